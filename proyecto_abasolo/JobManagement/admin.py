@@ -3,7 +3,7 @@ from django.contrib import admin
 from django.utils import timezone
 from django import forms
 
-from .models import Maquina, Proceso, Ruta, RutaPieza, TipoOT, SituacionOT, OrdenTrabajo, EmpresaOT, RutaOT, ItemRuta, ProgramaOrdenTrabajo, ProgramaProduccion
+from .models import Maquina, Proceso, Ruta, RutaPieza, TipoOT, SituacionOT, OrdenTrabajo, EmpresaOT, RutaOT, ItemRuta, ProgramaOrdenTrabajo, ProgramaProduccion, TiempoPreparacion
 
 from .forms import ProgramaOrdenTrabajoAdminForm
 # Register your models here.
@@ -128,6 +128,12 @@ class EmpresaOTAdmin(admin.ModelAdmin):
     search_fields = ('nombre', 'nombre_fantasia', 'codigo_empresa')
 
 
+@admin.register(TiempoPreparacion)
+class TiempoPreparacionAdmin(admin.ModelAdmin):
+    list_display = ('maquina', 'proceso_anterior', 'proceso_siguiente', 'familia_anterior', 'familia_siguiente', 'minutos')
+    list_filter = ('maquina',)
+
+
 admin.site.register(Maquina, MaquinaAdmin)
 admin.site.register(RutaOT, RutaOTAdmin)
 admin.site.register(ItemRuta)
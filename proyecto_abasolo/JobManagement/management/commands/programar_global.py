@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from JobManagement.models import ProgramaProduccion
+from JobManagement.views_files.program_views import ProgramDetailView
+
+
+class Command(BaseCommand):
+    help = 'Programa juntos los programas activos sobre una línea de tiempo compartida por máquina'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--programa_id',
+            type=int,
+            action='append',
+            help='ID de programa a incluir (se puede repetir; por defecto todos los activos)'
+        )
+
+    def handle(self, *args, **options):
+        programa_ids = options['programa_id']
+        programas = None
+        if programa_ids:
+            programas = list(ProgramaProduccion.objects.filter(id__in=programa_ids))
+            faltantes = set(programa_ids) - {programa.id for programa in programas}
+            if faltantes:
+                raise CommandError(f"Programas no encontrados: {sorted(faltantes)}")
+
+        resultado = ProgramDetailView().generar_programacion_global(programas)
+        for programa in ProgramaProduccion.objects.filter(id__in=resultado).order_by('fecha_inicio', 'id'):
+            self.stdout.write(f"Programa {programa.id} ({programa.nombre}): {programa.fecha_inicio} -> {programa.fecha_fin}")
+        self.stdout.write(self.style.SUCCESS(f"Programación global guardada para {len(resultado)} programas"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from JobManagement.services.machine_occupancy import MachineOccupancyService
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye o verifica la ocupación diaria guardada de las máquinas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--maquina_id',
+            type=int,
+            action='append',
+            help='ID de máquina a procesar (se puede repetir; por defecto todas)'
+        )
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo comparar la ocupación guardada con la calculada, sin modificarla'
+        )
+
+    def handle(self, *args, **options):
+        servicio = MachineOccupancyService()
+        maquina_ids = options['maquina_id']
+
+        if options['verificar']:
+            diferencias = servicio.verificar_consistencia(maquina_ids)
+            for diferencia in diferencias:
+                self.stdout.write(
+                    f"Máquina {diferencia['maquina_id']} {diferencia['fecha']}: "
+                    f"guardado {diferencia['guardado']} / calculado {diferencia['calculado']}"
+                )
+            if diferencias:
+                self.stdout.write(self.style.WARNING(f"{len(diferencias)} diferencias encontradas"))
+            else:
+                self.stdout.write(self.style.SUCCESS("La ocupación guardada está al día"))
+            return
+
+        if maquina_ids:
+            total = servicio.actualizar(maquina_ids)
+        else:
+            total = servicio.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f"Ocupación reconstruida: {total} registros máquina-día"))
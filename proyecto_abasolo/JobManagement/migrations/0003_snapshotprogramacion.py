@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JobManagement', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotProgramacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('fecha_fin', models.DateField(blank=True, null=True)),
+                ('datos', models.JSONField(blank=True, null=True)),
+                ('vigente', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('programa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='JobManagement.programaproduccion')),
+            ],
+            options={
+                'verbose_name': 'Snapshot de Programación',
+                'verbose_name_plural': 'Snapshots de Programación',
+                'ordering': ['programa', '-version'],
+                'unique_together': {('programa', 'version')},
+            },
+        ),
+    ]
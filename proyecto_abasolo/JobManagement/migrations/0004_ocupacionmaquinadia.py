@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JobManagement', '0003_snapshotprogramacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionMaquinaDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('minutos_reservados', models.FloatField(default=0)),
+                ('minutos_bloqueados', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('maquina', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacion_diaria', to='JobManagement.maquina')),
+            ],
+            options={
+                'verbose_name': 'Ocupación de Máquina por Día',
+                'verbose_name_plural': 'Ocupación de Máquinas por Día',
+                'ordering': ['maquina', 'fecha'],
+                'unique_together': {('maquina', 'fecha')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JobManagement', '0004_ocupacionmaquinadia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='programaproduccion',
+            name='lote_transferencia',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JobManagement', '0005_programaproduccion_lote_transferencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='programaproduccion',
+            name='maquinas_paralelas',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
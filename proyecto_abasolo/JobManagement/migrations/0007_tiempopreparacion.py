@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JobManagement', '0006_programaproduccion_maquinas_paralelas'),
+        ('Product', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='programaproduccion',
+            name='agrupar_preparaciones',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TiempoPreparacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minutos', models.PositiveIntegerField()),
+                ('familia_anterior', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Product.familiaproducto')),
+                ('familia_siguiente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Product.familiaproducto')),
+                ('maquina', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tiempos_preparacion', to='JobManagement.maquina')),
+                ('proceso_anterior', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='JobManagement.proceso')),
+                ('proceso_siguiente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='JobManagement.proceso')),
+            ],
+            options={
+                'verbose_name': 'Tiempo de Preparación',
+                'verbose_name_plural': 'Tiempos de Preparación',
+                'unique_together': {('maquina', 'proceso_anterior', 'proceso_siguiente', 'familia_anterior', 'familia_siguiente')},
+            },
+        ),
+    ]
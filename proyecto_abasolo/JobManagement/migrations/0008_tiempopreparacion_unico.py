@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:43
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JobManagement', '0007_tiempopreparacion'),
+        ('Product', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='tiempopreparacion',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='tiempopreparacion',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('maquina', 0), django.db.models.functions.comparison.Coalesce('proceso_anterior', 0), django.db.models.functions.comparison.Coalesce('proceso_siguiente', 0), django.db.models.functions.comparison.Coalesce('familia_anterior', 0), django.db.models.functions.comparison.Coalesce('familia_siguiente', 0), name='tiempo_preparacion_unico', violation_error_message='Ya existe un tiempo de preparación para esta máquina y este par de procesos y familias.'),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -28,20 +29,21 @@ class Maquina(models.Model):
         return f'{self.codigo_maquina} - {self.descripcion}'
     
     def get_disponibilidad_fecha(self, fecha):
-        """Obtiene la disponibilidad para una fecha específica"""
+        """Obtiene la disponibilidad para una fecha específica (sin crearla si no existe)"""
         from Machine.models import DisponibilidadMaquina
-        return DisponibilidadMaquina.objects.get_or_create(
-            maquina=self,
-            fecha=fecha
-        )[0]
+        disponibilidad = DisponibilidadMaquina.objects.filter(maquina=self, fecha=fecha).first()
+        return disponibilidad or DisponibilidadMaquina(maquina=self, fecha=fecha)
     
     def validar_disponibilidad(self, fecha, cantidad, estandar):
         """Valida si la máquina puede aceptar más carga en una fecha"""
         disponibilidad = self.get_disponibilidad_fecha(fecha)
-        estado = self.estado
+        estado = getattr(self, 'estadomaquina', None)
         
         if not disponibilidad.disponible:
             return False, "Máquina no disponible en esta fecha"
+
+        if estado is None or estado.capacidad_hora is None:
+            return False, "Máquina sin capacidad configurada"
         
         horas_efectivas = disponibilidad.get_horas_efectivas()
         capacidad_dia = estado.get_capacidad_real() * horas_efectivas
@@ -54,57 +56,9 @@ class Maquina(models.Model):
         return True, "Máquina disponible"
     
     def calcular_carga_fecha(self, fecha):
-        """Calcula la carga total para una fecha específica basada en ItemRuta"""
-        from datetime import datetime, time
-        inicio_dia = datetime.combine(fecha, time.min)
-        fin_dia = datetime.combine(fecha, time.max)
-        
-        # Obtener todos los ItemRuta que usan esta máquina en la fecha
-        items_ruta = ItemRuta.objects.filter(
-            maquina=self,
-            ruta_ot__programa__fecha_inicio__lte=fecha,
-            ruta_ot__programa__fecha_fin__gte=fecha
-        ).select_related(
-            'ruta_ot__programa',
-            'ruta_ot__orden_trabajo'
-        )
-
-        carga_total = 0
-        for item in items_ruta:
-            # Validar si el proceso está programado para esta fecha
-            if self.proceso_programado_para_fecha(item, fecha):
-                # Calcular carga basada en cantidad y estándar
-                carga_total += item.cantidad / item.estandar if item.estandar else 0
-                
-        return carga_total
-
-    def proceso_programado_para_fecha(self, item_ruta, fecha):
-        """Determina si un proceso está programado para una fecha específica"""
-        programa = item_ruta.ruta_ot.programa
-        
-        # Si tenemos fechas específicas en el timeline
-        timeline = programa.timeline_set.filter(
-            item_ruta=item_ruta,
-            fecha=fecha
-        ).exists()
-        
-        if timeline:
-            return True
-            
-        # Si no hay timeline específico, usar lógica de programación general
-        orden_trabajo = item_ruta.ruta_ot.orden_trabajo
-        prioridad = orden_trabajo.programaordentrabajo_set.filter(
-            programa=programa
-        ).first()
-        
-        if not prioridad:
-            return False
-            
-        # Aquí podrías implementar la lógica para determinar si,
-        # basado en la prioridad y la secuencia de procesos,
-        # este proceso debería estar activo en esta fecha
-        
-        return False  # Por defecto, ser conservador
+        """Carga (horas reservadas) de la máquina en la fecha, leída de la ocupación guardada"""
+        ocupacion = OcupacionMaquinaDia.objects.filter(maquina=self, fecha=fecha).first()
+        return ocupacion.minutos_reservados / 60 if ocupacion else 0
 
 class Proceso(models.Model):
     codigo_proceso = models.CharField(max_length=10, null=False, blank=False, unique=False)
@@ -268,6 +222,13 @@ class ProgramaProduccion(models.Model):
     #Fecha de inicio será determinada por la fecha de la ot en primera posición, y la fecha de fin se determinará por el cálculo de cuando termine el último proceso de la ultima ot
     fecha_inicio = models.DateField()
     fecha_fin = models.DateField()
+    # Unidades por lote de transferencia: un proceso puede comenzar cuando el anterior entregó
+    # el primer lote. Vacío = cada proceso espera el término del anterior
+    lote_transferencia = models.PositiveIntegerField(null=True, blank=True)
+    # Máximo de máquinas compatibles entre las que se puede dividir un proceso largo (1 = sin división)
+    maquinas_paralelas = models.PositiveSmallIntegerField(default=1)
+    # Reordenar OTs cercanas en prioridad para reducir los setups (agrupar familias de producto)
+    agrupar_preparaciones = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
     creado_por = models.ForeignKey(
@@ -763,4 +724,280 @@ class ReporteSupervisor(models.Model):
                     programa=instance,
                     supervisor=supervisor,
                     estado='ACTIVO'
-                )
\ No newline at end of file
+                )
+
+
+class SnapshotProgramacion(models.Model):
+    """
+    Programación calculada (timeline y OTs formateadas) guardada por versión para cada programa.
+    Se invalida cuando cambian las OTs, procesos o asignaciones del programa, y se regenera en
+    la siguiente lectura.
+    """
+    MAX_VERSIONES = 5  # Versiones guardadas por programa
+    MAX_INTENTOS_RESERVA = 5  # Reintentos si dos lecturas simultáneas reservan la misma versión
+
+    programa = models.ForeignKey(ProgramaProduccion, on_delete=models.CASCADE, related_name='snapshots')
+    version = models.PositiveIntegerField()
+    fecha_fin = models.DateField(null=True, blank=True)
+    datos = models.JSONField(null=True, blank=True)
+    vigente = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Snapshot de Programación'
+        verbose_name_plural = 'Snapshots de Programación'
+        unique_together = ['programa', 'version']
+        ordering = ['programa', '-version']
+
+    def __str__(self):
+        return f'{self.programa.nombre} - v{self.version}'
+
+    @classmethod
+    def obtener_vigente(cls, programa):
+        """Última versión vigente y completa de la programación, o None"""
+        return cls.objects.filter(
+            programa=programa,
+            vigente=True,
+            datos__isnull=False
+        ).order_by('-version').first()
+
+    @classmethod
+    def obtener_ultima(cls, programa):
+        """Última versión completa de la programación, vigente o no, o None"""
+        return cls.objects.filter(
+            programa=programa,
+            datos__isnull=False
+        ).order_by('-version').first()
+
+    @classmethod
+    def reservar_version(cls, programa):
+        """
+        Crea la siguiente versión vacía antes de calcular. Si el programa se invalida mientras se
+        calcula, la reserva queda no vigente y el resultado no se guarda. Si otra lectura
+        simultánea reservó el mismo número, se reintenta con el siguiente.
+        """
+        for intento in range(cls.MAX_INTENTOS_RESERVA):
+            ultima = cls.objects.filter(programa=programa).aggregate(models.Max('version'))['version__max'] or 0
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(programa=programa, version=ultima + 1)
+            except IntegrityError:
+                if intento == cls.MAX_INTENTOS_RESERVA - 1:
+                    raise
+
+    def completar(self, datos, fecha_fin):
+        """Guarda el resultado calculado; retorna False si la versión fue invalidada entretanto"""
+        actualizados = SnapshotProgramacion.objects.filter(pk=self.pk, vigente=True).update(
+            datos=datos,
+            fecha_fin=fecha_fin,
+            updated_at=timezone.now()
+        )
+        if not actualizados:
+            SnapshotProgramacion.objects.filter(pk=self.pk).delete()
+            return False
+
+        # Mantener solo las últimas versiones
+        SnapshotProgramacion.objects.filter(
+            programa_id=self.programa_id,
+            version__lte=self.version - self.MAX_VERSIONES
+        ).delete()
+        return True
+
+    @classmethod
+    def invalidar(cls, programa_ids):
+        """Marca como no vigentes las versiones de los programas indicados"""
+        return cls.objects.filter(programa_id__in=programa_ids, vigente=True).update(vigente=False)
+
+
+@receiver([post_save, post_delete], sender=ProgramaOrdenTrabajo)
+def invalidar_snapshot_programa_ot(sender, instance, **kwargs):
+    SnapshotProgramacion.invalidar([instance.programa_id])
+
+
+@receiver([post_save, post_delete], sender=ItemRuta)
+def invalidar_snapshot_item_ruta(sender, instance, **kwargs):
+    programa_ids = ProgramaOrdenTrabajo.objects.filter(
+        orden_trabajo__ruta_ot__id=instance.ruta_id
+    ).values_list('programa_id', flat=True)
+    SnapshotProgramacion.invalidar(list(programa_ids))
+
+
+@receiver([post_save, post_delete], sender='Operator.AsignacionOperador')
+def invalidar_snapshot_asignacion(sender, instance, **kwargs):
+    SnapshotProgramacion.invalidar([instance.programa_id])
+
+
+@receiver([post_save, post_delete], sender=TareaFragmentada)
+def invalidar_snapshot_continuacion(sender, instance, **kwargs):
+    # Las continuaciones aparecen en el timeline
+    if instance.es_continuacion:
+        SnapshotProgramacion.invalidar([instance.programa_id])
+
+
+@receiver(post_save, sender=ProgramaProduccion)
+def invalidar_snapshot_programa(sender, instance, created, update_fields=None, **kwargs):
+    # Guardar solo la fecha_fin calculada no cambia la programación
+    if not created and set(update_fields or []) != {'fecha_fin'}:
+        SnapshotProgramacion.invalidar([instance.id])
+
+
+class OcupacionMaquinaDia(models.Model):
+    """
+    Ocupación guardada de cada máquina por día: minutos reservados por procesos en programa y
+    minutos bloqueados por intervalos y mantenimientos. Se mantiene al día con señales y puede
+    reconstruirse con el comando reconstruir_ocupacion_maquinas.
+    """
+    maquina = models.ForeignKey(Maquina, on_delete=models.CASCADE, related_name='ocupacion_diaria')
+    fecha = models.DateField()
+    minutos_reservados = models.FloatField(default=0)
+    minutos_bloqueados = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Ocupación de Máquina por Día'
+        verbose_name_plural = 'Ocupación de Máquinas por Día'
+        unique_together = ['maquina', 'fecha']
+        ordering = ['maquina', 'fecha']
+
+    def __str__(self):
+        return f'{self.maquina.codigo_maquina} - {self.fecha}: {self.minutos_reservados:.0f} min'
+
+
+def _actualizar_ocupacion(maquina_ids):
+    from .services.machine_occupancy import programar_actualizacion
+    programar_actualizacion(maquina_ids)
+
+
+def _maquinas_de_ot(orden_trabajo_ids):
+    return ItemRuta.objects.filter(
+        ruta__orden_trabajo_id__in=orden_trabajo_ids
+    ).values_list('maquina_id', flat=True).distinct()
+
+
+@receiver(pre_save, sender=ItemRuta)
+def registrar_maquina_anterior(sender, instance, **kwargs):
+    # Si el proceso cambia de máquina, ambas máquinas deben recalcularse
+    if instance.pk:
+        instance._maquina_anterior_id = ItemRuta.objects.filter(
+            pk=instance.pk
+        ).values_list('maquina_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=ItemRuta)
+def ocupacion_item_ruta(sender, instance, **kwargs):
+    _actualizar_ocupacion([instance.maquina_id, getattr(instance, '_maquina_anterior_id', None)])
+
+
+@receiver([post_save, post_delete], sender=ProgramaOrdenTrabajo)
+def ocupacion_programa_ot(sender, instance, **kwargs):
+    _actualizar_ocupacion(_maquinas_de_ot([instance.orden_trabajo_id]))
+
+
+@receiver(post_save, sender=ProgramaProduccion)
+def ocupacion_programa(sender, instance, created, update_fields=None, **kwargs):
+    # La ocupación depende de la fecha de inicio del programa
+    if not created and set(update_fields or []) != {'fecha_fin'}:
+        _actualizar_ocupacion(_maquinas_de_ot(
+            ProgramaOrdenTrabajo.objects.filter(programa=instance).values_list('orden_trabajo_id', flat=True)
+        ))
+
+
+@receiver([post_save, post_delete], sender='Operator.AsignacionOperador')
+def ocupacion_asignacion(sender, instance, **kwargs):
+    _actualizar_ocupacion(ItemRuta.objects.filter(pk=instance.item_ruta_id).values_list('maquina_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=IntervaloMaquina)
+def ocupacion_intervalo_maquina(sender, instance, **kwargs):
+    _actualizar_ocupacion([instance.maquina_id])
+
+
+@receiver([post_save, post_delete], sender='Machine.MantenimientoMaquina')
+def ocupacion_mantenimiento(sender, instance, **kwargs):
+    _actualizar_ocupacion([instance.maquina_id])
+
+
+def _invalidar_mapa_calor():
+    from .services.machine_load import invalidar_mapa_calor
+    invalidar_mapa_calor()
+
+
+@receiver([post_save, post_delete], sender=TareaFragmentada)
+@receiver([post_save, post_delete], sender=ItemRuta)
+@receiver([post_save, post_delete], sender='Machine.EstadoMaquina')
+@receiver([post_save, post_delete], sender='Machine.DisponibilidadMaquina')
+@receiver([post_save, post_delete], sender='Machine.BloqueoMaquina')
+def invalidar_mapa_calor_maquinas(sender, instance, **kwargs):
+    # La carga y la capacidad de las máquinas cambiaron: los mapas de calor en caché ya no sirven
+    _invalidar_mapa_calor()
+
+
+def _programas_con_maquina(maquina_id):
+    return list(ProgramaOrdenTrabajo.objects.filter(
+        orden_trabajo__ruta_ot__items__maquina_id=maquina_id
+    ).values_list('programa_id', flat=True).distinct())
+
+
+@receiver([post_save, post_delete], sender=IntervaloMaquina)
+@receiver([post_save, post_delete], sender='Machine.EstadoMaquina')
+@receiver([post_save, post_delete], sender='Machine.DisponibilidadMaquina')
+@receiver([post_save, post_delete], sender='Machine.MantenimientoMaquina')
+def invalidar_snapshot_calendario_maquina(sender, instance, **kwargs):
+    # El calendario de la máquina cambió: los programas que la usan deben reprogramarse
+    SnapshotProgramacion.invalidar(_programas_con_maquina(instance.maquina_id))
+
+
+@receiver([post_save, post_delete], sender='Machine.BloqueoMaquina')
+def invalidar_snapshot_bloqueo_maquina(sender, instance, **kwargs):
+    from Machine.models import DisponibilidadMaquina
+    maquina_id = DisponibilidadMaquina.objects.filter(
+        pk=instance.disponibilidad_id
+    ).values_list('maquina_id', flat=True).first()
+    if maquina_id:
+        SnapshotProgramacion.invalidar(_programas_con_maquina(maquina_id))
+
+
+class TiempoPreparacion(models.Model):
+    """
+    Tiempo de preparación (cambio) de una máquina entre dos operaciones consecutivas, según el
+    par (anterior, siguiente) de procesos y/o de familias de producto. Los campos vacíos actúan
+    como comodín: una fila sin máquina vale para todas y una fila sin pares es el setup por
+    defecto de la máquina. Al programar se usa la fila más específica que calce.
+    """
+    maquina = models.ForeignKey(Maquina, on_delete=models.CASCADE, null=True, blank=True, related_name='tiempos_preparacion')
+    proceso_anterior = models.ForeignKey(Proceso, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    proceso_siguiente = models.ForeignKey(Proceso, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    familia_anterior = models.ForeignKey('Product.FamiliaProducto', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    familia_siguiente = models.ForeignKey('Product.FamiliaProducto', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    minutos = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = 'Tiempo de Preparación'
+        verbose_name_plural = 'Tiempos de Preparación'
+        constraints = [
+            # Los campos vacíos son comodines y dos filas con los mismos comodines se repiten. Se
+            # compara con Coalesce en vez de nulls_distinct=False porque SQLite no lo soporta
+            # (no crearía la restricción)
+            models.UniqueConstraint(
+                *(
+                    Coalesce(campo, 0)
+                    for campo in ('maquina', 'proceso_anterior', 'proceso_siguiente', 'familia_anterior', 'familia_siguiente')
+                ),
+                name='tiempo_preparacion_unico',
+                violation_error_message='Ya existe un tiempo de preparación para esta máquina y este par de procesos y familias.'
+            )
+        ]
+
+    def __str__(self):
+        maquina = self.maquina.codigo_maquina if self.maquina else 'Todas'
+        return f'{maquina}: {self.minutos} min'
+
+
+@receiver([post_save, post_delete], sender=TiempoPreparacion)
+def invalidar_snapshot_tiempo_preparacion(sender, instance, **kwargs):
+    # Cambian los setups entre operaciones: reprogramar los programas que usan la máquina (o todos)
+    if instance.maquina_id:
+        SnapshotProgramacion.invalidar(_programas_con_maquina(instance.maquina_id))
+    else:
+        SnapshotProgramacion.invalidar(list(ProgramaProduccion.objects.values_list('id', flat=True)))
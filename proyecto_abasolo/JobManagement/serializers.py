@@ -208,7 +208,7 @@ class ProgramaProduccionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ProgramaProduccion
-        fields = ['id', 'nombre', 'fecha_inicio', 'fecha_fin', 'created_at', 'updated_at', 'ordenes_trabajo']
+        fields = ['id', 'nombre', 'fecha_inicio', 'fecha_fin', 'lote_transferencia', 'maquinas_paralelas', 'agrupar_preparaciones', 'created_at', 'updated_at', 'ordenes_trabajo']
 
     def get_ordenes_trabajo(self, obj):
         ordenes_trabajo = ProgramaOrdenTrabajo.objects.filter(programa=obj).select_related('orden_trabajo').order_by('prioridad')
@@ -0,0 +1,128 @@
+from bisect import bisect_left, bisect_right
+
+
+class MachineIntervalIndex:
+    """
+    Índice en memoria de los intervalos ocupados de una máquina.
+
+    Guarda los intervalos ordenados por inicio junto con el máximo acumulado de sus términos,
+    lo que permite encontrar el primer intervalo que se traslapa con un rango mediante búsqueda
+    binaria. Además mantiene la ocupación fusionada (bloques disjuntos) y un árbol de máximos
+    sobre los huecos entre bloques para responder "siguiente hueco libre de N minutos" en
+    O(log n).
+    """
+
+    def __init__(self, intervalos, clave_orden=None):
+        """
+        intervalos: lista de dicts con al menos 'inicio' y 'fin' (el resto se devuelve tal cual).
+        clave_orden: orden de desempate entre intervalos con el mismo inicio.
+        """
+        self.intervalos = sorted(
+            (i for i in intervalos if i['inicio'] < i['fin']),
+            key=clave_orden or (lambda i: i['inicio'])
+        )
+        self.inicios = [i['inicio'] for i in self.intervalos]
+
+        # fin_maximo[k] = mayor término entre los intervalos 0..k (no decreciente)
+        self.fin_maximo = []
+        maximo = None
+        for intervalo in self.intervalos:
+            maximo = intervalo['fin'] if maximo is None else max(maximo, intervalo['fin'])
+            self.fin_maximo.append(maximo)
+
+        self._fusionar()
+
+    def __len__(self):
+        return len(self.intervalos)
+
+    # ------------------------------------------------------------------
+    # Ocupación fusionada y árbol de huecos
+    # ------------------------------------------------------------------
+    def _fusionar(self):
+        bloques = []
+        for intervalo in sorted(self.intervalos, key=lambda i: i['inicio']):
+            if bloques and intervalo['inicio'] <= bloques[-1][1]:
+                if intervalo['fin'] > bloques[-1][1]:
+                    bloques[-1][1] = intervalo['fin']
+            else:
+                bloques.append([intervalo['inicio'], intervalo['fin']])
+
+        self.bloques_inicio = [b[0] for b in bloques]
+        self.bloques_fin = [b[1] for b in bloques]
+
+        # huecos[k] = duración libre entre el bloque k y el k+1
+        huecos = [
+            self.bloques_inicio[k + 1] - self.bloques_fin[k]
+            for k in range(len(bloques) - 1)
+        ]
+        self._n_huecos = len(huecos)
+        tamano = 1
+        while tamano < max(self._n_huecos, 1):
+            tamano *= 2
+        self._tamano = tamano
+        self._arbol = [None] * (2 * tamano)
+        for k, hueco in enumerate(huecos):
+            self._arbol[tamano + k] = hueco
+        for nodo in range(tamano - 1, 0, -1):
+            self._arbol[nodo] = self._max(self._arbol[2 * nodo], self._arbol[2 * nodo + 1])
+
+    @staticmethod
+    def _max(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return a if a >= b else b
+
+    def _primer_hueco(self, desde, duracion, nodo=1, izquierda=0, derecha=None):
+        """Índice del primer hueco k >= desde con duración >= duracion (o None)"""
+        if derecha is None:
+            derecha = self._tamano
+        if derecha <= desde or self._arbol[nodo] is None or self._arbol[nodo] < duracion:
+            return None
+        if derecha - izquierda == 1:
+            return izquierda
+        medio = (izquierda + derecha) // 2
+        encontrado = self._primer_hueco(desde, duracion, 2 * nodo, izquierda, medio)
+        if encontrado is None:
+            encontrado = self._primer_hueco(desde, duracion, 2 * nodo + 1, medio, derecha)
+        return encontrado
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def primer_conflicto(self, inicio, fin):
+        """Primer intervalo (en orden del índice) que se traslapa con [inicio, fin), o None"""
+        # Solo pueden traslaparse los intervalos que comienzan antes de 'fin'
+        limite = bisect_left(self.inicios, fin)
+        # El primero cuyo término supera 'inicio' es donde el máximo acumulado lo supera
+        k = bisect_right(self.fin_maximo, inicio, 0, limite)
+        return self.intervalos[k] if k < limite else None
+
+    def tiene_conflicto(self, inicio, fin):
+        return self.primer_conflicto(inicio, fin) is not None
+
+    def siguiente_libre(self, desde):
+        """Primer instante >= desde que no está ocupado"""
+        k = bisect_right(self.bloques_inicio, desde) - 1
+        if k >= 0 and desde < self.bloques_fin[k]:
+            return self.bloques_fin[k]
+        return desde
+
+    def siguiente_hueco(self, desde, duracion):
+        """Primer instante >= desde a partir del cual la máquina queda libre durante 'duracion'"""
+        k = bisect_right(self.bloques_inicio, desde) - 1
+        if k >= 0 and desde < self.bloques_fin[k]:
+            # 'desde' cae dentro del bloque k: el hueco candidato empieza en su término
+            candidato = k
+        else:
+            siguiente = k + 1
+            if siguiente >= len(self.bloques_inicio) or self.bloques_inicio[siguiente] - desde >= duracion:
+                return desde
+            candidato = siguiente
+
+        if candidato < self._n_huecos:
+            hueco = self._primer_hueco(candidato, duracion)
+            if hueco is not None and hueco < self._n_huecos:
+                return self.bloques_fin[hueco]
+        return self.bloques_fin[-1]
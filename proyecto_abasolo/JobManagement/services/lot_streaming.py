@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def desfases_transferencia(cantidades, estandares, primeros, lotes):
+    """
+    Desfases de traslape por lotes de transferencia para operaciones de varias cadenas
+    (procesos de cada OT en orden de ruta, todas las cadenas concatenadas), en una sola pasada.
+
+    cantidades, estandares (unidades por hora) y lotes (unidades por lote que pasan de la
+    operación anterior a esta) son arreglos por operación; primeros marca la primera operación
+    de cada cadena. Para cada operación retorna, en minutos laborables:
+
+    - adelanto: desde el inicio de la operación anterior hasta que entrega su primer lote.
+    - cola: lo que la operación debe seguir trabajando después del término de la anterior
+      (procesar el último lote, que puede ser parcial, o menos si le quedan menos unidades).
+
+    Las operaciones sin traslape (primeras de su cadena, sin lote o con estándar inválido)
+    quedan con NaN y se programan término-inicio.
+    """
+    cantidades = np.asarray(cantidades, dtype=np.float64)
+    estandares = np.asarray(estandares, dtype=np.float64)
+    lotes = np.asarray(lotes, dtype=np.float64)
+    primeros = np.asarray(primeros, dtype=bool)
+
+    cantidad_anterior = np.roll(cantidades, 1)
+    estandar_anterior = np.roll(estandares, 1)
+    validos = (
+        ~primeros
+        & (lotes > 0)
+        & (estandares > 0)
+        & (estandar_anterior > 0)
+        & (cantidad_anterior > 0)
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lote = np.minimum(lotes, cantidad_anterior)
+        n_lotes = np.ceil(cantidad_anterior / lote - 1e-9)
+        ultimo_lote = cantidad_anterior - (n_lotes - 1) * lote
+        adelanto = np.ceil(lote * 60 / estandar_anterior - 1e-9)
+        cola = np.ceil(np.minimum(ultimo_lote, cantidades) * 60 / estandares - 1e-9)
+
+    return np.where(validos, adelanto, np.nan), np.where(validos, cola, np.nan)
+
+
+def inicios_cadena(duraciones, adelanto, cola):
+    """
+    Inicio de cada operación de una cadena (minutos laborables desde el inicio de la primera)
+    sin competencia por máquinas: cada una parte cuando llega el primer lote de la anterior, o
+    más tarde si así no alcanzaría a procesar el último lote; sin traslape, al término de la anterior.
+    """
+    duraciones = np.asarray(duraciones, dtype=np.float64)
+    if not duraciones.size:
+        return duraciones
+    anterior = np.roll(duraciones, 1)
+    desfase = np.where(
+        np.isnan(adelanto),
+        anterior,
+        np.maximum(adelanto, anterior + cola - duraciones)
+    )
+    desfase[0] = 0.0
+    return np.cumsum(desfase)
@@ -1,7 +1,12 @@
 from django.db import models
 from django.utils import timezone
 from datetime import datetime, timedelta, date
+import heapq
+import numpy as np
 from .time_calculations import TimeCalculator
+from .interval_index import MachineIntervalIndex
+from .machine_calendars import MachineCalendarService
+from .setup_times import MatrizPreparacion
 from JobManagement.models import ItemRuta, ProgramaOrdenTrabajo
 import logging
 import os
@@ -10,6 +15,7 @@ from pathlib import Path
 class MachineAvailabilityService:
     def __init__(self):
         self.time_calculator = TimeCalculator()
+        self.indices_maquina = {}  # maquina_id -> MachineIntervalIndex (se construyen una vez por corrida)
         self.setup_logger()
 
     def setup_logger(self):
@@ -41,70 +47,123 @@ class MachineAvailabilityService:
         # # Agregar el handler al logger
         # self.logger.addHandler(file_handler)
 
-    def obtener_intervalos_maquina(self, maquina, fecha_inicio, fecha_fin):
-        """Obtiene los intervalos de uso existentes para una máquina"""
-        self.logger.info(f"\nObteniendo intervalos para máquina {maquina.codigo_maquina}")
-        self.logger.info(f"Rango: {fecha_inicio} - {fecha_fin}")
-        
-        intervalos = []
-        
-        # Obtener intervalos existentes de la base de datos
-        asignaciones = ItemRuta.objects.filter(
-            maquina=maquina,
-            ruta__orden_trabajo__programaordentrabajo__isnull=False
-        ).select_related(
+    def _asignaciones_programadas(self, maquina=None, maquina_ids=None):
+        """ItemRuta de la(s) máquina(s) que pertenecen a alguna OT en programa, con su programa precargado"""
+        filtros = {'ruta__orden_trabajo__programaordentrabajo__isnull': False}
+        if maquina is not None:
+            filtros['maquina'] = maquina
+        elif maquina_ids is not None:
+            filtros['maquina_id__in'] = maquina_ids
+        return ItemRuta.objects.filter(**filtros).select_related(
             'ruta',
             'ruta__orden_trabajo',
             'proceso'
         ).prefetch_related(
-            'ruta__orden_trabajo__programaordentrabajo_set'
-        )
+            models.Prefetch(
+                'ruta__orden_trabajo__programaordentrabajo_set',
+                queryset=ProgramaOrdenTrabajo.objects.select_related('programa').order_by('id')
+            )
+        ).distinct()
 
+    def _calcular_ocupaciones(self, asignaciones):
+        """
+        Calcula en un solo lote la ocupación de cada asignación desde el inicio de su programa.
+        Retorna una lista de (asignacion, programa_ot, indice) y el resultado del cálculo por lote.
+        """
+        filas = []
         for asignacion in asignaciones:
-            programa_ot = asignacion.ruta.orden_trabajo.programaordentrabajo_set.first()
-            if not programa_ot:
+            programas_ot = asignacion.ruta.orden_trabajo.programaordentrabajo_set.all()
+            programa_ot = programas_ot[0] if programas_ot else None
+            if not programa_ot or not programa_ot.programa.fecha_inicio:
                 continue
+            filas.append((asignacion, programa_ot, len(filas)))
 
-            # Calcular el intervalo específico para este proceso
-            calculo_tiempo = self.time_calculator.calculate_working_days(
-                programa_ot.programa.fecha_inicio,
-                asignacion.cantidad_pedido,
-                asignacion.estandar
-            )
+        lote = self.time_calculator.calculate_working_days_batch(
+            [programa_ot.programa.fecha_inicio for _, programa_ot, _ in filas],
+            [asignacion.cantidad_pedido or 0 for asignacion, _, _ in filas],
+            [asignacion.estandar or 0 for asignacion, _, _ in filas]
+        )
+        return filas, lote
+
+    def _intervalos_por_maquina(self, asignaciones):
+        """Intervalos diarios de uso de cada asignación, agrupados por máquina"""
+        filas, lote = self._calcular_ocupaciones(asignaciones)
+        unidades_por_dia = lote['unidades_por_dia']
+        inicio_por_dia = lote['inicio_por_dia'].astype(datetime)
+        fin_por_dia = lote['fin_por_dia'].astype(datetime)
+
+        por_maquina = {}
+        for asignacion, programa_ot, i in filas:
+            if not lote['valido'][i]:
+                continue
+            intervalos = por_maquina.setdefault(asignacion.maquina_id, [])
+            for d in np.flatnonzero(unidades_por_dia[i] > 0):
+                intervalos.append({
+                    'inicio': inicio_por_dia[i, d],
+                    'fin': fin_por_dia[i, d],
+                    'ot': asignacion.ruta.orden_trabajo.codigo_ot,
+                    'proceso': asignacion.proceso,
+                    'prioridad': programa_ot.prioridad,
+                    'item_ruta': asignacion
+                })
+        return por_maquina
 
-            if 'error' not in calculo_tiempo and calculo_tiempo['intervals']:
-                for intervalo in calculo_tiempo['intervals']:
-                    intervalos.append({
-                        'inicio': intervalo['fecha_inicio'],
-                        'fin': intervalo['fecha_fin'],
-                        'ot': asignacion.ruta.orden_trabajo.codigo_ot,
-                        'proceso': asignacion.proceso,
-                        'prioridad': programa_ot.prioridad,
-                        'item_ruta': asignacion
-                    })
+    def obtener_intervalos_maquina(self, maquina, fecha_inicio, fecha_fin):
+        """Obtiene los intervalos de uso existentes para una máquina"""
+        self.logger.info(f"\nObteniendo intervalos para máquina {maquina.codigo_maquina}")
+        self.logger.info(f"Rango: {fecha_inicio} - {fecha_fin}")
 
+        # Obtener intervalos existentes de la base de datos y calcularlos en un solo lote
+        intervalos = self._intervalos_por_maquina(self._asignaciones_programadas(maquina)).get(maquina.id, [])
         return sorted(intervalos, key=lambda x: (x['inicio'], x['prioridad']))
 
+    def construir_indices(self, maquina_ids=None):
+        """
+        Construye (una vez por corrida) el índice de intervalos de las máquinas indicadas, o de
+        todas las que tienen asignaciones en programa, con una sola consulta y un solo cálculo
+        por lote. Los índices quedan disponibles para verificar_conflicto y los demás llamadores.
+        """
+        if maquina_ids is not None:
+            maquina_ids = [m for m in set(maquina_ids) if m is not None and m not in self.indices_maquina]
+            if not maquina_ids:
+                return self.indices_maquina
+
+        por_maquina = self._intervalos_por_maquina(self._asignaciones_programadas(maquina_ids=maquina_ids))
+        for maquina_id in (maquina_ids if maquina_ids is not None else por_maquina.keys()):
+            self.indices_maquina[maquina_id] = MachineIntervalIndex(
+                por_maquina.get(maquina_id, []),
+                clave_orden=lambda x: (x['inicio'], x['prioridad'])
+            )
+        return self.indices_maquina
+
+    def indice_maquina(self, maquina):
+        """Índice de intervalos de la máquina (se construye la primera vez que se pide)"""
+        if maquina.id not in self.indices_maquina:
+            self.construir_indices([maquina.id])
+        return self.indices_maquina[maquina.id]
+
+    def invalidar_indices(self):
+        """Descarta los índices construidos (p.ej. al cambiar las asignaciones durante la corrida)"""
+        self.indices_maquina = {}
+
     def verificar_conflicto(self, maquina, fecha_inicio, fecha_fin, prioridad_actual):
         """Verifica si hay conflicto y retorna información del conflicto"""
         self.logger.info(f"\nVerificando conflictos para máquina {maquina.codigo_maquina}")
         self.logger.info(f"Intervalo a verificar: {fecha_inicio} - {fecha_fin}")
         self.logger.info(f"Prioridad actual: {prioridad_actual}")
 
-        intervalos = self.obtener_intervalos_maquina(maquina, fecha_inicio, fecha_fin)
-        
-        for intervalo in intervalos:
-            if (fecha_inicio < intervalo['fin'] and fecha_fin > intervalo['inicio']):
-                self.logger.warning(f"Conflicto detectado con OT {intervalo['ot']}")
-                self.logger.warning(f"Prioridad del conflicto: {intervalo['prioridad']}")
-                
-                return {
-                    'tiene_conflicto': True,
-                    'con_mayor_prioridad': intervalo['prioridad'] <= prioridad_actual,
-                    'fecha_disponible': intervalo['fin'] + timedelta(minutes=30),
-                    'intervalo_conflicto': intervalo
-                }
-        
+        intervalo = self.indice_maquina(maquina).primer_conflicto(fecha_inicio, fecha_fin)
+        if intervalo:
+            self.logger.warning(f"Conflicto detectado con OT {intervalo['ot']}")
+            self.logger.warning(f"Prioridad del conflicto: {intervalo['prioridad']}")
+
+            return {
+                'tiene_conflicto': True,
+                'con_mayor_prioridad': intervalo['prioridad'] <= prioridad_actual,
+                'fecha_disponible': intervalo['fin'] + timedelta(minutes=30),
+                'intervalo_conflicto': intervalo
+            }
+
         self.logger.info("No se detectaron conflictos")
         return {
             'tiene_conflicto': False,
@@ -112,60 +171,150 @@ class MachineAvailabilityService:
         }
 
     def obtener_ajustes_necesarios(self, programa):
-        """Obtiene los ajustes necesarios para un programa"""
+        """
+        Obtiene los ajustes necesarios para un programa en una sola pasada (barrido por tiempo).
+
+        Las operaciones del programa se recorren en orden de disponibilidad (y prioridad en
+        empates) con una cola de prioridad. Para cada máquina se mantienen ordenadas las
+        reservas de otros programas (bloques fusionados) y un puntero que solo avanza, además
+        del instante en que la máquina queda libre por las operaciones del propio programa.
+        Una operación que no puede comenzar cuando queda lista se propone como ajuste. Los
+        setups y calendarios son los de la programación: MatrizPreparacion según la secuencia de
+        cada máquina y el calendario propio de la máquina (bloqueos, mantenciones).
+        """
         self.logger.info(f"\nObteniendo ajustes para programa {programa.id}")
-        
-        ajustes = []
-        ordenes = ProgramaOrdenTrabajo.objects.filter(
+
+        ordenes = list(ProgramaOrdenTrabajo.objects.filter(
             programa=programa
         ).select_related(
             'orden_trabajo',
             'orden_trabajo__ruta_ot'
         ).prefetch_related(
-            'orden_trabajo__ruta_ot__items__maquina',
-            'orden_trabajo__ruta_ot__items__proceso'
-        ).order_by('prioridad')
+            models.Prefetch(
+                'orden_trabajo__ruta_ot__items',
+                queryset=ItemRuta.objects.select_related('maquina', 'proceso').order_by('item')
+            )
+        ).order_by('prioridad'))
 
+        # Operaciones de cada OT en orden de ruta
+        cadenas = []
         for prog_ot in ordenes:
-            fecha_actual = programa.fecha_inicio
-            
-            for item_ruta in prog_ot.orden_trabajo.ruta_ot.items.all().order_by('item'):
-                if not item_ruta.maquina or not item_ruta.estandar:
-                    continue
+            ruta = getattr(prog_ot.orden_trabajo, 'ruta_ot', None)
+            if ruta is None:
+                continue
+            items = [item for item in ruta.items.all() if item.maquina_id and item.estandar]
+            if items:
+                cadenas.append((prog_ot, items))
+
+        # Reservas de otros programas en las máquinas involucradas (índice por máquina)
+        maquina_ids = {item.maquina_id for _, items in cadenas for item in items}
+        ajenas = self._intervalos_por_maquina(
+            self._asignaciones_programadas(maquina_ids=maquina_ids).exclude(
+                ruta__orden_trabajo__programaordentrabajo__programa=programa
+            )
+        )
+        indices = {
+            maquina_id: MachineIntervalIndex(
+                ajenas.get(maquina_id, []),
+                clave_orden=lambda x: (x['inicio'], x['prioridad'])
+            )
+            for maquina_id in maquina_ids
+        }
+        punteros = dict.fromkeys(maquina_ids, 0)
+        maquina_libre = {}  # maquina_id -> (fin, OT) de la última operación del programa
+
+        fecha_inicio = programa.fecha_inicio
+        if not isinstance(fecha_inicio, datetime):
+            fecha_inicio = datetime.combine(fecha_inicio, self.time_calculator.WORKDAY_START)
+        # Calendario propio de cada máquina y setups según la secuencia, como en la programación
+        calendarios = MachineCalendarService().calendarios(maquina_ids, fecha_inicio)
+        preparaciones = MatrizPreparacion.cargar(
+            {item.id for _, items in cadenas for item in items}, maquina_ids
+        )
+        espera = timedelta(minutes=preparaciones.minutos_defecto)
+        ultima_operacion = {}  # maquina_id -> clave de la última operación del programa
+
+        # Los inicios propuestos se llevan siempre al siguiente instante laborable
+        calendario = self.time_calculator.get_calendar()
+        fecha_inicio = calendario.ajustar_inicio(fecha_inicio)
 
-                # Calcular duración del proceso
+        # Cola de operaciones listas: (instante en que queda lista, prioridad, índice OT, posición)
+        listos = [
+            (fecha_inicio, prog_ot.prioridad if prog_ot.prioridad is not None else float('inf'), indice, 0)
+            for indice, (prog_ot, _) in enumerate(cadenas)
+        ]
+        heapq.heapify(listos)
+
+        ajustes = []
+        while listos:
+            fecha_lista, prioridad, indice, posicion = heapq.heappop(listos)
+            prog_ot, items = cadenas[indice]
+            item_ruta = items[posicion]
+            maquina_id = item_ruta.maquina_id
+            calendario_maquina = calendarios.get(maquina_id) or calendario
+            clave = preparaciones.clave(item_ruta.id)
+            preparacion = timedelta(minutes=preparaciones.minutos(
+                maquina_id, ultima_operacion.get(maquina_id), clave
+            ))
+
+            inicio = calendario_maquina.ajustar_inicio(fecha_lista)
+            conflicto = None
+            if maquina_id in maquina_libre and maquina_libre[maquina_id][0] + preparacion > inicio:
+                inicio = calendario_maquina.ajustar_inicio(maquina_libre[maquina_id][0] + preparacion)
+                conflicto = maquina_libre[maquina_id][1]
+
+            indice_maquina = indices[maquina_id]
+            bloques_inicio = indice_maquina.bloques_inicio
+            bloques_fin = indice_maquina.bloques_fin
+            while True:
                 calculo_tiempo = self.time_calculator.calculate_working_days(
-                    fecha_actual,
+                    inicio,
                     item_ruta.cantidad_pedido,
-                    item_ruta.estandar
+                    item_ruta.estandar,
+                    calendario=calendario_maquina
                 )
-
                 if 'error' in calculo_tiempo:
-                    continue
+                    fin = None
+                    break
+                fin = calculo_tiempo['next_available_time']
 
-                fecha_fin = calculo_tiempo['next_available_time']
-                
-                # Verificar conflictos
-                verificacion = self.verificar_conflicto(
-                    item_ruta.maquina,
-                    fecha_actual,
-                    fecha_fin,
-                    prog_ot.prioridad
+                # Avanzar el puntero de la máquina sobre las reservas que ya terminaron
+                k = punteros[maquina_id]
+                while k < len(bloques_fin) and bloques_fin[k] <= inicio:
+                    k += 1
+                punteros[maquina_id] = k
+                if k == len(bloques_inicio) or bloques_inicio[k] >= fin:
+                    break
+
+                conflicto = indice_maquina.primer_conflicto(inicio, fin)['ot']
+                # La reserva ajena es de otro programa: setup por defecto tras ella
+                inicio = calendario_maquina.ajustar_inicio(
+                    bloques_fin[k] + timedelta(minutes=preparaciones.minutos(maquina_id, None, clave))
                 )
 
-                if verificacion['tiene_conflicto']:
+            if fin is None:
+                # Sin tiempo calculable: el proceso no ocupa la máquina
+                fin = inicio
+            else:
+                maquina_libre[maquina_id] = (fin, prog_ot.orden_trabajo.codigo_ot)
+                ultima_operacion[maquina_id] = clave
+                if inicio > fecha_lista:
                     ajustes.append({
                         'item_ruta': item_ruta,
-                        'fecha_original': fecha_actual,
-                        'fecha_ajustada': verificacion['fecha_disponible'],
+                        'fecha_original': fecha_lista,
+                        'fecha_ajustada': inicio,
                         'maquina': item_ruta.maquina,
                         'proceso': item_ruta.proceso,
                         'orden_trabajo': prog_ot.orden_trabajo.codigo_ot,
-                        'prioridad': prog_ot.prioridad
+                        'prioridad': prog_ot.prioridad,
+                        'conflicto_con': conflicto
                     })
 
-                fecha_actual = verificacion['fecha_disponible']
+            if posicion + 1 < len(items):
+                siguiente = calendario.ajustar_inicio(fin + espera) if fin > inicio else fin
+                heapq.heappush(listos, (siguiente, prioridad, indice, posicion + 1))
 
+        self.logger.info(f"Ajustes sugeridos: {len(ajustes)}")
         return ajustes
 
     def verificar_disponibilidad_maquina(self, maquina, fecha_inicio, fecha_fin, programa_actual=None, item_ruta_actual=None, prioridad_actual=None):
@@ -190,61 +339,42 @@ class MachineAvailabilityService:
         elif not isinstance(fecha_fin, datetime):
             fecha_fin = datetime.combine(datetime.strptime(str(fecha_fin), "%Y-%m-%d").date(), TimeCalculator.WORKDAY_END)
 
-        # Obtener todas las asignaciones ordenadas por fecha y prioridad
-        asignaciones = ItemRuta.objects.filter(
-            maquina=maquina,
-            ruta__orden_trabajo__programaordentrabajo__isnull=False
-        ).select_related(
-            'ruta',
-            'ruta__orden_trabajo',
-            'proceso'
-        ).prefetch_related(
-            'ruta__orden_trabajo__programaordentrabajo_set'
-        )
-
+        # Obtener todas las asignaciones y calcular su ocupación en un solo lote
+        asignaciones = self._asignaciones_programadas(maquina)
         if item_ruta_actual:
             asignaciones = asignaciones.exclude(id=item_ruta_actual.id)
 
+        filas, lote = self._calcular_ocupaciones(asignaciones)
+        inicios = lote['inicio'].astype(datetime)
+        fines = lote['fin'].astype(datetime)
+
         intervalos_ocupados = []
-        for asignacion in asignaciones:
-            programa_ot = asignacion.ruta.orden_trabajo.programaordentrabajo_set.first()
-            if not programa_ot:
+        for asignacion, programa_ot, i in filas:
+            if not lote['valido'][i] or not lote['minutos_por_dia'][i].any():
                 continue
 
             # Obtener la prioridad de la OT
             prioridad_ot = programa_ot.prioridad
-            
-            programa = programa_ot.programa
-            if not programa.fecha_inicio:
-                continue
+            inicio = inicios[i]
+            fin = fines[i]
 
-            calculo_tiempo = self.time_calculator.calculate_working_days(
-                programa.fecha_inicio,
-                asignacion.cantidad_pedido,
-                asignacion.estandar if asignacion.estandar else 0
-            )
-
-            if 'error' not in calculo_tiempo and calculo_tiempo['intervals']:
-                inicio = calculo_tiempo['intervals'][0]['fecha_inicio']
-                fin = calculo_tiempo['next_available_time']
-                
-                self.logger.info(f"\nProceso encontrado:")
-                self.logger.info(f"OT: {asignacion.ruta.orden_trabajo.codigo_ot}")
-                self.logger.info(f"Proceso: {asignacion.proceso.descripcion}")
-                self.logger.info(f"Prioridad: {prioridad_ot}")
-                self.logger.info(f"Ocupación: {inicio} - {fin}")
-                
-                inicio_con_setup = inicio - TIEMPO_SETUP
-                fin_con_setup = fin + TIEMPO_SETUP
-                
-                intervalos_ocupados.append({
-                    'inicio': inicio_con_setup,
-                    'fin': fin_con_setup,
-                    'ot': asignacion.ruta.orden_trabajo.codigo_ot,
-                    'proceso': asignacion.proceso.descripcion,
-                    'prioridad': prioridad_ot,
-                    'item_ruta': asignacion
-                })
+            self.logger.info(f"\nProceso encontrado:")
+            self.logger.info(f"OT: {asignacion.ruta.orden_trabajo.codigo_ot}")
+            self.logger.info(f"Proceso: {asignacion.proceso.descripcion}")
+            self.logger.info(f"Prioridad: {prioridad_ot}")
+            self.logger.info(f"Ocupación: {inicio} - {fin}")
+
+            inicio_con_setup = inicio - TIEMPO_SETUP
+            fin_con_setup = fin + TIEMPO_SETUP
+
+            intervalos_ocupados.append({
+                'inicio': inicio_con_setup,
+                'fin': fin_con_setup,
+                'ot': asignacion.ruta.orden_trabajo.codigo_ot,
+                'proceso': asignacion.proceso.descripcion,
+                'prioridad': prioridad_ot,
+                'item_ruta': asignacion
+            })
 
         # Ordenar intervalos por fecha de inicio y prioridad
         intervalos_ocupados.sort(key=lambda x: (x['inicio'], x['prioridad']))
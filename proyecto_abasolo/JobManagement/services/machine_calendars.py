@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+from JobManagement.models import IntervaloMaquina
+from .time_calculations import TimeCalculator
+from .working_calendar import MachineCalendar
+
+
+class MachineCalendarService:
+    """
+    Construye los calendarios de disponibilidad de cada máquina (MachineCalendar) a partir de
+    EstadoMaquina (horario normal), DisponibilidadMaquina (excepciones por día), BloqueoMaquina,
+    IntervaloMaquina y MantenimientoMaquina programados. Las máquinas sin particularidades usan
+    el calendario general compartido.
+    """
+
+    HORIZONTE_DIAS = 730  # El calendario se extiende solo si se necesitan fechas posteriores
+    MAX_CALENDARIOS = 128  # Calendarios reutilizados entre corridas (mantienen útil la caché de intervalos)
+
+    _calendarios = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def _obtener(cls, clave, construir):
+        with cls._lock:
+            calendario = cls._calendarios.get(clave)
+            if calendario is not None:
+                cls._calendarios.move_to_end(clave)
+                return calendario
+        calendario = construir()
+        with cls._lock:
+            cls._calendarios[clave] = calendario
+            while len(cls._calendarios) > cls.MAX_CALENDARIOS:
+                cls._calendarios.popitem(last=False)
+        return calendario
+
+    def calendarios(self, maquina_ids, fecha_desde):
+        """Retorna {maquina_id: calendario} usando una consulta por cada fuente de disponibilidad"""
+        from Machine.models import EstadoMaquina, DisponibilidadMaquina, BloqueoMaquina, MantenimientoMaquina
+
+        maquina_ids = {maquina_id for maquina_id in maquina_ids if maquina_id}
+        if not maquina_ids:
+            return {}
+        general = TimeCalculator.get_calendar()
+        if hasattr(fecha_desde, 'date'):
+            fecha_desde = fecha_desde.date()
+
+        horarios = {}
+        for maquina_id, inicio, fin in EstadoMaquina.objects.filter(
+            maquina_id__in=maquina_ids
+        ).values_list('maquina_id', 'hora_inicio_normal', 'hora_fin_normal'):
+            if (inicio, fin) != (TimeCalculator.WORKDAY_START, TimeCalculator.WORKDAY_END):
+                horarios[maquina_id] = (inicio, fin)
+
+        def horario_normal(maquina_id, fecha):
+            inicio, fin = horarios.get(maquina_id, (TimeCalculator.WORKDAY_START, TimeCalculator.WORKDAY_END))
+            return inicio, min(fin, TimeCalculator.FRIDAY_END) if fecha.weekday() == 4 else fin
+
+        dias = defaultdict(dict)
+        for maquina_id, fecha, hora_inicio, hora_fin, disponible in DisponibilidadMaquina.objects.filter(
+            maquina_id__in=maquina_ids,
+            fecha__gte=fecha_desde
+        ).values_list('maquina_id', 'fecha', 'hora_inicio', 'hora_fin', 'disponible'):
+            if not disponible:
+                dias[maquina_id][fecha] = None
+            elif hora_inicio or hora_fin:
+                inicio, fin = horario_normal(maquina_id, fecha)
+                dias[maquina_id][fecha] = (hora_inicio or inicio, hora_fin or fin)
+
+        bloqueos = defaultdict(list)
+        for maquina_id, fecha, hora_inicio, hora_fin in BloqueoMaquina.objects.filter(
+            disponibilidad__maquina_id__in=maquina_ids,
+            disponibilidad__fecha__gte=fecha_desde
+        ).values_list('disponibilidad__maquina_id', 'disponibilidad__fecha', 'hora_inicio', 'hora_fin'):
+            bloqueos[maquina_id].append((
+                datetime.combine(fecha, hora_inicio),
+                datetime.combine(fecha, hora_fin)
+            ))
+
+        for maquina_id, inicio, fin in IntervaloMaquina.objects.filter(
+            maquina_id__in=maquina_ids,
+            fecha_fin__date__gte=fecha_desde
+        ).values_list('maquina_id', 'fecha_inicio', 'fecha_fin'):
+            bloqueos[maquina_id].append((TimeCalculator.a_hora_local(inicio), TimeCalculator.a_hora_local(fin)))
+
+        for mantenimiento in MantenimientoMaquina.objects.filter(
+            maquina_id__in=maquina_ids
+        ).exclude(estado__in=['CN', 'CM']).only(
+            'maquina_id', 'fecha_programada', 'fecha_inicio', 'fecha_fin', 'duracion_estimada'
+        ):
+            inicio = mantenimiento.fecha_inicio or mantenimiento.fecha_programada
+            fin = mantenimiento.fecha_fin or inicio + mantenimiento.duracion_estimada
+            bloqueos[mantenimiento.maquina_id].append((TimeCalculator.a_hora_local(inicio), TimeCalculator.a_hora_local(fin)))
+
+        resultado = {}
+        for maquina_id in maquina_ids:
+            if maquina_id not in horarios and not dias.get(maquina_id) and not bloqueos.get(maquina_id):
+                resultado[maquina_id] = general
+                continue
+            inicio, fin = horarios.get(maquina_id, (TimeCalculator.WORKDAY_START, TimeCalculator.WORKDAY_END))
+            dias_maquina = dias.get(maquina_id, {})
+            bloqueos_maquina = sorted(bloqueos.get(maquina_id, []))
+            clave = (
+                fecha_desde, inicio, fin,
+                tuple(sorted(dias_maquina.items())),
+                tuple(bloqueos_maquina),
+                general
+            )
+            resultado[maquina_id] = self._obtener(clave, lambda: MachineCalendar(
+                fecha_desde - timedelta(days=7),
+                fecha_desde + timedelta(days=self.HORIZONTE_DIAS),
+                inicio,
+                fin,
+                min(fin, TimeCalculator.FRIDAY_END),
+                TimeCalculator.BREAK_START,
+                TimeCalculator.BREAK_END,
+                cargar_feriados_pais=TimeCalculator.HOLIDAYS_COUNTRY,
+                dias=dias_maquina,
+                bloqueos=bloqueos_maquina
+            ))
+        return resultado
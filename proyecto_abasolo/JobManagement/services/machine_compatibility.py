@@ -0,0 +1,69 @@
+import numpy as np
+
+from JobManagement.models import Proceso
+
+
+class MatrizCompatibilidad:
+    """
+    Matriz booleana proceso x máquina: compatible[i, j] indica que maquina_ids[j] está operativa
+    y tiene algún tipo de máquina compatible con proceso_ids[i]. Se arma con dos consultas a las
+    tablas intermedias de tipos de máquina (proceso x tipo por tipo x máquina), en lugar de
+    consultar Proceso.get_maquinas_compatibles proceso por proceso.
+    """
+
+    def __init__(self, proceso_ids, maquina_ids, compatible, descripciones):
+        self.proceso_ids = list(proceso_ids)
+        self.maquina_ids = np.asarray(maquina_ids, dtype=np.int64)
+        self.compatible = compatible
+        self.descripciones = descripciones
+        self._filas = {proceso_id: i for i, proceso_id in enumerate(self.proceso_ids)}
+        self._columnas = {int(maquina_id): j for j, maquina_id in enumerate(self.maquina_ids)}
+
+    @classmethod
+    def cargar(cls, proceso_ids=None):
+        """Matriz de los procesos indicados (o de todos los que tienen tipos compatibles)"""
+        from Machine.models import EstadoMaquina
+
+        tipos_proceso = Proceso.tipos_maquina_compatibles.through.objects.all()
+        if proceso_ids is not None:
+            proceso_ids = set(proceso_ids)
+            tipos_proceso = tipos_proceso.filter(proceso_id__in=proceso_ids)
+        tipos_proceso = list(tipos_proceso.values_list('proceso_id', 'tipomaquina_id'))
+
+        tipos_maquina = list(EstadoMaquina.tipos_maquina.through.objects.filter(
+            tipomaquina_id__in={tipo_id for _, tipo_id in tipos_proceso},
+            estadomaquina__estado_operatividad__estado='OP'
+        ).values_list('tipomaquina_id', 'estadomaquina__maquina_id', 'estadomaquina__maquina__descripcion'))
+
+        proceso_ids = sorted(proceso_ids if proceso_ids is not None else {p for p, _ in tipos_proceso})
+        tipo_ids = sorted({tipo_id for _, tipo_id in tipos_proceso})
+        maquina_ids = sorted({maquina_id for _, maquina_id, _ in tipos_maquina})
+        fila = {proceso_id: i for i, proceso_id in enumerate(proceso_ids)}
+        tipo = {tipo_id: k for k, tipo_id in enumerate(tipo_ids)}
+        columna = {maquina_id: j for j, maquina_id in enumerate(maquina_ids)}
+
+        proceso_tipo = np.zeros((len(proceso_ids), len(tipo_ids)), dtype=np.int32)
+        for proceso_id, tipo_id in tipos_proceso:
+            proceso_tipo[fila[proceso_id], tipo[tipo_id]] = 1
+        tipo_maquina = np.zeros((len(tipo_ids), len(maquina_ids)), dtype=np.int32)
+        for tipo_id, maquina_id, _ in tipos_maquina:
+            tipo_maquina[tipo[tipo_id], columna[maquina_id]] = 1
+
+        return cls(
+            proceso_ids,
+            maquina_ids,
+            (proceso_tipo @ tipo_maquina) > 0,
+            {maquina_id: descripcion for _, maquina_id, descripcion in tipos_maquina}
+        )
+
+    def maquinas(self, proceso_id):
+        """Ids de las máquinas compatibles con el proceso (ordenados)"""
+        i = self._filas.get(proceso_id)
+        if i is None:
+            return []
+        return self.maquina_ids[self.compatible[i]].tolist()
+
+    def es_compatible(self, proceso_id, maquina_id):
+        i = self._filas.get(proceso_id)
+        j = self._columnas.get(maquina_id)
+        return i is not None and j is not None and bool(self.compatible[i, j])
@@ -0,0 +1,300 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.core.cache import caches
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import Cast
+
+from JobManagement.models import Maquina, TareaFragmentada
+from .time_calculations import TimeCalculator
+from .transaction_batch import LoteTransaccion
+
+MAPA_CALOR_CACHE = 'mapa_calor'  # Alias de CACHES compartido por todos los procesos
+MAPA_CALOR_TIMEOUT = 600  # segundos
+_MAPA_CALOR_VERSION = 'mapa_calor:version'
+
+
+def _incrementar_version(_):
+    cache = caches[MAPA_CALOR_CACHE]
+    try:
+        cache.incr(_MAPA_CALOR_VERSION)
+    except ValueError:
+        cache.set(_MAPA_CALOR_VERSION, 1, None)
+
+
+_invalidaciones = LoteTransaccion('mapa_calor', _incrementar_version)
+
+
+def invalidar_mapa_calor():
+    """
+    Invalida todos los mapas de calor en caché (cambia la versión de las claves). La versión
+    cambia una sola vez por transacción y recién al confirmarse, para que nadie vuelva a guardar
+    en caché un mapa calculado con datos aún sin confirmar.
+    """
+    _invalidaciones.agregar([_MAPA_CALOR_VERSION])
+
+
+def _minutos_turno(inicio, fin):
+    """Minutos entre dos horas del día descontando la colación"""
+    def minutos(hora):
+        return hora.hour * 60 + hora.minute
+
+    total = max(minutos(fin) - minutos(inicio), 0)
+    colacion = min(minutos(fin), minutos(TimeCalculator.BREAK_END)) - max(minutos(inicio), minutos(TimeCalculator.BREAK_START))
+    return total - max(colacion, 0)
+
+
+class CargaMaquinas:
+    """
+    Matriz densa de carga planificada: una fila por máquina y una columna por día.
+    horas[i, d] son las horas de trabajo planificadas de maquina_ids[i] en fechas[d] y
+    unidades[i, d] las unidades planificadas.
+    """
+
+    def __init__(self, maquina_ids, fechas, horas, unidades):
+        self.maquina_ids = list(maquina_ids)
+        self.fechas = fechas
+        self.horas = horas
+        self.unidades = unidades
+        self._filas = {maquina_id: i for i, maquina_id in enumerate(self.maquina_ids)}
+
+    def _columna(self, fecha):
+        d = int((np.datetime64(fecha, 'D') - self.fechas[0]).astype(int)) if len(self.fechas) else -1
+        if d < 0 or d >= len(self.fechas):
+            raise KeyError(fecha)
+        return d
+
+    def fila(self, maquina_id):
+        """Horas planificadas de la máquina en cada día del rango"""
+        return self.horas[self._filas[maquina_id]]
+
+    def horas_dia(self, maquina_id, fecha):
+        return float(self.horas[self._filas[maquina_id], self._columna(fecha)])
+
+    def total_por_maquina(self):
+        return dict(zip(self.maquina_ids, self.horas.sum(axis=1).tolist()))
+
+    def total_por_dia(self):
+        return dict(zip(self.fechas.astype(date).tolist(), self.horas.sum(axis=0).tolist()))
+
+    def to_dict(self):
+        """Representación serializable: {maquina_id: {'YYYY-MM-DD': horas}} solo con días con carga"""
+        fechas = [f.isoformat() for f in self.fechas.astype(date).tolist()]
+        return {
+            maquina_id: {
+                fechas[d]: float(self.horas[i, d])
+                for d in np.flatnonzero(self.horas[i] > 0)
+            }
+            for i, maquina_id in enumerate(self.maquina_ids)
+        }
+
+
+class MachineLoadService:
+    """
+    Carga planificada de las máquinas por día, calculada desde las TareaFragmentada del programa.
+    Es la carga del plan ya fragmentado; las horas reservadas por los procesos en programa
+    (cantidad / estándar desde el inicio del programa) siguen en OcupacionMaquinaDia, que es lo
+    que entrega Maquina.calcular_carga_fecha.
+    """
+
+    def carga_rango(self, fecha_inicio, fecha_fin, maquina_ids=None, programa_ids=None):
+        """
+        Retorna un CargaMaquinas con la carga de las máquinas indicadas (o de todas) para cada día
+        entre fecha_inicio y fecha_fin (inclusive). Usa una consulta agregada (más una para listar
+        las máquinas si no se indican), sin importar el tamaño del rango.
+        """
+        if maquina_ids is None:
+            maquina_ids = list(Maquina.objects.order_by('id').values_list('id', flat=True))
+        else:
+            maquina_ids = list(dict.fromkeys(maquina_ids))
+
+        fechas = np.arange(
+            np.datetime64(fecha_inicio, 'D'),
+            np.datetime64(fecha_fin, 'D') + np.timedelta64(1, 'D'),
+            dtype='datetime64[D]'
+        )
+        horas = np.zeros((len(maquina_ids), len(fechas)))
+        unidades = np.zeros((len(maquina_ids), len(fechas)))
+        if not maquina_ids or not len(fechas):
+            return CargaMaquinas(maquina_ids, fechas, horas, unidades)
+
+        tareas = TareaFragmentada.objects.filter(
+            tarea_original__maquina_id__in=maquina_ids,
+            tarea_original__estandar__gt=0,
+            fecha__gte=fecha_inicio,
+            fecha__lte=fecha_fin
+        )
+        if programa_ids is not None:
+            tareas = tareas.filter(programa_id__in=programa_ids)
+
+        cantidad = Cast(F('cantidad_asignada') + F('cantidad_pendiente_anterior'), FloatField())
+        filas = list(tareas.values('tarea_original__maquina_id', 'fecha').annotate(
+            unidades=Sum(cantidad),
+            horas=Sum(cantidad / Cast(F('tarea_original__estandar'), FloatField()))
+        ).values_list('tarea_original__maquina_id', 'fecha', 'unidades', 'horas'))
+
+        if filas:
+            posicion = {maquina_id: i for i, maquina_id in enumerate(maquina_ids)}
+            maquinas, dias, cantidades, tiempos = zip(*filas)
+            i = np.array([posicion[m] for m in maquinas])
+            d = (np.array(dias, dtype='datetime64[D]') - fechas[0]).astype(int)
+            np.add.at(unidades, (i, d), np.array(cantidades, dtype=float))
+            np.add.at(horas, (i, d), np.array(tiempos, dtype=float))
+
+        return CargaMaquinas(maquina_ids, fechas, horas, unidades)
+
+    def carga_semana(self, fecha, maquina_ids=None, programa_ids=None):
+        """Carga de la semana (lunes a domingo) que contiene la fecha"""
+        lunes = fecha - timedelta(days=fecha.weekday())
+        return self.carga_rango(lunes, lunes + timedelta(days=6), maquina_ids, programa_ids)
+
+    def capacidad_rango(self, fecha_inicio, fecha_fin, maquina_ids):
+        """
+        Horas disponibles de cada máquina por día (matriz máquinas x días), según el calendario
+        laboral, el horario normal y la operatividad de EstadoMaquina, las excepciones de
+        DisponibilidadMaquina y los BloqueoMaquina del día. Usa tres consultas.
+        """
+        from Machine.models import EstadoMaquina, DisponibilidadMaquina, BloqueoMaquina
+
+        calendario = TimeCalculator.get_calendar()
+        dias = [fecha_inicio + timedelta(days=d) for d in range((fecha_fin - fecha_inicio).days + 1)]
+        laboral = np.array([calendario.es_dia_laboral(dia) for dia in dias], dtype=bool)
+        viernes = np.array([dia.weekday() == 4 for dia in dias], dtype=bool)
+        posicion = {maquina_id: i for i, maquina_id in enumerate(maquina_ids)}
+        columna = {dia: d for d, dia in enumerate(dias)}
+
+        # Horario normal de cada máquina (o el del calendario si no tiene estado)
+        horario = {
+            maquina_id: (TimeCalculator.WORKDAY_START, TimeCalculator.WORKDAY_END)
+            for maquina_id in maquina_ids
+        }
+        inoperativas = set()
+        for estado in EstadoMaquina.objects.filter(maquina_id__in=maquina_ids).select_related('estado_operatividad'):
+            horario[estado.maquina_id] = (estado.hora_inicio_normal, estado.hora_fin_normal)
+            if estado.estado_operatividad.estado == 'IN':
+                inoperativas.add(estado.maquina_id)
+
+        def fin_del_dia(maquina_id, es_viernes):
+            fin = horario[maquina_id][1]
+            return min(fin, TimeCalculator.FRIDAY_END) if es_viernes else fin
+
+        minutos = np.zeros((len(maquina_ids), len(dias)))
+        for maquina_id, i in posicion.items():
+            inicio = horario[maquina_id][0]
+            minutos[i] = np.where(
+                viernes,
+                _minutos_turno(inicio, fin_del_dia(maquina_id, True)),
+                _minutos_turno(inicio, fin_del_dia(maquina_id, False))
+            )
+        minutos[:, ~laboral] = 0
+
+        # Excepciones por día
+        for maquina_id, fecha, hora_inicio, hora_fin, disponible in DisponibilidadMaquina.objects.filter(
+            maquina_id__in=maquina_ids,
+            fecha__gte=fecha_inicio,
+            fecha__lte=fecha_fin
+        ).values_list('maquina_id', 'fecha', 'hora_inicio', 'hora_fin', 'disponible'):
+            i, d = posicion[maquina_id], columna[fecha]
+            if not disponible:
+                minutos[i, d] = 0
+            elif hora_inicio or hora_fin:
+                minutos[i, d] = _minutos_turno(
+                    hora_inicio or horario[maquina_id][0],
+                    hora_fin or fin_del_dia(maquina_id, viernes[d])
+                )
+
+        # Bloqueos dentro del día
+        for maquina_id, fecha, hora_inicio, hora_fin in BloqueoMaquina.objects.filter(
+            disponibilidad__maquina_id__in=maquina_ids,
+            disponibilidad__fecha__gte=fecha_inicio,
+            disponibilidad__fecha__lte=fecha_fin,
+            disponibilidad__disponible=True
+        ).values_list('disponibilidad__maquina_id', 'disponibilidad__fecha', 'hora_inicio', 'hora_fin'):
+            i, d = posicion[maquina_id], columna[fecha]
+            minutos[i, d] = max(minutos[i, d] - _minutos_turno(hora_inicio, hora_fin), 0)
+
+        for maquina_id in inoperativas:
+            minutos[posicion[maquina_id]] = 0
+
+        return minutos / 60
+
+    def mapa_calor(self, fecha_inicio, fecha_fin, granularidad='dia', maquina_ids=None):
+        """
+        Horas reservadas versus horas disponibles de las máquinas por día o por semana en el
+        horizonte indicado. El resultado (serializable) queda en caché por horizonte hasta que
+        cambian las tareas planificadas o la disponibilidad de las máquinas.
+        """
+        if granularidad not in ('dia', 'semana'):
+            raise ValueError("La granularidad debe ser 'dia' o 'semana'")
+        if fecha_fin < fecha_inicio:
+            raise ValueError("La fecha de fin debe ser posterior a la de inicio")
+
+        cache = caches[MAPA_CALOR_CACHE]
+        version = cache.get(_MAPA_CALOR_VERSION, 0)
+        maquinas_clave = ','.join(str(m) for m in sorted(maquina_ids)) if maquina_ids is not None else 'todas'
+        clave = f"mapa_calor:{version}:{fecha_inicio}:{fecha_fin}:{granularidad}:{maquinas_clave}"
+        resultado = cache.get(clave)
+        if resultado is not None:
+            return resultado
+
+        maquinas = Maquina.objects.order_by('codigo_maquina')
+        if maquina_ids is not None:
+            maquinas = maquinas.filter(id__in=maquina_ids)
+        maquinas = list(maquinas.values('id', 'codigo_maquina', 'descripcion'))
+        ids = [maquina['id'] for maquina in maquinas]
+
+        carga = self.carga_rango(fecha_inicio, fecha_fin, ids)
+        reservadas = carga.horas
+        disponibles = self.capacidad_rango(fecha_inicio, fecha_fin, ids)
+        dias = carga.fechas.astype(date).tolist()
+
+        if granularidad == 'semana':
+            cortes = [d for d, dia in enumerate(dias) if d == 0 or dia.weekday() == 0]
+            periodos = [
+                {'inicio': dias[c].isoformat(), 'fin': dias[(cortes + [len(dias)])[k + 1] - 1].isoformat()}
+                for k, c in enumerate(cortes)
+            ]
+            if len(ids):
+                reservadas = np.add.reduceat(reservadas, cortes, axis=1)
+                disponibles = np.add.reduceat(disponibles, cortes, axis=1)
+            else:
+                reservadas = disponibles = np.zeros((0, len(cortes)))
+        else:
+            periodos = [{'inicio': dia.isoformat(), 'fin': dia.isoformat()} for dia in dias]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            utilizacion = np.where(disponibles > 0, reservadas / disponibles, np.nan)
+        sobrecarga = reservadas > disponibles + 1e-9
+
+        filas = []
+        sobrecargas = []
+        for i, maquina in enumerate(maquinas):
+            filas.append({
+                'id': maquina['id'],
+                'codigo': maquina['codigo_maquina'],
+                'descripcion': maquina['descripcion'],
+                'horas_reservadas': np.round(reservadas[i], 2).tolist(),
+                'horas_disponibles': np.round(disponibles[i], 2).tolist(),
+                'utilizacion': [None if np.isnan(u) else round(float(u), 3) for u in utilizacion[i]]
+            })
+            for k in np.flatnonzero(sobrecarga[i]):
+                sobrecargas.append({
+                    'maquina_id': maquina['id'],
+                    'codigo': maquina['codigo_maquina'],
+                    'periodo': periodos[k]['inicio'],
+                    'horas_reservadas': round(float(reservadas[i, k]), 2),
+                    'horas_disponibles': round(float(disponibles[i, k]), 2),
+                    'exceso': round(float(reservadas[i, k] - disponibles[i, k]), 2)
+                })
+
+        resultado = {
+            'fecha_inicio': fecha_inicio.isoformat(),
+            'fecha_fin': fecha_fin.isoformat(),
+            'granularidad': granularidad,
+            'periodos': periodos,
+            'maquinas': filas,
+            'sobrecargas': sorted(sobrecargas, key=lambda x: -x['exceso']),
+            'generado': datetime.now().isoformat(timespec='seconds')
+        }
+        cache.set(clave, resultado, MAPA_CALOR_TIMEOUT)
+        return resultado
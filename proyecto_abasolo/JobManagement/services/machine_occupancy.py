@@ -0,0 +1,159 @@
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+
+from JobManagement.models import IntervaloMaquina, OcupacionMaquinaDia
+from .machine_availability import MachineAvailabilityService
+from .time_calculations import TimeCalculator
+from .transaction_batch import LoteTransaccion
+
+# Máquinas pendientes de recalcular en la transacción actual
+_pendientes = LoteTransaccion('ocupacion_maquinas', lambda ids: MachineOccupancyService().actualizar(ids))
+
+
+def programar_actualizacion(maquina_ids):
+    """
+    Agenda el recálculo de la ocupación de las máquinas para cuando se confirme la transacción.
+    Varios cambios dentro de la misma transacción se recalculan juntos una sola vez.
+    """
+    _pendientes.agregar(maquina_ids)
+
+
+class MachineOccupancyService:
+    """Calcula y mantiene la ocupación diaria guardada (OcupacionMaquinaDia) de las máquinas"""
+
+    TOLERANCIA_MINUTOS = 0.5
+
+    def __init__(self):
+        self.time_calculator = TimeCalculator()
+        self.machine_availability = MachineAvailabilityService()
+
+    def _minutos_por_dia(self, tramos):
+        """
+        Reparte tramos (maquina_id, inicio, fin) en minutos laborables por máquina y día.
+        Retorna {(maquina_id, fecha): minutos}.
+        """
+        resultado = defaultdict(float)
+        if not tramos:
+            return resultado
+        calendario = self.time_calculator.get_calendar()
+        inicios = calendario.minutos_laborales([inicio for _, inicio, _ in tramos])
+        fines = calendario.minutos_laborales([fin for _, _, fin in tramos])
+        fechas, desde, hasta = calendario.tramos_por_dia(inicios, np.maximum(fines, inicios))
+        minutos = hasta - desde
+        for i, d in zip(*np.nonzero(minutos > 0)):
+            resultado[(tramos[i][0], fechas[d].astype(object))] += float(minutos[i, d])
+        return resultado
+
+    def calcular(self, maquina_ids=None):
+        """
+        Calcula desde cero la ocupación de las máquinas indicadas (o de todas).
+        Retorna {(maquina_id, fecha): {'minutos_reservados': x, 'minutos_bloqueados': y}}.
+        """
+        from Machine.models import MantenimientoMaquina
+
+        ocupacion = defaultdict(lambda: {'minutos_reservados': 0.0, 'minutos_bloqueados': 0.0})
+
+        # Minutos reservados por procesos en programa (mismo cálculo que la disponibilidad)
+        filas, lote = self.machine_availability._calcular_ocupaciones(
+            self.machine_availability._asignaciones_programadas(maquina_ids=maquina_ids)
+        )
+        minutos = lote['minutos_por_dia']
+        for asignacion, _, i in filas:
+            if not lote['valido'][i]:
+                continue
+            for d in np.flatnonzero(minutos[i] > 0):
+                clave = (asignacion.maquina_id, lote['fechas'][d].astype(object))
+                ocupacion[clave]['minutos_reservados'] += float(minutos[i, d])
+
+        # Minutos bloqueados por intervalos de máquina y mantenimientos
+        intervalos = IntervaloMaquina.objects.all()
+        mantenimientos = MantenimientoMaquina.objects.exclude(estado='CN')
+        if maquina_ids is not None:
+            intervalos = intervalos.filter(maquina_id__in=maquina_ids)
+            mantenimientos = mantenimientos.filter(maquina_id__in=maquina_ids)
+
+        tramos = [
+            (maquina_id, TimeCalculator.a_hora_local(inicio), TimeCalculator.a_hora_local(fin))
+            for maquina_id, inicio, fin in intervalos.values_list('maquina_id', 'fecha_inicio', 'fecha_fin')
+        ]
+        for mantenimiento in mantenimientos.only(
+            'maquina_id', 'fecha_programada', 'fecha_inicio', 'fecha_fin', 'duracion_estimada'
+        ):
+            inicio = mantenimiento.fecha_inicio or mantenimiento.fecha_programada
+            fin = mantenimiento.fecha_fin or inicio + mantenimiento.duracion_estimada
+            tramos.append((mantenimiento.maquina_id, TimeCalculator.a_hora_local(inicio), TimeCalculator.a_hora_local(fin)))
+
+        for clave, bloqueados in self._minutos_por_dia(tramos).items():
+            ocupacion[clave]['minutos_bloqueados'] += bloqueados
+
+        return dict(ocupacion)
+
+    def _guardar(self, anteriores, ocupacion):
+        with transaction.atomic():
+            anteriores.delete()
+            OcupacionMaquinaDia.objects.bulk_create(
+                [
+                    OcupacionMaquinaDia(maquina_id=maquina_id, fecha=fecha, **valores)
+                    for (maquina_id, fecha), valores in ocupacion.items()
+                ],
+                batch_size=500
+            )
+        return len(ocupacion)
+
+    def actualizar(self, maquina_ids):
+        """Recalcula y reemplaza la ocupación guardada de las máquinas indicadas"""
+        maquina_ids = list(maquina_ids)
+        return self._guardar(
+            OcupacionMaquinaDia.objects.filter(maquina_id__in=maquina_ids),
+            self.calcular(maquina_ids)
+        )
+
+    def reconstruir(self):
+        """Reconstruye la ocupación guardada de todas las máquinas"""
+        return self._guardar(OcupacionMaquinaDia.objects.all(), self.calcular())
+
+    def verificar_consistencia(self, maquina_ids=None):
+        """
+        Compara la ocupación guardada con la calculada desde cero.
+        Retorna la lista de diferencias (vacía si la caché está al día).
+        """
+        calculada = self.calcular(maquina_ids)
+        guardadas = OcupacionMaquinaDia.objects.all()
+        if maquina_ids is not None:
+            guardadas = guardadas.filter(maquina_id__in=maquina_ids)
+        guardada = {
+            (maquina_id, fecha): {'minutos_reservados': reservados, 'minutos_bloqueados': bloqueados}
+            for maquina_id, fecha, reservados, bloqueados in guardadas.values_list(
+                'maquina_id', 'fecha', 'minutos_reservados', 'minutos_bloqueados'
+            )
+        }
+
+        vacio = {'minutos_reservados': 0.0, 'minutos_bloqueados': 0.0}
+        diferencias = []
+        for clave in sorted(set(calculada) | set(guardada)):
+            esperado = calculada.get(clave, vacio)
+            actual = guardada.get(clave, vacio)
+            if any(abs(esperado[campo] - actual[campo]) > self.TOLERANCIA_MINUTOS for campo in vacio):
+                diferencias.append({
+                    'maquina_id': clave[0],
+                    'fecha': clave[1],
+                    'guardado': actual,
+                    'calculado': esperado
+                })
+        return diferencias
+
+    def carga(self, maquina_ids, fecha_inicio, fecha_fin):
+        """Lee la ocupación guardada: {maquina_id: {fecha: {'minutos_reservados', 'minutos_bloqueados'}}}"""
+        resultado = defaultdict(dict)
+        for maquina_id, fecha, reservados, bloqueados in OcupacionMaquinaDia.objects.filter(
+            maquina_id__in=maquina_ids,
+            fecha__gte=fecha_inicio,
+            fecha__lte=fecha_fin
+        ).values_list('maquina_id', 'fecha', 'minutos_reservados', 'minutos_bloqueados'):
+            resultado[maquina_id][fecha] = {
+                'minutos_reservados': reservados,
+                'minutos_bloqueados': bloqueados
+            }
+        return dict(resultado)
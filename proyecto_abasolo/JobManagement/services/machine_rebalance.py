@@ -0,0 +1,184 @@
+from datetime import timedelta
+
+import numpy as np
+
+from JobManagement.models import ItemRuta, Maquina, ProgramaOrdenTrabajo, Ruta, RutaPieza
+from .machine_compatibility import MatrizCompatibilidad
+from .machine_load import MachineLoadService
+from .time_calculations import TimeCalculator
+
+
+def _terminos(carga, capacidad):
+    """Días laborales que necesita cada máquina para terminar su carga (inf si no tiene capacidad)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(capacidad > 0, carga / capacidad, np.where(carga > 1e-9, np.inf, 0.0))
+
+
+def _redondear(valor, decimales=2):
+    return round(float(valor), decimales) if np.isfinite(valor) else None
+
+
+class MachineRebalanceService:
+    """
+    Propone mover operaciones de un programa desde máquinas sobrecargadas a máquinas
+    compatibles con menos carga.
+
+    Cada máquina termina su carga (horas de otros programas según la matriz de carga más las
+    horas pendientes de las operaciones del programa) en carga / capacidad diaria días
+    laborales; el makespan estimado es el máximo entre las máquinas. En cada ronda se evalúan
+    a la vez todos los movimientos posibles (operación, máquina compatible) y se aplica el que
+    más reduce el makespan. Las horas en la máquina de destino usan el estándar de Ruta o
+    RutaPieza del producto de la OT para esa máquina, o el de la operación si no lo hay.
+    """
+
+    MAX_MOVIMIENTOS = 20
+    HORIZONTE_MINIMO_DIAS = 27  # Ventana mínima para promediar la capacidad diaria
+    GANANCIA_MINIMA_DIAS = 0.01
+
+    def proponer(self, programa, max_movimientos=None):
+        max_movimientos = int(max_movimientos or self.MAX_MOVIMIENTOS)
+
+        items = [
+            item for item in ItemRuta.objects.filter(
+                ruta__orden_trabajo_id__in=ProgramaOrdenTrabajo.objects.filter(
+                    programa=programa
+                ).values('orden_trabajo_id'),
+                estandar__gt=0
+            ).select_related('ruta__orden_trabajo', 'proceso').order_by('ruta__orden_trabajo_id', 'item')
+            if item.cantidad_pedido > item.cantidad_terminado_proceso
+        ]
+        if not items:
+            return self._resultado([], [], np.zeros(0), np.zeros(0), np.zeros(0), {})
+
+        compatibilidad = MatrizCompatibilidad.cargar({item.proceso_id for item in items})
+        maquina_ids = sorted({item.maquina_id for item in items} | set(compatibilidad.maquina_ids.tolist()))
+        columna = {maquina_id: j for j, maquina_id in enumerate(maquina_ids)}
+        descripciones = dict(Maquina.objects.filter(id__in=maquina_ids).values_list('id', 'descripcion'))
+
+        # Carga de otros programas en el horizonte y capacidad diaria de cada máquina
+        fecha_inicio = programa.fecha_inicio
+        fecha_fin = max(programa.fecha_fin, fecha_inicio + timedelta(days=self.HORIZONTE_MINIMO_DIAS))
+        servicio = MachineLoadService()
+        carga_total = servicio.carga_rango(fecha_inicio, fecha_fin, maquina_ids).horas.sum(axis=1)
+        carga_propia = servicio.carga_rango(fecha_inicio, fecha_fin, maquina_ids, [programa.id]).horas.sum(axis=1)
+        calendario = TimeCalculator.get_calendar()
+        dias_laborales = sum(
+            1 for d in range((fecha_fin - fecha_inicio).days + 1)
+            if calendario.es_dia_laboral(fecha_inicio + timedelta(days=d))
+        )
+        capacidad = servicio.capacidad_rango(fecha_inicio, fecha_fin, maquina_ids).sum(axis=1) / max(dias_laborales, 1)
+
+        # Estándares de la ruta del producto (o pieza) de cada OT, por proceso y máquina
+        codigos = {item.ruta.orden_trabajo.codigo_producto_salida for item in items} - {None, ''}
+        estandares_ruta = {
+            (codigo, proceso_id, maquina_id): estandar
+            for codigo, proceso_id, maquina_id, estandar in list(Ruta.objects.filter(
+                producto__codigo_producto__in=codigos, estandar__gt=0
+            ).values_list('producto__codigo_producto', 'proceso_id', 'maquina_id', 'estandar')) + list(RutaPieza.objects.filter(
+                pieza__codigo_pieza__in=codigos, estandar__gt=0
+            ).values_list('pieza__codigo_pieza', 'proceso_id', 'maquina_id', 'estandar'))
+        }
+
+        horas_items = np.array([
+            float(item.cantidad_pedido - item.cantidad_terminado_proceso) / item.estandar for item in items
+        ])
+        carga = carga_total - carga_propia
+        np.add.at(carga, [columna[item.maquina_id] for item in items], horas_items)
+        carga_inicial = carga.copy()
+
+        # Movimientos posibles: (operación, origen, destino, horas en origen, horas en destino)
+        candidatos = []
+        estandares_destino = []
+        for indice, item in enumerate(items):
+            codigo = item.ruta.orden_trabajo.codigo_producto_salida
+            pendiente = float(item.cantidad_pedido - item.cantidad_terminado_proceso)
+            for maquina_id in compatibilidad.maquinas(item.proceso_id):
+                if maquina_id == item.maquina_id or capacidad[columna[maquina_id]] <= 0:
+                    continue
+                estandar_ruta = estandares_ruta.get((codigo, item.proceso_id, maquina_id))
+                estandar = estandar_ruta or item.estandar
+                candidatos.append((indice, columna[item.maquina_id], columna[maquina_id], horas_items[indice], pendiente / estandar))
+                estandares_destino.append((estandar, estandar_ruta is not None))
+        candidatos = np.array(candidatos, dtype=np.float64).reshape(-1, 5)
+        operacion = candidatos[:, 0].astype(np.int64)
+        origen = candidatos[:, 1].astype(np.int64)
+        destino = candidatos[:, 2].astype(np.int64)
+        horas_origen = candidatos[:, 3]
+        horas_destino = candidatos[:, 4]
+
+        movimientos = []
+        vigentes = np.ones(len(candidatos), dtype=bool)
+        while len(movimientos) < max_movimientos and vigentes.any():
+            terminos = _terminos(carga, capacidad)
+            makespan = terminos.max()
+
+            # Término máximo de las máquinas que no participan en cada movimiento (tres mayores)
+            orden = np.argsort(-terminos, kind='stable')[:3]
+            mayores = np.pad(terminos[orden], (0, 3 - len(orden)))
+            orden = np.pad(orden, (0, 3 - len(orden)), constant_values=-1)
+            libre_0 = (origen != orden[0]) & (destino != orden[0])
+            libre_1 = (origen != orden[1]) & (destino != orden[1])
+            resto = np.where(libre_0, mayores[0], np.where(libre_1, mayores[1], mayores[2]))
+
+            despues = np.maximum.reduce([
+                resto,
+                _terminos(carga[origen] - horas_origen, capacidad[origen]),
+                _terminos(carga[destino] + horas_destino, capacidad[destino])
+            ])
+            with np.errstate(invalid='ignore'):
+                ganancia = makespan - despues
+            # Las operaciones de máquinas sin capacidad se mueven primero
+            prioridad = np.where(capacidad[origen] <= 0, np.inf, np.nan_to_num(ganancia, nan=-np.inf, posinf=np.inf))
+            prioridad[~vigentes] = -np.inf
+
+            mejor = int(np.argmax(prioridad))
+            if prioridad[mejor] < self.GANANCIA_MINIMA_DIAS:
+                break
+
+            carga[origen[mejor]] -= horas_origen[mejor]
+            carga[destino[mejor]] += horas_destino[mejor]
+            vigentes &= operacion != operacion[mejor]
+
+            item = items[operacion[mejor]]
+            maquina_destino = maquina_ids[destino[mejor]]
+            estandar, desde_ruta = estandares_destino[mejor]
+            movimientos.append({
+                'item_ruta': item.id,
+                'orden_trabajo': item.ruta.orden_trabajo.id,
+                'codigo_ot': item.ruta.orden_trabajo.codigo_ot,
+                'item': item.item,
+                'proceso': item.proceso.descripcion if item.proceso else None,
+                'maquina_origen': {'id': item.maquina_id, 'descripcion': descripciones.get(item.maquina_id)},
+                'maquina_destino': {'id': maquina_destino, 'descripcion': descripciones.get(maquina_destino)},
+                'horas_origen': round(float(horas_origen[mejor]), 2),
+                'horas_destino': round(float(horas_destino[mejor]), 2),
+                'estandar_destino': estandar,
+                'estandar_desde_ruta': desde_ruta,
+                'ganancia_dias': _redondear(ganancia[mejor]),
+                'makespan_dias': _redondear(despues[mejor]),
+                # Mismo formato que los procesos de update-prio, para aplicar el movimiento
+                'cambio': {'id': item.id, 'maquina_id': maquina_destino, 'estandar': estandar}
+            })
+
+        return self._resultado(movimientos, maquina_ids, carga_inicial, carga, capacidad, descripciones)
+
+    def _resultado(self, movimientos, maquina_ids, carga_inicial, carga_final, capacidad, descripciones):
+        terminos_iniciales = _terminos(carga_inicial, capacidad)
+        terminos_finales = _terminos(carga_final, capacidad)
+        return {
+            'makespan_inicial_dias': _redondear(terminos_iniciales.max()) if len(maquina_ids) else 0.0,
+            'makespan_final_dias': _redondear(terminos_finales.max()) if len(maquina_ids) else 0.0,
+            'movimientos': movimientos,
+            'maquinas': [
+                {
+                    'id': maquina_id,
+                    'descripcion': descripciones.get(maquina_id),
+                    'capacidad_horas_dia': round(float(capacidad[j]), 2),
+                    'carga_inicial_horas': round(float(carga_inicial[j]), 2),
+                    'carga_final_horas': round(float(carga_final[j]), 2),
+                    'dias_iniciales': _redondear(terminos_iniciales[j]),
+                    'dias_finales': _redondear(terminos_finales[j])
+                }
+                for j, maquina_id in enumerate(maquina_ids)
+            ]
+        }
@@ -0,0 +1,125 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+from .time_calculations import TimeCalculator
+
+
+class OperatorAvailability:
+    """
+    Disponibilidad de los operadores como segundo recurso de la programación.
+
+    Para cada operador mantiene sus tramos ocupados (ausencias de IntervaloOperador,
+    asignaciones en otros programas y las operaciones que se le van asignando en la corrida)
+    como bloques ordenados y disjuntos, de modo que verificar si está libre en un rango o
+    reservarlo se resuelve con búsqueda binaria.
+    """
+
+    def __init__(self, habilitados, ocupados=None, nombres=None):
+        """
+        habilitados: {maquina_id: [operador_id, ...]} con los operadores activos habilitados.
+        ocupados: {operador_id: [(inicio, fin), ...]} tramos en que el operador no está libre.
+        """
+        self.habilitados = {maquina_id: list(operadores) for maquina_id, operadores in habilitados.items()}
+        self.nombres = dict(nombres or {})
+        self.bloques_inicio = defaultdict(list)
+        self.bloques_fin = defaultdict(list)
+        self.minutos_asignados = defaultdict(float)
+        for operador_id, tramos in (ocupados or {}).items():
+            for inicio, fin in sorted(tramos):
+                self._agregar(operador_id, inicio, fin)
+
+    @classmethod
+    def cargar(cls, maquina_ids, fecha_desde, excluir_programa_id=None):
+        """Carga habilitaciones, ausencias y asignaciones de otros programas (tres consultas)"""
+        from Operator.models import OperadorMaquina, AsignacionOperador
+        from JobManagement.models import IntervaloOperador
+
+        habilitados = defaultdict(list)
+        nombres = {}
+        for maquina_id, operador_id, nombre in OperadorMaquina.objects.filter(
+            maquina_id__in=maquina_ids,
+            activo=True,
+            operador__activo=True
+        ).order_by('operador_id').values_list('maquina_id', 'operador_id', 'operador__nombre'):
+            habilitados[maquina_id].append(operador_id)
+            nombres[operador_id] = nombre
+
+        if settings.USE_TZ and timezone.is_naive(fecha_desde):
+            fecha_desde = timezone.make_aware(fecha_desde)
+        operador_ids = list(nombres)
+        ocupados = defaultdict(list)
+        for operador_id, inicio, fin in IntervaloOperador.objects.filter(
+            operador_id__in=operador_ids,
+            fecha_fin__gte=fecha_desde
+        ).values_list('operador_id', 'fecha_inicio', 'fecha_fin'):
+            ocupados[operador_id].append((TimeCalculator.a_hora_local(inicio), TimeCalculator.a_hora_local(fin)))
+
+        asignaciones = AsignacionOperador.objects.filter(
+            operador_id__in=operador_ids,
+            fecha_fin__gte=fecha_desde
+        )
+        if excluir_programa_id is not None:
+            asignaciones = asignaciones.exclude(programa_id=excluir_programa_id)
+        for operador_id, inicio, fin in asignaciones.values_list('operador_id', 'fecha_inicio', 'fecha_fin'):
+            ocupados[operador_id].append((TimeCalculator.a_hora_local(inicio), TimeCalculator.a_hora_local(fin)))
+
+        return cls(habilitados, ocupados, nombres)
+
+    def _agregar(self, operador_id, inicio, fin):
+        """Agrega un tramo ocupado fusionándolo con los bloques vecinos"""
+        if not inicio < fin:
+            return
+        inicios = self.bloques_inicio[operador_id]
+        fines = self.bloques_fin[operador_id]
+        k = bisect_right(inicios, inicio)
+        # Fusionar con el bloque anterior si se toca
+        if k > 0 and fines[k - 1] >= inicio:
+            k -= 1
+            inicio = inicios[k]
+            fin = max(fin, fines[k])
+        j = k
+        while j < len(inicios) and inicios[j] <= fin:
+            fin = max(fin, fines[j])
+            j += 1
+        inicios[k:j] = [inicio]
+        fines[k:j] = [fin]
+
+    def candidatos(self, maquina_id):
+        return self.habilitados.get(maquina_id, [])
+
+    def conflicto(self, operador_id, inicio, fin):
+        """Término del bloque ocupado que se traslapa con [inicio, fin), o None si está libre"""
+        inicios = self.bloques_inicio.get(operador_id)
+        if not inicios:
+            return None
+        fines = self.bloques_fin[operador_id]
+        k = bisect_right(inicios, inicio) - 1
+        if k >= 0 and fines[k] > inicio:
+            return fines[k]
+        if k + 1 < len(inicios) and inicios[k + 1] < fin:
+            return fines[k + 1]
+        return None
+
+    def elegir(self, maquina_id, inicio, fin):
+        """
+        Operador habilitado libre durante [inicio, fin) (el de menor carga asignada).
+        Si ninguno está libre retorna (None, instante en que se libera el primero).
+        """
+        libres = []
+        proximo = None
+        for operador_id in self.candidatos(maquina_id):
+            termino = self.conflicto(operador_id, inicio, fin)
+            if termino is None:
+                libres.append((self.minutos_asignados[operador_id], operador_id))
+            elif proximo is None or termino < proximo:
+                proximo = termino
+        if libres:
+            return min(libres)[1], None
+        return None, proximo
+
+    def reservar(self, operador_id, inicio, fin):
+        self._agregar(operador_id, inicio, fin)
+        self.minutos_asignados[operador_id] += (fin - inicio).total_seconds() / 60
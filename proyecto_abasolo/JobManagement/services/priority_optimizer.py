@@ -0,0 +1,282 @@
+import math
+import random
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from .lot_streaming import desfases_transferencia
+from .production_scheduler import ProductionScheduler
+from .setup_times import MatrizPreparacion, secuenciar
+from .time_calculations import TimeCalculator
+from .what_if import WhatIfService
+
+
+class ProgramacionRapida:
+    """
+    Núcleo de programación en memoria para evaluar miles de órdenes de OTs por segundo.
+
+    Aplica la misma regla que ProductionScheduler._programar_operaciones (cada OT completa en
+    orden, cada operación después de su predecesora y de la última operación de su máquina más
+    el setup, dentro del calendario de su máquina, con el mismo traslape por lotes de
+    transferencia y los mismos setups por secuencia, incluida la agrupación de OTs), pero
+    trabaja con minutos desde el inicio del programa y listas planas de los tramos de cada
+    calendario, sin crear datetimes ni intervalos diarios. No modela la división de procesos
+    entre máquinas: con ella activa, el orden se busca sin dividir.
+
+    El setup por defecto (y la espera entre procesos de una OT) es el de la matriz de
+    preparación (MINUTOS_PREPARACION_DEFECTO de setup_times si el escenario no trae una).
+    """
+
+    def __init__(self, escenario):
+        self.origen = escenario['fecha_inicio']
+        self.preparaciones = escenario.get('preparaciones') or MatrizPreparacion({})
+        self.agrupar_preparaciones = escenario.get('agrupar_preparaciones', False)
+        self.calendarios = []
+        self.tablas = []
+        indice_calendario = {}
+
+        self.ots = []
+        self.operaciones = []
+        validos = []
+        for ot in escenario['ordenes_trabajo']:
+            operaciones = []
+            for proceso in ot['procesos']:
+                if not proceso.get('estandar') or not proceso.get('cantidad'):
+                    continue
+                calendario = escenario['calendarios'].get(proceso['maquina_id']) or TimeCalculator.get_calendar()
+                if id(calendario) not in indice_calendario:
+                    indice_calendario[id(calendario)] = len(self.calendarios)
+                    self.calendarios.append(calendario)
+                    self.tablas.append(self._tabla(calendario))
+                duracion = None
+                if proceso['estandar'] > 0:
+                    duracion = math.ceil(float(proceso['cantidad']) * 60 / float(proceso['estandar']) - 1e-9)
+                operaciones.append((
+                    indice_calendario[id(calendario)], proceso['maquina_id'], duracion,
+                    self.preparaciones.clave(proceso['id'])
+                ))
+                validos.append(proceso)
+            self.ots.append(ot['orden_trabajo'])
+            self.operaciones.append(operaciones)
+
+        # Traslape por lotes: (adelanto, cola) de cada operación, o None si espera el término de la anterior
+        self.desfases = [[None] * len(operaciones) for operaciones in self.operaciones]
+        lote = escenario.get('lote_transferencia')
+        if lote and validos:
+            posiciones = [(i, k) for i, operaciones in enumerate(self.operaciones) for k in range(len(operaciones))]
+            adelanto, cola = desfases_transferencia(
+                [float(proceso['cantidad']) for proceso in validos],
+                [float(proceso['estandar']) for proceso in validos],
+                [k == 0 for _, k in posiciones],
+                [float(lote)] * len(validos)
+            )
+            for (i, k), a, c in zip(posiciones, adelanto, cola):
+                if not math.isnan(a) and self.operaciones[i][k][2] is not None:
+                    self.desfases[i][k] = (float(a), float(c))
+
+        self.terminos = [
+            self._minutos(datetime.combine(escenario['fechas_termino'][ot_id], TimeCalculator.WORKDAY_END))
+            if ot_id in escenario['fechas_termino'] else None
+            for ot_id in self.ots
+        ]
+
+    def _minutos(self, fecha_hora):
+        return (fecha_hora - self.origen).total_seconds() / 60
+
+    def _tabla(self, calendario):
+        """Tramos trabajables del calendario en minutos desde el origen del programa"""
+        origen_dt, seg_inicio, seg_fin, seg_acum, seg_acum_fin = calendario.tramos()
+        desfase = self._minutos(origen_dt)
+        return (
+            [float(x) + desfase for x in seg_inicio],
+            [float(x) + desfase for x in seg_fin],
+            [float(x) for x in seg_acum],
+            [float(x) for x in seg_acum_fin]
+        )
+
+    def _laboral(self, c, instante):
+        """Minutos laborables del calendario c hasta 'instante' (ambos en minutos desde el origen)"""
+        seg_inicio, seg_fin, acum, _ = self.tablas[c]
+        k = bisect_right(seg_fin, instante)
+        if k < len(seg_fin):
+            return acum[k] + max(0.0, instante - seg_inicio[k])
+
+        # Fuera del horizonte cargado: usar el calendario (lo extiende) y actualizar la tabla
+        calendario = self.calendarios[c]
+        minuto = calendario.minuto_laboral(self.origen + timedelta(minutes=instante))
+        self.tablas[c] = self._tabla(calendario)
+        return minuto
+
+    def _instante(self, c, minuto, inicio=False):
+        """Instante (en minutos desde el origen) en que el calendario c acumula 'minuto' minutos laborables"""
+        seg_inicio, _, acum, acum_fin = self.tablas[c]
+        k = bisect_right(acum_fin, minuto) if inicio else bisect_left(acum_fin, minuto)
+        if k < len(acum_fin):
+            # El calendario redondea los instantes al segundo
+            return round((seg_inicio[k] + minuto - acum[k]) * 60) / 60
+
+        calendario = self.calendarios[c]
+        instante = calendario.instante(minuto, inicio=inicio)
+        self.tablas[c] = self._tabla(calendario)
+        return self._minutos(instante)
+
+    def _colocar(self, c, inicio, duracion):
+        """Término (en minutos) de una operación de 'duracion' minutos laborables que parte en 'inicio'"""
+        return self._instante(c, self._laboral(c, inicio) + duracion)
+
+    def programar(self, orden):
+        """Término (en minutos) de cada OT para un orden dado (lista de índices de self.ots)"""
+        setup = self.preparaciones.minutos_defecto
+        preparaciones = self.preparaciones
+        maquina_libre = {}
+        ultima_operacion = {}
+        fines = [0.0] * len(self.ots)
+        if self.agrupar_preparaciones:
+            orden = secuenciar(
+                orden,
+                [[(maquina_id, clave) for _, maquina_id, _, clave in operaciones] for operaciones in self.operaciones],
+                preparaciones,
+                ProductionScheduler.VENTANA_PREPARACION
+            )
+        for i in orden:
+            anterior = None
+            for (c, maquina_id, duracion, clave), desfase in zip(self.operaciones[i], self.desfases[i]):
+                if anterior is None:
+                    inicio = 0.0
+                elif desfase:
+                    # Traslape: parte cuando el anterior entregó su primer lote
+                    c_anterior, inicio_anterior, fin_anterior = anterior
+                    inicio = self._instante(c_anterior, self._laboral(c_anterior, inicio_anterior) + desfase[0]) + setup
+                else:
+                    inicio = anterior[2] + setup
+                libre = maquina_libre.get(maquina_id) if maquina_id else None
+                if libre is not None:
+                    cambio = setup if preparaciones.vacia else preparaciones.minutos(
+                        maquina_id, ultima_operacion.get(maquina_id), clave
+                    )
+                    inicio = max(inicio, libre + cambio)
+                fin = inicio if duracion is None else self._colocar(c, inicio, duracion)
+                if desfase:
+                    # No terminar antes de procesar el último lote del anterior
+                    faltante = self._laboral(c, anterior[2]) + desfase[1] - self._laboral(c, fin)
+                    if faltante > 0:
+                        inicio = self._instante(c, self._laboral(c, inicio) + faltante, inicio=True)
+                        fin = self._colocar(c, inicio, duracion)
+                if maquina_id:
+                    maquina_libre[maquina_id] = fin
+                    ultima_operacion[maquina_id] = clave
+                anterior = (c, inicio, fin)
+            fines[i] = anterior[2] if anterior is not None else 0.0
+        return fines
+
+
+class PriorityOptimizer:
+    """
+    Busca el orden de OTs de un programa que minimiza un objetivo ponderado mediante recocido
+    simulado con presupuesto de tiempo. El objetivo suma las horas de atraso de cada OT contra
+    su fecha de término, multiplicadas por (1 + multa·[OT con multa] + vip·[cliente VIP]), más
+    las horas de makespan por su peso.
+    """
+
+    PESOS = {'atraso': 1.0, 'multa': 2.0, 'vip': 1.0, 'makespan': 0.1}
+    SEGUNDOS_DEFECTO = 5
+    MAX_SEGUNDOS = 60
+
+    def __init__(self, pesos=None):
+        self.pesos = dict(self.PESOS, **{clave: float(valor) for clave, valor in (pesos or {}).items() if clave in self.PESOS})
+
+    def _factores(self, escenario, nucleo):
+        return [
+            self.pesos['atraso'] * (
+                1
+                + self.pesos['multa'] * (ot_id in escenario['ots_multa'])
+                + self.pesos['vip'] * (ot_id in escenario['ots_vip'])
+            )
+            for ot_id in nucleo.ots
+        ]
+
+    def _costo(self, nucleo, factores, orden):
+        fines = nucleo.programar(orden)
+        atraso = 0.0
+        for fin, termino, factor in zip(fines, nucleo.terminos, factores):
+            if termino is not None and fin > termino:
+                atraso += factor * (fin - termino)
+        return (atraso + self.pesos['makespan'] * max(fines, default=0.0)) / 60, fines
+
+    def _indicadores(self, nucleo, costo, fines):
+        atrasos = [
+            (fin - termino) / 60
+            for fin, termino in zip(fines, nucleo.terminos)
+            if termino is not None and fin > termino
+        ]
+        fin = nucleo.origen + timedelta(minutes=max(fines, default=0.0))
+        return {
+            'costo': round(costo, 2),
+            'fecha_fin': fin.strftime('%Y-%m-%d %H:%M'),
+            'makespan_horas': round(max(fines, default=0.0) / 60, 2),
+            'atraso_total_horas': round(sum(atrasos), 2),
+            'ots_atrasadas': len(atrasos)
+        }
+
+    def optimizar(self, programa, segundos=None, semilla=None):
+        """
+        Retorna los indicadores del orden actual y del mejor encontrado, junto con la propuesta
+        de prioridades en el formato de actualización del programa ({'ordenes': [{'orden_trabajo', 'prioridad'}]}).
+        """
+        segundos = min(float(segundos or self.SEGUNDOS_DEFECTO), self.MAX_SEGUNDOS)
+        escenario = WhatIfService().cargar_escenario(programa)
+        nucleo = ProgramacionRapida(escenario)
+        factores = self._factores(escenario, nucleo)
+        rng = random.Random(semilla)
+
+        n = len(nucleo.ots)
+        actual = list(range(n))
+        costo_actual, fines_actual = self._costo(nucleo, factores, actual)
+        inicial = self._indicadores(nucleo, costo_actual, fines_actual)
+        mejor, costo_mejor, fines_mejor = list(actual), costo_actual, fines_actual
+
+        evaluaciones = 1
+        inicio = time.perf_counter()
+        transcurrido = 0.0
+        temperatura_inicial = max(costo_actual * 0.05, 1.0)
+        temperatura = temperatura_inicial
+        while n > 1 and transcurrido < segundos:
+            # Vecino: intercambiar dos OTs o mover una OT a otra posición
+            i, j = rng.sample(range(n), 2)
+            vecino = list(actual)
+            if rng.random() < 0.5:
+                vecino[i], vecino[j] = vecino[j], vecino[i]
+            else:
+                vecino.insert(j, vecino.pop(i))
+
+            costo, fines = self._costo(nucleo, factores, vecino)
+            evaluaciones += 1
+            delta = costo - costo_actual
+            if delta <= 0 or rng.random() < math.exp(-delta / temperatura):
+                actual, costo_actual = vecino, costo
+                if costo < costo_mejor:
+                    mejor, costo_mejor, fines_mejor = list(vecino), costo, fines
+
+            if evaluaciones % 32 == 0:
+                transcurrido = time.perf_counter() - inicio
+                # Enfriamiento geométrico según la fracción del presupuesto consumida
+                temperatura = temperatura_inicial * (0.001 ** (transcurrido / segundos))
+
+        transcurrido = time.perf_counter() - inicio
+        codigos = {ot['orden_trabajo']: ot['orden_trabajo_codigo_ot'] for ot in escenario['ordenes_trabajo']}
+        return {
+            'actual': inicial,
+            'propuesta': self._indicadores(nucleo, costo_mejor, fines_mejor),
+            'ordenes': [
+                {
+                    'orden_trabajo': nucleo.ots[i],
+                    'codigo_ot': codigos[nucleo.ots[i]],
+                    'prioridad': posicion,
+                    'posicion_actual': i + 1
+                }
+                for posicion, i in enumerate(mejor, start=1)
+            ],
+            'pesos': self.pesos,
+            'evaluaciones': evaluaciones,
+            'evaluaciones_por_segundo': round(evaluaciones / transcurrido) if transcurrido else evaluaciones
+        }
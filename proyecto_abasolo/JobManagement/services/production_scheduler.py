@@ -1,8 +1,30 @@
+import heapq
+import logging
+import math
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta, date, time
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
 from .time_calculations import TimeCalculator
 from ..models import TareaFragmentada, ProgramaOrdenTrabajo, Maquina, ItemRuta, ReporteDiarioPrograma, EjecucionTarea
 from Operator.models import AsignacionOperador
 from .machine_availability import MachineAvailabilityService
+from .machine_load import invalidar_mapa_calor
+from .machine_calendars import MachineCalendarService
+from .operator_availability import OperatorAvailability
+from .lot_streaming import desfases_transferencia, inicios_cadena
+from .machine_compatibility import MatrizCompatibilidad
+from .setup_times import MINUTOS_PREPARACION_DEFECTO, MatrizPreparacion, secuenciar
+
+logger = logging.getLogger(__name__)
+
+# Estado de la última programación de cada programa (por proceso), para reprogramar en forma incremental
+MAX_ESTADOS_PROGRAMA = 32
+_estados_programa = OrderedDict()
+_estados_lock = threading.Lock()
+
 
 class ProcessNode:
     def __init__(self, proceso_id, proceso_data, fecha_inicio, fecha_fin, ot_id):
@@ -15,28 +37,20 @@ class ProcessNode:
         self.prioridad = proceso_data.get('prioridad', 0)
         self.intervals = []  # Lista para almacenar los intervalos de tiempo del proceso
         self.ot_id = ot_id  # Guardamos la referencia a la OT
+        self.calendario = None  # Calendario propio de la máquina (None = calendario general)
+        self.piezas = []  # Nodos de cada máquina cuando el proceso se divide entre máquinas compatibles
         
     def actualizar_fechas(self, nueva_fecha_inicio):
         """Actualiza las fechas del proceso y sus intervalos"""
-        # Asegurarnos que la nueva fecha sea un día laboral
-        if not TimeCalculator.is_working_day(nueva_fecha_inicio.date()):
-            nueva_fecha_inicio = datetime.combine(
-                TimeCalculator.get_next_working_day(nueva_fecha_inicio.date()),
-                TimeCalculator.WORKDAY_START
-            )
-        
-        # Si la hora está fuera del horario laboral, ajustar al inicio del siguiente día
-        if nueva_fecha_inicio.time() < TimeCalculator.WORKDAY_START:
-            nueva_fecha_inicio = datetime.combine(nueva_fecha_inicio.date(), TimeCalculator.WORKDAY_START)
-        elif nueva_fecha_inicio.time() > TimeCalculator.WORKDAY_END:
-            siguiente_dia = TimeCalculator.get_next_working_day(nueva_fecha_inicio.date())
-            nueva_fecha_inicio = datetime.combine(siguiente_dia, TimeCalculator.WORKDAY_START)
+        # Llevar la fecha al primer instante laborable (considera fines de semana, feriados y colación)
+        nueva_fecha_inicio = TimeCalculator().ajustar_a_horario_laboral(nueva_fecha_inicio, self.calendario)
 
         # Recalcular los intervalos usando TimeCalculator
         calculo_tiempo = TimeCalculator().calculate_working_days(
             nueva_fecha_inicio,
             float(self.proceso_data['cantidad']),
-            float(self.proceso_data['estandar'])
+            float(self.proceso_data['estandar']),
+            calendario=self.calendario
         )
         
         if 'error' not in calculo_tiempo:
@@ -44,46 +58,23 @@ class ProcessNode:
             self.fecha_fin = calculo_tiempo['next_available_time']
             self.intervals = calculo_tiempo['intervals']
         
-    def propagar_ajuste(self, tiempo_setup=timedelta(minutes=30), procesos_por_maquina=None):
-        """Propaga el ajuste a los procesos siguientes considerando tanto máquinas como dependencias"""
-        # Primero, ajustar procesos de la misma máquina
-        if procesos_por_maquina and self.maquina_id:
-            procesos_misma_maquina = procesos_por_maquina.get(self.maquina_id, [])
-            procesos_misma_maquina.sort(key=lambda x: x.prioridad)
-            
-            mi_indice = procesos_misma_maquina.index(self)
-            fecha_maquina_disponible = self.fecha_fin + tiempo_setup
-            
-            # Ajustar procesos posteriores de la misma máquina
-            for proceso in procesos_misma_maquina[mi_indice + 1:]:
-                if proceso.fecha_inicio < fecha_maquina_disponible:
-                    proceso.actualizar_fechas(fecha_maquina_disponible)
-                    proceso.propagar_ajuste(tiempo_setup, procesos_por_maquina)
-                fecha_maquina_disponible = proceso.fecha_fin + tiempo_setup
-
-        # Luego, propagar a los procesos siguientes de la misma OT
-        siguiente_proceso = self.siguiente_proceso
-        while siguiente_proceso:
-            nueva_fecha_inicio = max(
-                self.fecha_fin + tiempo_setup,
-                siguiente_proceso.fecha_inicio
-            )
-            
-            if nueva_fecha_inicio > siguiente_proceso.fecha_inicio:
-                siguiente_proceso.actualizar_fechas(nueva_fecha_inicio)
-                # Propagar también a los procesos que usan la misma máquina
-                siguiente_proceso.propagar_ajuste(tiempo_setup, procesos_por_maquina)
-            
-            siguiente_proceso = siguiente_proceso.siguiente_proceso
-
     def agregar_intervalo(self, interval_data):
         """Agrega un intervalo de tiempo al proceso"""
         self.intervals.append(interval_data)
 
 class ProductionScheduler:
-    def __init__(self, time_calculator):
+    MAX_ESPERAS_OPERADOR = 200  # Reintentos por operación buscando un operador libre
+    MIN_HORAS_DIVISION = 8  # Solo se dividen entre máquinas los procesos de al menos un turno
+    MAX_HORAS_HUECO_DIVISION = 8  # Tiempo ocioso máximo (un turno) que una pieza puede dejar en otra máquina
+    VENTANA_PREPARACION = 4  # OTs pendientes entre las que se elige la siguiente para reducir setups
+
+    def __init__(self, time_calculator, considerar_operadores=False):
         self.time_calculator = time_calculator if time_calculator else TimeCalculator()
         self.machine_availability = MachineAvailabilityService()
+        self.ultimo_delta = None  # Cambios respecto de la programación anterior del programa
+        # Con considerar_operadores cada operación se ubica solo cuando hay un operador habilitado libre
+        self.considerar_operadores = considerar_operadores
+        self.resumen_operadores = None
 
     def generate_timeline_data(self, programa, ordenes_trabajo):
         """Genera datos del timeline considerando asignaciones y fragmentación"""
@@ -104,17 +95,25 @@ class ProductionScheduler:
             print(f"[ProductionScheduler] Stack trace: {traceback.format_exc()}")
             return {"groups": [], "items": []}
 
-    def _generate_base_timeline(self, programa, ordenes_trabajo):
-        cascade_calculator = ProductionCascadeCalculator(self.time_calculator)
+    def generate_timeline_with_end_date(self, programa, ordenes_trabajo):
+        """
+        Timeline del programa (como generate_timeline_data) y su fecha de término, calculados con
+        una sola programación. Retorna (timeline_data, fecha_fin).
+        """
+        timeline_data = self._generate_base_timeline(programa, ordenes_trabajo)
+        # La fecha de término considera solo lo programado, no las continuaciones ya guardadas
+        fecha_fin = self._fecha_fin_timeline(programa, timeline_data)
+        self._add_fragmented_tasks(timeline_data, programa)
+        return timeline_data, fecha_fin
+
+    def _construir_cadenas(self, ordenes_trabajo):
+        """Grupos del timeline y cadenas de ProcessNode (procesos de cada OT en orden de ruta)"""
         groups = []
-        all_items = []  # Lista separada para todos los items
-        procesos_por_maquina = {}
-        nodos_procesos = {}
+        cadenas = []
 
         for ot_data in ordenes_trabajo:
             ot_id = ot_data['orden_trabajo']
-            fecha_inicio = datetime.combine(programa.fecha_inicio, self.time_calculator.WORKDAY_START)
-            
+
             # Grupo principal (OT)
             group = {
                 "id": f"ot_{ot_id}",
@@ -122,149 +121,596 @@ class ProductionScheduler:
                 "descripcion": ot_data['orden_trabajo_descripcion_producto_ot'],
                 "procesos": []
             }
-            
-            # Calcular tiempos ideales en cascada
-            cascade_times = cascade_calculator.calculate_cascade_times(ot_data['procesos'], fecha_inicio)
-            
-            proceso_anterior = None
+
+            cadena = []
             for proceso in ot_data['procesos']:
                 if not proceso.get('estandar') or not proceso.get('cantidad'):
                     continue
-                
+
                 proceso_id = f"proc_{proceso['id']}"
-                
+
                 # Agregar proceso al grupo
                 group['procesos'].append({
                     "id": proceso_id,
                     "descripcion": proceso['descripcion'],
                     "item": proceso['item']
                 })
-                
-                # Crear nodo de proceso
+
                 nodo = ProcessNode(
                     proceso_id=proceso_id,
                     proceso_data=proceso,
-                    fecha_inicio=cascade_times[proceso_id]['inicio'],
-                    fecha_fin=cascade_times[proceso_id]['fin'],
-                    ot_id=ot_id  # Pasamos el ot_id al constructor
+                    fecha_inicio=None,
+                    fecha_fin=None,
+                    ot_id=ot_id
                 )
-                
+
                 # Establecer dependencia con proceso anterior
-                if proceso_anterior:
-                    proceso_anterior.siguiente_proceso = nodo
-                
-                # Guardar nodo
-                nodos_procesos[proceso_id] = nodo
-                proceso_anterior = nodo
-                
-                # Agrupar por máquina
-                if proceso.get('maquina_id'):
-                    if proceso['maquina_id'] not in procesos_por_maquina:
-                        procesos_por_maquina[proceso['maquina_id']] = []
-                    procesos_por_maquina[proceso['maquina_id']].append(nodo)
-
-                # Generar intervalos iniciales
-                calculo_tiempo = self.time_calculator.calculate_working_days(
-                    nodo.fecha_inicio,
-                    float(proceso['cantidad']),
-                    float(proceso['estandar'])
-                )
-                
-                if 'error' not in calculo_tiempo:
-                    # Agrupar intervalos por día
-                    intervalos_por_dia = {}
-                    
-                    for interval in calculo_tiempo['intervals']:
-                        fecha_dia = interval['fecha_inicio'].date()
-                        if fecha_dia not in intervalos_por_dia:
-                            intervalos_por_dia[fecha_dia] = {
-                                'fecha_inicio': interval['fecha_inicio'],
-                                'fecha_fin': interval['fecha_fin'],
-                                'unidades': interval['unidades'],
-                                'unidades_restantes': interval.get('unidades_restantes', 0)
-                            }
-                        else:
-                            # Actualizar el intervalo existente
-                            intervalos_por_dia[fecha_dia]['fecha_fin'] = interval['fecha_fin']
-                            intervalos_por_dia[fecha_dia]['unidades'] += interval['unidades']
-                            intervalos_por_dia[fecha_dia]['unidades_restantes'] += interval.get('unidades_restantes', 0)
-
-                    # Crear items agrupados por día
-                    for fecha_dia, intervalo_dia in intervalos_por_dia.items():
-                        nodo.agregar_intervalo(intervalo_dia)
+                if cadena:
+                    cadena[-1].siguiente_proceso = nodo
+                cadena.append(nodo)
+
+            cadenas.append(cadena)
+            groups.append(group)
+
+        return groups, cadenas
+
+    def _items_timeline(self, cadenas):
+        """Items del timeline con las fechas asignadas a cada nodo"""
+        all_items = []
+        for cadena in cadenas:
+            for nodo in cadena:
+                # Un proceso dividido aparece una vez por máquina, siempre con el mismo proceso_id
+                for numero, pieza in enumerate(nodo.piezas or [nodo], start=1):
+                    sufijo = f" (parte {numero}/{len(nodo.piezas)})" if nodo.piezas else ""
+                    for interval in pieza.intervals:
+                        # Un intervalo por día: el id es estable entre cálculos (item_{id}_{YYYYMMDD}[_{pieza}])
+                        item_id = f"item_{nodo.proceso_data['id']}_{interval['fecha_inicio'].strftime('%Y%m%d')}"
+                        if nodo.piezas:
+                            item_id += f"_{numero}"
                         item = {
-                            "id": f"item_{proceso['id']}_{fecha_dia.strftime('%Y%m%d')}",
-                            "ot_id": f"ot_{ot_id}",
-                            "proceso_id": proceso_id,
-                            "name": f"{proceso['descripcion']} - {intervalo_dia['unidades']:.0f} de {proceso['cantidad']} unidades",
-                            "start_time": intervalo_dia['fecha_inicio'].strftime('%Y-%m-%d %H:%M:%S'),
-                            "end_time": intervalo_dia['fecha_fin'].strftime('%Y-%m-%d %H:%M:%S'),
-                            "cantidad_total": float(proceso['cantidad']),
-                            "cantidad_intervalo": float(intervalo_dia['unidades']),
-                            "unidades_restantes": float(intervalo_dia['unidades_restantes']),
-                            "estandar": float(proceso['estandar']),
-                            "maquina": proceso.get('maquina_descripcion', 'No asignada'),
-                            "operador_nombre": proceso.get('operador_nombre', 'No asignado'),
-                            "asignado": proceso.get('operador_id') is not None
+                            "id": item_id,
+                            "ot_id": f"ot_{nodo.ot_id}",
+                            "proceso_id": nodo.proceso_id,
+                            "name": f"{pieza.proceso_data['descripcion']} - {interval['unidades']:.0f} de {pieza.proceso_data['cantidad']} unidades{sufijo}",
+                            "start_time": interval['fecha_inicio'].strftime('%Y-%m-%d %H:%M:%S'),
+                            "end_time": interval['fecha_fin'].strftime('%Y-%m-%d %H:%M:%S'),
+                            "cantidad_total": float(nodo.proceso_data['cantidad']),
+                            "cantidad_intervalo": float(interval['unidades']),
+                            "unidades_restantes": float(interval.get('unidades_restantes', 0)),
+                            "estandar": float(nodo.proceso_data['estandar']),
+                            "maquina": pieza.proceso_data.get('maquina_descripcion', 'No asignada'),
+                            "operador_nombre": nodo.proceso_data.get('operador_nombre', 'No asignado'),
+                            "asignado": nodo.proceso_data.get('operador_id') is not None
                         }
+                        if nodo.piezas:
+                            item["division"] = {
+                                "pieza": numero,
+                                "piezas": len(nodo.piezas),
+                                "maquina_id": pieza.maquina_id,
+                                "cantidad": float(pieza.proceso_data['cantidad'])
+                            }
                         all_items.append(item)
-            
-            groups.append(group)
+        return all_items
 
-        # Segunda pasada: resolver conflictos de máquina y propagar ajustes
-        for maquina_id, procesos in procesos_por_maquina.items():
-            procesos.sort(key=lambda x: x.prioridad)
-            fecha_maquina_disponible = procesos[0].fecha_fin + timedelta(minutes=30)
-            
-            for proceso in procesos[1:]:
-                if proceso.fecha_inicio < fecha_maquina_disponible:
-                    proceso.actualizar_fechas(fecha_maquina_disponible)
-                    proceso.propagar_ajuste(procesos_por_maquina=procesos_por_maquina)
-                fecha_maquina_disponible = proceso.fecha_fin + timedelta(minutes=30)
-
-        # Tercera pasada: verificar y corregir secuencia de procesos por OT
-        ot_procesos = {}
-        for nodo in nodos_procesos.values():
-            if nodo.ot_id not in ot_procesos:
-                ot_procesos[nodo.ot_id] = []
-            ot_procesos[nodo.ot_id].append(nodo)
-
-        for ot_id, procesos in ot_procesos.items():
-            procesos.sort(key=lambda x: x.proceso_data['item'])
-            for i in range(len(procesos) - 1):
-                proceso_actual = procesos[i]
-                proceso_siguiente = procesos[i + 1]
-                
-                if proceso_siguiente.fecha_inicio < proceso_actual.fecha_fin + timedelta(minutes=30):
-                    proceso_siguiente.actualizar_fechas(
-                        proceso_actual.fecha_fin + timedelta(minutes=30)
-                    )
-                    proceso_siguiente.propagar_ajuste(procesos_por_maquina=procesos_por_maquina)
+    def _generate_base_timeline(self, programa, ordenes_trabajo):
+        groups, cadenas = self._construir_cadenas(ordenes_trabajo)
 
-        # Actualizar los items con las nuevas fechas
-        all_items.clear()
-        for nodo in nodos_procesos.values():
-            for interval in nodo.intervals:
-                item = {
-                    "id": f"item_{nodo.proceso_data['id']}_{len(all_items)}",
-                    "ot_id": f"ot_{nodo.ot_id}",  # Usamos el ot_id guardado en el nodo
-                    "proceso_id": nodo.proceso_id,
-                    "name": f"{nodo.proceso_data['descripcion']} - {interval['unidades']:.0f} de {nodo.proceso_data['cantidad']} unidades",
-                    "start_time": interval['fecha_inicio'].strftime('%Y-%m-%d %H:%M:%S'),
-                    "end_time": interval['fecha_fin'].strftime('%Y-%m-%d %H:%M:%S'),
-                    "cantidad_total": float(nodo.proceso_data['cantidad']),
-                    "cantidad_intervalo": float(interval['unidades']),
-                    "unidades_restantes": float(interval.get('unidades_restantes', 0)),
-                    "estandar": float(nodo.proceso_data['estandar']),
-                    "maquina": nodo.proceso_data.get('maquina_descripcion', 'No asignada'),
-                    "operador_nombre": nodo.proceso_data.get('operador_nombre', 'No asignado'),
-                    "asignado": nodo.proceso_data.get('operador_id') is not None
-                }
-                all_items.append(item)
+        fecha_inicio = datetime.combine(programa.fecha_inicio, self.time_calculator.WORKDAY_START)
+        lote = getattr(programa, 'lote_transferencia', None)
+        lotes = [lote] * len(cadenas) if lote else None
+        paralelas = getattr(programa, 'maquinas_paralelas', 1) or 1
+        maquinas_paralelas = [paralelas] * len(cadenas) if paralelas > 1 else None
+        agrupar = getattr(programa, 'agrupar_preparaciones', False)
+        if self.considerar_operadores:
+            # La disponibilidad de operadores no forma parte del estado incremental
+            operadores = OperatorAvailability.cargar(
+                {nodo.maquina_id for cadena in cadenas for nodo in cadena if nodo.maquina_id},
+                fecha_inicio,
+                excluir_programa_id=programa.id
+            )
+            colocaciones = self._programar_operaciones(
+                cadenas, fecha_inicio, operadores=operadores, lotes=lotes, agrupar_preparaciones=agrupar
+            )
+            self.ultimo_delta = self._calcular_delta(None, colocaciones)
+        else:
+            previas = self._obtener_estado(programa, fecha_inicio)
+            colocaciones = self._programar_operaciones(
+                cadenas, fecha_inicio, previas=previas, lotes=lotes, maquinas_paralelas=maquinas_paralelas,
+                agrupar_preparaciones=agrupar
+            )
+            self.ultimo_delta = self._calcular_delta(previas, colocaciones)
+            self._guardar_estado(programa, fecha_inicio, colocaciones)
 
         return {
             "groups": groups,
-            "items": all_items
+            "items": self._items_timeline(cadenas)
+        }
+
+    def generate_global_timelines(self, programas_ordenes):
+        """
+        Programa varios programas juntos sobre una línea de tiempo compartida por máquina.
+
+        programas_ordenes: lista de (programa, ordenes_trabajo) en orden de precedencia (las OTs
+        de cada programa en su orden de prioridad). Cada OT comienza no antes del inicio de su
+        programa y cada máquina atiende una operación a la vez entre todos los programas.
+        Retorna {programa_id: (routes_data, fecha_fin)}.
+        """
+        cadenas = []
+        inicios = []
+        lotes = []
+        maquinas_paralelas = []
+        por_programa = []
+        for programa, ordenes_trabajo in programas_ordenes:
+            groups, cadenas_programa = self._construir_cadenas(ordenes_trabajo)
+            inicio_programa = datetime.combine(programa.fecha_inicio, self.time_calculator.WORKDAY_START)
+            por_programa.append((programa, groups, cadenas_programa))
+            cadenas.extend(cadenas_programa)
+            inicios.extend([inicio_programa] * len(cadenas_programa))
+            lotes.extend([getattr(programa, 'lote_transferencia', None)] * len(cadenas_programa))
+            maquinas_paralelas.extend([getattr(programa, 'maquinas_paralelas', 1) or 1] * len(cadenas_programa))
+
+        if not cadenas:
+            return {programa.id: ({"groups": [], "items": []}, programa.fecha_inicio) for programa, _ in programas_ordenes}
+
+        # Las prioridades de cada programa quedan dadas por el orden de las cadenas
+        for cadena in cadenas:
+            for nodo in cadena:
+                nodo.prioridad = 0
+        # Reordenar para reducir setups puede mover OTs entre programas: solo si todos lo permiten
+        colocaciones = self._programar_operaciones(
+            cadenas, min(inicios), inicios=inicios, lotes=lotes, maquinas_paralelas=maquinas_paralelas,
+            agrupar_preparaciones=all(getattr(programa, 'agrupar_preparaciones', False) for programa, _ in programas_ordenes)
+        )
+        self.ultimo_delta = self._calcular_delta(None, colocaciones)
+
+        resultado = {}
+        for programa, groups, cadenas_programa in por_programa:
+            timeline_data = {"groups": groups, "items": self._items_timeline(cadenas_programa)}
+            fecha_fin = self._fecha_fin_timeline(programa, timeline_data)
+            self._add_fragmented_tasks(timeline_data, programa)
+            resultado[programa.id] = (timeline_data, fecha_fin)
+        return resultado
+
+    def _programar_operaciones(self, cadenas, fecha_inicio, tiempo_setup=timedelta(minutes=MINUTOS_PREPARACION_DEFECTO), previas=None,
+                               operadores=None, inicios=None, calendarios=None, lotes=None,
+                               maquinas_paralelas=None, alternativas=None, preparaciones=None,
+                               agrupar_preparaciones=False):
+        """
+        Programa las operaciones en una sola pasada (list scheduling).
+
+        Mantiene una cola de prioridad con las operaciones listas (la primera pendiente de cada
+        OT), ordenada por prioridad de la OT, y el instante en que cada máquina queda libre.
+        Cada operación se ubica exactamente una vez, después de su predecesora en la ruta y de
+        la última operación de su máquina, más el tiempo de setup, y solo dentro del tiempo
+        libre del calendario de su máquina (horario propio, excepciones, bloqueos y mantenciones).
+
+        Si se entregan las colocaciones de una corrida anterior (previas), una OT cuyos procesos
+        no cambiaron y que encuentra sus máquinas libres en los mismos instantes reutiliza su
+        colocación anterior sin recalcular. Retorna las colocaciones por OT.
+
+        Con operadores (OperatorAvailability) la operación además necesita un operador habilitado
+        libre durante todo su tramo: si no hay ninguno se posterga hasta que se libere alguno.
+
+        inicios permite que cada OT tenga su propio instante de inicio (programación de varios
+        programas juntos); por defecto todas comienzan en fecha_inicio. calendarios
+        ({maquina_id: calendario}) evita leerlos de la base de datos.
+
+        lotes (unidades por lote de transferencia de cada OT) activa el traslape entre procesos
+        consecutivos: un proceso puede comenzar cuando el anterior entregó su primer lote, siempre
+        que no termine antes de alcanzar a procesar el último lote del anterior.
+
+        maquinas_paralelas (máximo de máquinas por proceso de cada OT) permite dividir un proceso
+        largo entre su máquina y otras compatibles y operativas (alternativas, {item_ruta_id:
+        [(maquina_id, descripcion)]}; por defecto se leen de Proceso.tipos_maquina_compatibles)
+        cuando así termina antes. No aplica al programar con operadores.
+
+        preparaciones (MatrizPreparacion; por defecto se lee de TiempoPreparacion) define el setup
+        de cada máquina según la operación anterior en ella; tiempo_setup queda como setup por
+        defecto y como espera entre procesos consecutivos de una OT. Con agrupar_preparaciones
+        las OTs se reordenan dentro de una ventana de VENTANA_PREPARACION para reducir el setup
+        total (por ejemplo, agrupando las de una misma familia de producto); como las máquinas
+        no se rellenan hacia atrás, el nuevo orden puede alargar el programa.
+        """
+        maquina_libre = {}
+        ultima_operacion = {}  # Clave de preparación de la última operación de cada máquina
+        colocaciones = {}
+        listos = []
+        if operadores is not None:
+            self.resumen_operadores = {'asignados': 0, 'esperas': 0, 'sin_operador': []}
+
+        if operadores is not None or not any((n or 1) > 1 for n in maquinas_paralelas or []):
+            maquinas_paralelas = None
+        if maquinas_paralelas and alternativas is None:
+            alternativas = self.maquinas_alternativas({nodo.proceso_data['id'] for cadena in cadenas for nodo in cadena})
+        alternativas = alternativas if maquinas_paralelas else {}
+
+        maquina_ids = (
+            {nodo.maquina_id for cadena in cadenas for nodo in cadena}
+            | {maquina_id for candidatas in alternativas.values() for maquina_id, _ in candidatas}
+        )
+        if calendarios is None:
+            calendarios = MachineCalendarService().calendarios(maquina_ids, fecha_inicio)
+        if preparaciones is None:
+            preparaciones = MatrizPreparacion.cargar(
+                {nodo.proceso_data['id'] for cadena in cadenas for nodo in cadena},
+                maquina_ids,
+                tiempo_setup.total_seconds() / 60
+            )
+
+        def preparacion(maquina_id, item_id):
+            """Setup de la máquina antes de la operación, según la última operación que atendió"""
+            if preparaciones.vacia:
+                return tiempo_setup
+            return timedelta(minutes=preparaciones.minutos(
+                maquina_id, ultima_operacion.get(maquina_id), preparaciones.clave(item_id)
+            ))
+
+        for cadena in cadenas:
+            for nodo in cadena:
+                nodo.calendario = calendarios.get(nodo.maquina_id)
+        transferencias = self._desfases_cadenas(cadenas, lotes) if lotes and any(lotes) else {}
+
+        def prioridad_ot(indice_ot):
+            prioridad = cadenas[indice_ot][0].prioridad
+            return prioridad if prioridad is not None else float('inf')
+
+        con_procesos = [indice_ot for indice_ot, cadena in enumerate(cadenas) if cadena]
+        if preparaciones.vacia or not agrupar_preparaciones:
+            for indice_ot in con_procesos:
+                heapq.heappush(listos, (prioridad_ot(indice_ot), indice_ot, 0))
+        else:
+            # La posición en la secuencia que reduce el setup reemplaza a la prioridad en la cola
+            secuencia = secuenciar(
+                sorted(con_procesos, key=lambda indice_ot: (prioridad_ot(indice_ot), indice_ot)),
+                {
+                    indice_ot: [(nodo.maquina_id, preparaciones.clave(nodo.proceso_data['id'])) for nodo in cadenas[indice_ot]]
+                    for indice_ot in con_procesos
+                },
+                preparaciones,
+                self.VENTANA_PREPARACION
+            )
+            for rango, indice_ot in enumerate(secuencia):
+                heapq.heappush(listos, (rango, indice_ot, 0))
+
+        while listos:
+            prioridad, indice_ot, posicion = heapq.heappop(listos)
+            cadena = cadenas[indice_ot]
+            nodo = cadena[posicion]
+
+            paralelas = maquinas_paralelas[indice_ot] if maquinas_paralelas else 1
+            if posicion == 0:
+                division = None
+                maquinas = {n.maquina_id for n in cadena if n.maquina_id}
+                if paralelas > 1:
+                    division = (paralelas,) + tuple(tuple(alternativas.get(n.proceso_data['id'], ())) for n in cadena)
+                    maquinas |= {m for n in cadena for m, _ in alternativas.get(n.proceso_data['id'], ())}
+                setups = None
+                if not preparaciones.vacia:
+                    setups = (preparaciones.firma,) + tuple(preparaciones.clave(n.proceso_data['id']) for n in cadena)
+                firma = self._firma_cadena(cadena, tiempo_setup, lotes[indice_ot] if lotes else None, division, setups)
+                entrada = {
+                    maquina_id: (maquina_libre.get(maquina_id), ultima_operacion.get(maquina_id))
+                    for maquina_id in maquinas
+                }
+                previa = previas.get(nodo.ot_id) if previas else None
+
+                if previa and previa['firma'] == firma and previa['entrada'] == entrada:
+                    # Nada de lo que afecta a esta OT cambió: reutilizar su colocación
+                    for nodo_cadena, (inicio, fin, intervals, piezas) in zip(cadena, previa['nodos']):
+                        nodo_cadena.fecha_inicio = inicio
+                        nodo_cadena.fecha_fin = fin
+                        nodo_cadena.intervals = intervals
+                        nodo_cadena.piezas = piezas
+                    for maquina_id, (libre, ultima) in previa['salida'].items():
+                        maquina_libre[maquina_id] = libre
+                        ultima_operacion[maquina_id] = ultima
+                    colocaciones[nodo.ot_id] = dict(previa, reutilizada=True)
+                    continue
+
+                colocaciones[nodo.ot_id] = {'firma': firma, 'entrada': entrada, 'reutilizada': False}
+
+            inicio = inicios[indice_ot] if inicios else fecha_inicio
+            # Tras un proceso dividido el siguiente espera el término de todas sus piezas
+            desfase = None if posicion > 0 and cadena[posicion - 1].piezas else transferencias.get((indice_ot, posicion))
+            liberacion = inicio if posicion == 0 else max(inicio, cadena[posicion - 1].fecha_fin + tiempo_setup)
+            if desfase:
+                # Traslape: basta con que el anterior haya entregado su primer lote
+                anterior = cadena[posicion - 1]
+                calendario_anterior = anterior.calendario or self.time_calculator.get_calendar()
+                primer_lote = calendario_anterior.instante(
+                    calendario_anterior.minuto_laboral(anterior.fecha_inicio) + desfase[0]
+                )
+                inicio = max(inicio, primer_lote + tiempo_setup)
+            elif posicion > 0:
+                inicio = max(inicio, cadena[posicion - 1].fecha_fin + tiempo_setup)
+            if nodo.maquina_id and nodo.maquina_id in maquina_libre:
+                inicio = max(inicio, maquina_libre[nodo.maquina_id] + preparacion(nodo.maquina_id, nodo.proceso_data['id']))
+
+            nodo.actualizar_fechas(inicio)
+            if nodo.fecha_inicio is None:
+                # Estándar inválido: el proceso no ocupa tiempo
+                nodo.fecha_inicio = nodo.fecha_fin = inicio
+            else:
+                if desfase:
+                    self._esperar_ultimo_lote(nodo, cadena[posicion - 1], desfase[1])
+                if operadores is not None:
+                    self._asignar_operador(nodo, operadores)
+                elif paralelas > 1 and alternativas.get(nodo.proceso_data['id']):
+                    self._dividir_entre_maquinas(
+                        nodo, liberacion, inicios[indice_ot] if inicios else fecha_inicio,
+                        alternativas[nodo.proceso_data['id']], paralelas, maquina_libre,
+                        lambda maquina_id: preparacion(maquina_id, nodo.proceso_data['id']), calendarios
+                    )
+
+            for pieza in nodo.piezas or [nodo]:
+                if pieza.maquina_id:
+                    maquina_libre[pieza.maquina_id] = pieza.fecha_fin
+                    ultima_operacion[pieza.maquina_id] = preparaciones.clave(nodo.proceso_data['id'])
+
+            if posicion + 1 < len(cadena):
+                heapq.heappush(listos, (prioridad, indice_ot, posicion + 1))
+            else:
+                colocaciones[nodo.ot_id].update({
+                    'nodos': [(n.fecha_inicio, n.fecha_fin, n.intervals, n.piezas) for n in cadena],
+                    'procesos': [n.proceso_id for n in cadena],
+                    'salida': {
+                        maquina_id: (maquina_libre[maquina_id], ultima_operacion.get(maquina_id))
+                        for maquina_id in colocaciones[nodo.ot_id]['entrada'] if maquina_id in maquina_libre
+                    },
+                })
+
+        return colocaciones
+
+    def _desfases_cadenas(self, cadenas, lotes):
+        """
+        Desfases de traslape de todas las operaciones, calculados en una sola pasada vectorizada.
+        Retorna {(indice_ot, posicion): (adelanto, cola)} solo para las operaciones con traslape.
+        """
+        posiciones = [
+            (indice_ot, posicion)
+            for indice_ot, cadena in enumerate(cadenas)
+            for posicion in range(len(cadena))
+        ]
+        if not posiciones:
+            return {}
+        nodos = [cadenas[indice_ot][posicion] for indice_ot, posicion in posiciones]
+        adelanto, cola = desfases_transferencia(
+            [float(nodo.proceso_data['cantidad']) for nodo in nodos],
+            [float(nodo.proceso_data['estandar']) for nodo in nodos],
+            [posicion == 0 for _, posicion in posiciones],
+            [float(lotes[indice_ot] or 0) for indice_ot, _ in posiciones]
+        )
+        return {
+            clave: (float(a), float(c))
+            for clave, a, c in zip(posiciones, adelanto, cola)
+            if not math.isnan(a)
+        }
+
+    def _esperar_ultimo_lote(self, nodo, anterior, cola):
+        """Posterga el nodo si terminaría antes de procesar el último lote de su proceso anterior"""
+        calendario = nodo.calendario or self.time_calculator.get_calendar()
+        faltante = (
+            calendario.minuto_laboral(anterior.fecha_fin) + cola
+            - calendario.minuto_laboral(nodo.fecha_fin)
+        )
+        if faltante > 0:
+            nodo.actualizar_fechas(calendario.instante(
+                calendario.minuto_laboral(nodo.fecha_inicio) + faltante,
+                inicio=True
+            ))
+
+    @staticmethod
+    def maquinas_alternativas(item_ids):
+        """
+        Máquinas operativas compatibles con el proceso de cada ItemRuta, según la matriz de
+        compatibilidad. Retorna {item_ruta_id: [(maquina_id, descripcion), ...]}.
+        """
+        proceso_por_item = dict(ItemRuta.objects.filter(id__in=item_ids).values_list('id', 'proceso_id'))
+        compatibilidad = MatrizCompatibilidad.cargar(set(proceso_por_item.values()))
+
+        alternativas = {}
+        for item_id, proceso_id in proceso_por_item.items():
+            maquinas = compatibilidad.maquinas(proceso_id)
+            if maquinas:
+                alternativas[item_id] = [
+                    (maquina_id, compatibilidad.descripciones[maquina_id]) for maquina_id in maquinas
+                ]
+        return alternativas
+
+    def _dividir_entre_maquinas(self, nodo, liberacion, origen, candidatas, paralelas, maquina_libre, preparacion,
+                                calendarios):
+        """
+        Divide el nodo entre su máquina y hasta paralelas - 1 máquinas compatibles ociosas (las
+        que quedan libres antes) si así termina antes que en su máquina sola. Las cantidades se
+        eligen para que las piezas terminen juntas: se busca el instante en que las máquinas,
+        partiendo cuando cada una queda libre, alcanzan a producir entre todas la cantidad del
+        proceso. Se usa el estándar del proceso en todas las máquinas y se descartan las piezas
+        de menos de una hora de producción, que no compensan el setup. preparacion(maquina_id)
+        retorna el setup de cada máquina antes de su pieza.
+        """
+        cantidad = float(nodo.proceso_data['cantidad'])
+        estandar = float(nodo.proceso_data['estandar'])
+        if not nodo.maquina_id or cantidad * 60 / estandar < self.MIN_HORAS_DIVISION * 60:
+            return
+
+        def disponible(maquina_id, descripcion):
+            calendario = calendarios.get(maquina_id) or self.time_calculator.get_calendar()
+            libre = maquina_libre.get(maquina_id)
+            listo = liberacion if libre is None else max(liberacion, libre + preparacion(maquina_id))
+            listo = calendario.ajustar_inicio(listo)
+            hueco = calendario.minuto_laboral(listo) - calendario.minuto_laboral(origen if libre is None else libre)
+            return (listo, maquina_id, descripcion, calendario, calendario.minuto_laboral(listo), hueco)
+
+        # Solo máquinas ociosas y sin dejar huecos largos: las máquinas se ocupan siempre hacia
+        # adelante, así que el tiempo ocioso antes de una pieza ya no lo aprovechan las OTs siguientes
+        otras = sorted(
+            maquina for maquina in (
+                disponible(maquina_id, descripcion)
+                for maquina_id, descripcion in candidatas
+                if maquina_id != nodo.maquina_id
+            )
+            if maquina[0] <= nodo.fecha_inicio and maquina[5] <= self.MAX_HORAS_HUECO_DIVISION * 60
+        )
+        maquinas = [disponible(nodo.maquina_id, nodo.proceso_data.get('maquina_descripcion'))] + otras[:paralelas - 1]
+
+        def producibles(maquina, instante):
+            return max(0.0, maquina[3].minuto_laboral(instante) - maquina[4]) * estandar / 60
+
+        while len(maquinas) > 1:
+            bajo, alto = min(m[0] for m in maquinas), nodo.fecha_fin
+            if sum(producibles(m, alto) for m in maquinas) <= cantidad:
+                return  # Las demás máquinas no adelantan el término
+            while alto - bajo > timedelta(minutes=1):
+                medio = bajo + (alto - bajo) / 2
+                if sum(producibles(m, medio) for m in maquinas) >= cantidad:
+                    alto = medio
+                else:
+                    bajo = medio
+            cantidades = [producibles(m, alto) for m in maquinas]
+            utiles = [m for m, q in zip(maquinas, cantidades) if q >= estandar]
+            if len(utiles) == len(maquinas):
+                break
+            maquinas = utiles
+        if len(maquinas) < 2:
+            return
+
+        # Unidades enteras por pieza; la pieza mayor absorbe el resto
+        cantidades = [math.floor(q) for q in cantidades]
+        mayor = cantidades.index(max(cantidades))
+        cantidades[mayor] = cantidad - (sum(cantidades) - cantidades[mayor])
+
+        piezas = []
+        for (listo, maquina_id, descripcion, *_), cantidad_pieza in zip(maquinas, cantidades):
+            pieza = ProcessNode(
+                proceso_id=nodo.proceso_id,
+                proceso_data=dict(
+                    nodo.proceso_data,
+                    cantidad=cantidad_pieza,
+                    maquina_id=maquina_id,
+                    maquina_descripcion=descripcion
+                ),
+                fecha_inicio=None,
+                fecha_fin=None,
+                ot_id=nodo.ot_id
+            )
+            pieza.calendario = calendarios.get(maquina_id)
+            pieza.actualizar_fechas(listo)
+            if pieza.fecha_inicio is None:
+                return
+            piezas.append(pieza)
+
+        fin = max(pieza.fecha_fin for pieza in piezas)
+        if fin < nodo.fecha_fin:
+            nodo.piezas = piezas
+            nodo.fecha_inicio = min(pieza.fecha_inicio for pieza in piezas)
+            nodo.fecha_fin = fin
+            nodo.intervals = []
+
+    def _asignar_operador(self, nodo, operadores):
+        """Posterga el nodo hasta que un operador habilitado esté libre en todo su tramo y lo reserva"""
+        resumen = self.resumen_operadores
+        if not operadores.candidatos(nodo.maquina_id):
+            resumen['sin_operador'].append(nodo.proceso_id)
+            return
+
+        for _ in range(self.MAX_ESPERAS_OPERADOR):
+            operador_id, liberacion = operadores.elegir(nodo.maquina_id, nodo.fecha_inicio, nodo.fecha_fin)
+            if operador_id is not None:
+                operadores.reservar(operador_id, nodo.fecha_inicio, nodo.fecha_fin)
+                nodo.proceso_data = dict(
+                    nodo.proceso_data,
+                    operador_id=operador_id,
+                    operador_nombre=operadores.nombres.get(operador_id)
+                )
+                resumen['asignados'] += 1
+                return
+            resumen['esperas'] += 1
+            nodo.actualizar_fechas(liberacion)
+
+        resumen['sin_operador'].append(nodo.proceso_id)
+
+    def _firma_cadena(self, cadena, tiempo_setup, lote=None, division=None, setups=None):
+        """Datos de la OT que determinan su colocación (procesos, máquinas, cantidades, estándares, calendarios, lote, división y setups)"""
+        return (tiempo_setup, lote, division, setups) + tuple(
+            (
+                nodo.proceso_id,
+                nodo.maquina_id,
+                float(nodo.proceso_data['cantidad']),
+                float(nodo.proceso_data['estandar']),
+                getattr(nodo.calendario, 'firma', None)
+            )
+            for nodo in cadena
+        )
+
+    def _obtener_estado(self, programa, fecha_inicio):
+        """Colocaciones de la última programación del programa, si siguen siendo comparables"""
+        if not getattr(programa, 'id', None):
+            return None
+        with _estados_lock:
+            estado = _estados_programa.get(programa.id)
+            if not estado:
+                return None
+            _estados_programa.move_to_end(programa.id)
+        if estado['fecha_inicio'] != fecha_inicio or estado['calendario'] is not self.time_calculator.get_calendar():
+            return None
+        return estado['colocaciones']
+
+    def _guardar_estado(self, programa, fecha_inicio, colocaciones):
+        if not getattr(programa, 'id', None):
+            return
+        with _estados_lock:
+            _estados_programa[programa.id] = {
+                'fecha_inicio': fecha_inicio,
+                'calendario': self.time_calculator.get_calendar(),
+                'colocaciones': colocaciones,
+            }
+            _estados_programa.move_to_end(programa.id)
+            while len(_estados_programa) > MAX_ESTADOS_PROGRAMA:
+                _estados_programa.popitem(last=False)
+
+    @staticmethod
+    def descartar_estado(programa_id=None):
+        """Descarta el estado incremental de un programa (o de todos)"""
+        with _estados_lock:
+            if programa_id is None:
+                _estados_programa.clear()
+            else:
+                _estados_programa.pop(programa_id, None)
+
+    def _calcular_delta(self, previas, colocaciones):
+        """
+        Compara dos programaciones y retorna los procesos cuyo inicio o término cambió.
+        Sin programación previa todos los procesos se informan como agregados.
+        """
+        def fechas_por_proceso(colocaciones_ot):
+            fechas = {}
+            for ot_id, colocacion in (colocaciones_ot or {}).items():
+                for proceso_id, (inicio, fin, *_) in zip(colocacion['procesos'], colocacion['nodos']):
+                    fechas[proceso_id] = (ot_id, inicio, fin)
+            return fechas
+
+        anteriores = fechas_por_proceso(previas)
+        actuales = fechas_por_proceso(colocaciones)
+
+        movidos = []
+        for proceso_id, (ot_id, inicio, fin) in actuales.items():
+            anterior = anteriores.get(proceso_id)
+            if anterior and (anterior[1], anterior[2]) != (inicio, fin):
+                movidos.append({
+                    'proceso_id': proceso_id,
+                    'ot_id': f"ot_{ot_id}",
+                    'inicio_anterior': anterior[1].strftime('%Y-%m-%d %H:%M:%S'),
+                    'fin_anterior': anterior[2].strftime('%Y-%m-%d %H:%M:%S'),
+                    'start_time': inicio.strftime('%Y-%m-%d %H:%M:%S'),
+                    'end_time': fin.strftime('%Y-%m-%d %H:%M:%S'),
+                })
+
+        return {
+            'movidos': movidos,
+            'agregados': [proceso_id for proceso_id in actuales if proceso_id not in anteriores],
+            'eliminados': [proceso_id for proceso_id in anteriores if proceso_id not in actuales],
+            'ots_recalculadas': sum(1 for c in colocaciones.values() if not c['reutilizada']),
+            'ots_reutilizadas': sum(1 for c in colocaciones.values() if c['reutilizada']),
         }
 
     def _add_fragmented_tasks(self, timeline_data, programa):
@@ -356,39 +802,44 @@ class ProductionScheduler:
             # Generar timeline data para obtener los nodos y sus intervalos ajustados
             timeline_data = self._generate_base_timeline(programa, ordenes_trabajo)
             
-            # Si no hay items, usar la fecha de inicio
-            if not timeline_data.get('items'):
-                return programa.fecha_inicio
+            fecha_fin = self._fecha_fin_timeline(programa, timeline_data)
+            logger.info("Fecha fin calculada para programa %s: %s", programa.id, fecha_fin)
+            return fecha_fin
 
-            # Encontrar la fecha más tardía entre todos los intervalos
-            latest_date = programa.fecha_inicio
-            if isinstance(latest_date, date):
-                latest_date = datetime.combine(latest_date, self.time_calculator.WORKDAY_START)
+        except Exception:
+            logger.exception("Error calculando fecha fin del programa %s", programa.id)
+            return programa.fecha_inicio
 
-            for item in timeline_data['items']:
-                try:
-                    end_time = datetime.strptime(item['end_time'], '%Y-%m-%d %H:%M:%S')
-                    if end_time > latest_date:
-                        latest_date = end_time
-                except (KeyError, ValueError) as e:
-                    continue
+    def _fecha_fin_timeline(self, programa, timeline_data):
+        """Fecha de término del programa según el último intervalo del timeline"""
+        # Si no hay items, usar la fecha de inicio
+        if not timeline_data.get('items'):
+            return programa.fecha_inicio
 
-            # Asegurarnos que la fecha final sea un día laboral
-            if not TimeCalculator.is_working_day(latest_date.date()):
-                latest_date = datetime.combine(
-                    TimeCalculator.get_next_working_day(latest_date.date()),
-                    self.time_calculator.WORKDAY_END
-                )
-            elif latest_date.time() > TimeCalculator.WORKDAY_END:
-                siguiente_dia = TimeCalculator.get_next_working_day(latest_date.date())
-                latest_date = datetime.combine(siguiente_dia, TimeCalculator.WORKDAY_END)
+        # Encontrar la fecha más tardía entre todos los intervalos
+        latest_date = programa.fecha_inicio
+        if isinstance(latest_date, date):
+            latest_date = datetime.combine(latest_date, self.time_calculator.WORKDAY_START)
 
-            print(f"[ProductionScheduler] Fecha fin calculada: {latest_date.date()}")
-            return latest_date.date()
+        for item in timeline_data['items']:
+            try:
+                end_time = datetime.strptime(item['end_time'], '%Y-%m-%d %H:%M:%S')
+                if end_time > latest_date:
+                    latest_date = end_time
+            except (KeyError, ValueError) as e:
+                continue
 
-        except Exception as e:
-            print(f"[ProductionScheduler] Error calculando fecha fin: {str(e)}")
-            return programa.fecha_inicio
+        # Asegurarnos que la fecha final sea un día laboral
+        if not TimeCalculator.is_working_day(latest_date.date()):
+            latest_date = datetime.combine(
+                TimeCalculator.get_next_working_day(latest_date.date()),
+                self.time_calculator.WORKDAY_END
+            )
+        elif latest_date.time() > TimeCalculator.WORKDAY_END:
+            siguiente_dia = TimeCalculator.get_next_working_day(latest_date.date())
+            latest_date = datetime.combine(siguiente_dia, TimeCalculator.WORKDAY_END)
+
+        return latest_date.date()
 
     def _get_program_orders(self, programa):
         """Obtiene las órdenes de trabajo del programa"""
@@ -638,26 +1089,20 @@ class ProductionScheduler:
             # Necesitamos asegurarnos de obtener la timeline completa para todos los días
             timeline_data = self._generate_base_timeline(programa, ordenes_trabajo)
             
-            # Crear ReporteDiarioPrograma para cada día del programa
-            fecha_actual = programa.fecha_inicio
-            while fecha_actual <= programa.fecha_fin:
-                if TimeCalculator.is_working_day(fecha_actual):
-                    ReporteDiarioPrograma.objects.get_or_create(
-                        programa=programa,
-                        fecha=fecha_actual,
-                        defaults={
-                            'estado': 'ABIERTO'
-                        }
-                    )
-                fecha_actual += timedelta(days=1)
+            # Precargar en una sola consulta los ItemRuta del timeline
+            items_ruta = ItemRuta.objects.in_bulk({
+                int(item['proceso_id'].replace('proc_', '')) for item in timeline_data['items']
+            })
 
             # Estructura para agrupar tareas por día e item_ruta
             tareas_agrupadas = {}  # {(fecha, item_ruta_id): {'cantidad': X, 'inicio': time, 'fin': time}}
             
             # Para cada item en la timeline, agrupar por día y proceso
             for item in timeline_data['items']:
-                proceso_id = item['proceso_id'].replace('proc_', '')
-                item_ruta = ItemRuta.objects.get(id=proceso_id)
+                proceso_id = int(item['proceso_id'].replace('proc_', ''))
+                item_ruta = items_ruta.get(proceso_id)
+                if not item_ruta:
+                    continue
                 
                 # Convertir fecha de inicio y fin a objetos datetime
                 start_time = datetime.strptime(item['start_time'], '%Y-%m-%d %H:%M:%S')
@@ -719,41 +1164,27 @@ class ProductionScheduler:
                     
                     current_day += timedelta(days=1)
             
-            # Ahora crear las tareas fragmentadas agrupadas
-            print(f"[ProductionScheduler] Creando {len(tareas_agrupadas)} tareas fragmentadas agrupadas")
-            for (fecha, _), datos in tareas_agrupadas.items():
-                # Crear o actualizar la tarea fragmentada
-                # Solo usamos los campos que sabemos que existen en el modelo
-                TareaFragmentada.objects.update_or_create(
-                    tarea_original=datos['item_ruta'],
-                    programa=programa,
-                    fecha=fecha,
-                    defaults={
-                        'fecha_planificada_inicio': datos['inicio'],
-                        'fecha_planificada_fin': datos['fin'],
-                        'cantidad_asignada': datos['cantidad'],  # Esta es la cantidad total para el día
-                        'cantidad_pendiente_anterior': 0,
-                        'cantidad_completada': 0,
-                        'es_continuacion': False,
-                        'estado': 'PENDIENTE'
-                    }
-                )
-            
-            # Verificar cuántas tareas se crearon por día para depuración
-            dias_con_tareas = TareaFragmentada.objects.filter(programa=programa).values('fecha').distinct().count()
-            print(f"[ProductionScheduler] Tareas fragmentadas creadas en {dias_con_tareas} días diferentes")
-            
-            # Ver si cada día del programa tiene tareas
+            # Ahora guardar las tareas fragmentadas agrupadas en bloque
+            logger.info("Guardando %s tareas fragmentadas agrupadas", len(tareas_agrupadas))
+            with transaction.atomic():
+                self._crear_reportes_diarios(programa)
+                resultado = self._guardar_tareas_fragmentadas(programa, tareas_agrupadas)
+            logger.info("%s tareas creadas, %s actualizadas", resultado['creadas'], resultado['actualizadas'])
+
+            # Resumen por día (una sola consulta)
+            tareas_por_dia = dict(
+                TareaFragmentada.objects.filter(programa=programa)
+                .values_list('fecha')
+                .annotate(total=Count('id'))
+            )
+            logger.info("Tareas fragmentadas creadas en %s días diferentes", len(tareas_por_dia))
+
             fecha_actual = programa.fecha_inicio
             while fecha_actual <= programa.fecha_fin:
                 if TimeCalculator.is_working_day(fecha_actual):
-                    count = TareaFragmentada.objects.filter(
-                        programa=programa, 
-                        fecha=fecha_actual
-                    ).count()
-                    print(f"[ProductionScheduler] Fecha {fecha_actual}: {count} tareas")
+                    logger.debug("Fecha %s: %s tareas", fecha_actual, tareas_por_dia.get(fecha_actual, 0))
                 fecha_actual += timedelta(days=1)
-            
+
             return True
         except Exception as e:
             print(f"[ProductionScheduler] Error en create_fragmented_tasks: {str(e)}")
@@ -762,45 +1193,109 @@ class ProductionScheduler:
             return False
 
 
+    def _crear_reportes_diarios(self, programa):
+        """Crea los ReporteDiarioPrograma que falten para los días laborales del programa"""
+        existentes = set(
+            ReporteDiarioPrograma.objects.filter(programa=programa).values_list('fecha', flat=True)
+        )
+        nuevos = []
+        fecha_actual = programa.fecha_inicio
+        while fecha_actual <= programa.fecha_fin:
+            if TimeCalculator.is_working_day(fecha_actual) and fecha_actual not in existentes:
+                nuevos.append(ReporteDiarioPrograma(programa=programa, fecha=fecha_actual, estado='ABIERTO'))
+            fecha_actual += timedelta(days=1)
+        ReporteDiarioPrograma.objects.bulk_create(nuevos)
+
+    def _guardar_tareas_fragmentadas(self, programa, tareas_agrupadas):
+        """
+        Compara las tareas planificadas con las TareaFragmentada existentes del programa y
+        aplica bulk_create / bulk_update. tareas_agrupadas: {(fecha, item_ruta_id): datos}
+        """
+        existentes = {
+            (tarea.fecha, tarea.tarea_original_id): tarea
+            for tarea in TareaFragmentada.objects.filter(
+                programa=programa,
+                tarea_original_id__in={item_ruta_id for _, item_ruta_id in tareas_agrupadas}
+            )
+        }
+
+        ahora = timezone.now()
+        nuevas = []
+        modificadas = []
+        for clave, datos in tareas_agrupadas.items():
+            valores = {
+                'fecha_planificada_inicio': datos['inicio'],
+                'fecha_planificada_fin': datos['fin'],
+                'cantidad_asignada': datos['cantidad'],  # Esta es la cantidad total para el día
+                'cantidad_pendiente_anterior': 0,
+                'cantidad_completada': 0,
+                'es_continuacion': False,
+                'estado': 'PENDIENTE'
+            }
+            tarea = existentes.get(clave)
+            if tarea:
+                for campo, valor in valores.items():
+                    setattr(tarea, campo, valor)
+                tarea.updated_at = ahora
+                modificadas.append(tarea)
+            else:
+                nuevas.append(TareaFragmentada(
+                    tarea_original=datos['item_ruta'],
+                    programa=programa,
+                    fecha=clave[0],
+                    **valores
+                ))
+
+        TareaFragmentada.objects.bulk_create(nuevas, batch_size=500)
+        TareaFragmentada.objects.bulk_update(
+            modificadas,
+            [
+                'fecha_planificada_inicio', 'fecha_planificada_fin', 'cantidad_asignada',
+                'cantidad_pendiente_anterior', 'cantidad_completada', 'es_continuacion',
+                'estado', 'updated_at'
+            ],
+            batch_size=500
+        )
+        # bulk_create / bulk_update no emiten señales
+        invalidar_mapa_calor()
+        return {'creadas': len(nuevas), 'actualizadas': len(modificadas)}
+
+
 class ProductionCascadeCalculator:
     def __init__(self, time_calculator):
         self.time_calculator = time_calculator
 
-    def calculate_cascade_times(self, procesos, fecha_inicio):
+    def calculate_cascade_times(self, procesos, fecha_inicio, lote=None):
+        """
+        Inicio y término de una cadena de procesos con traslape por lotes de transferencia, sobre
+        el calendario general y sin considerar la ocupación de las máquinas. Por defecto cada
+        proceso recibe lotes de una hora de producción del proceso anterior.
+        """
+        procesos = [
+            p for p in procesos
+            if float(p.get('estandar') or 0) > 0 and float(p.get('cantidad') or 0) > 0
+        ]
+        if not procesos:
+            return {}
+
+        cantidades = [float(p['cantidad']) for p in procesos]
+        estandares = [float(p['estandar']) for p in procesos]
+        lotes = [lote or estandares[max(i - 1, 0)] for i in range(len(procesos))]
+        adelanto, cola = desfases_transferencia(
+            cantidades, estandares, [i == 0 for i in range(len(procesos))], lotes
+        )
+        duraciones = [math.ceil(c * 60 / e - 1e-9) for c, e in zip(cantidades, estandares)]
+        inicios = inicios_cadena(duraciones, adelanto, cola)
+
+        calendario = self.time_calculator.get_calendar()
+        origen = calendario.minuto_laboral(fecha_inicio)
         cascade_times = {}
-        
-        # Identificar el proceso más lento
-        proceso_mas_lento = min(procesos, key=lambda p: float(p.get('estandar', float('inf'))))
-        estandar_mas_lento = float(proceso_mas_lento.get('estandar', 0))
-        
-        fecha_actual = fecha_inicio
-        unidades_disponibles = 0
-        
-        for proceso in procesos:
-            proceso_id = f"proc_{proceso['id']}"
-            estandar = float(proceso.get('estandar', 0))
-            cantidad_total = float(proceso.get('cantidad', 0))
-            
-            # Calcular cantidad mínima para iniciar este proceso
-            cantidad_minima = estandar  # Una hora de producción
-            
-            # Esperar hasta tener suficientes unidades del proceso anterior
-            if unidades_disponibles < cantidad_minima:
-                tiempo_espera = (cantidad_minima - unidades_disponibles) / estandar_mas_lento
-                fecha_actual += timedelta(hours=tiempo_espera)
-            
-            # Calcular tiempo de proceso ajustado al cuello de botella
-            tiempo_proceso = cantidad_total / min(estandar, estandar_mas_lento)
-            
-            cascade_times[proceso_id] = {
-                'inicio': fecha_actual,
-                'fin': fecha_actual + timedelta(hours=tiempo_proceso),
-                'cantidad_por_hora': min(estandar, estandar_mas_lento)
+        for proceso, inicio, duracion, estandar in zip(procesos, inicios, duraciones, estandares):
+            cascade_times[f"proc_{proceso['id']}"] = {
+                'inicio': calendario.instante(origen + float(inicio), inicio=True),
+                'fin': calendario.instante(origen + float(inicio) + duracion),
+                'cantidad_por_hora': estandar
             }
-            
-            fecha_actual = cascade_times[proceso_id]['fin']
-            unidades_disponibles = cantidad_total
-            
         return cascade_times
 
     def get_production_at_time(self, proceso_info, tiempo):
@@ -0,0 +1,153 @@
+from django.db.models import Q
+
+from JobManagement.models import ItemRuta, TiempoPreparacion
+from Product.models import FamiliaProducto, Pieza, Producto
+
+# Setup cuando no hay una fila de TiempoPreparacion que calce (y espera entre procesos de una OT)
+MINUTOS_PREPARACION_DEFECTO = 30
+
+
+class MatrizPreparacion:
+    """
+    Tiempos de preparación dependientes de la secuencia, cargados una vez por programación.
+
+    Solo se guardan las filas definidas en TiempoPreparacion, como {(maquina, proceso_anterior,
+    proceso_siguiente, familia_anterior, familia_siguiente): minutos} con None como comodín.
+    Cada consulta usa la fila más específica que calce (primero la máquina, luego el par de
+    procesos y luego el de familias) o el setup por defecto si ninguna calza, y se memoriza.
+
+    Las operaciones se identifican por su clave (proceso_id, familia_id): el proceso del
+    ItemRuta y la familia del producto o pieza de su OT.
+    """
+
+    def __init__(self, filas, claves=None, minutos_defecto=MINUTOS_PREPARACION_DEFECTO):
+        self.filas = dict(filas)
+        self.claves = dict(claves or {})
+        self.minutos_defecto = minutos_defecto
+        self.firma = (minutos_defecto, frozenset(self.filas.items()))
+        self._memo = {}
+
+    @property
+    def vacia(self):
+        """Sin filas todos los cambios usan el setup por defecto"""
+        return not self.filas
+
+    @classmethod
+    def cargar(cls, item_ids, maquina_ids=None, minutos_defecto=MINUTOS_PREPARACION_DEFECTO):
+        """Filas de las máquinas indicadas (más las generales) y claves de los ItemRuta, en pocas consultas"""
+        filas = TiempoPreparacion.objects.all()
+        if maquina_ids is not None:
+            filas = filas.filter(Q(maquina_id__in=maquina_ids) | Q(maquina__isnull=True))
+        filas = {
+            (maquina_id, proceso_anterior, proceso_siguiente, familia_anterior, familia_siguiente): minutos
+            for maquina_id, proceso_anterior, proceso_siguiente, familia_anterior, familia_siguiente, minutos
+            in filas.values_list(
+                'maquina_id', 'proceso_anterior_id', 'proceso_siguiente_id',
+                'familia_anterior_id', 'familia_siguiente_id', 'minutos'
+            )
+        }
+        # Sin filas no hace falta identificar las operaciones
+        claves = cls.claves_items(item_ids) if filas else {}
+        return cls(filas, claves, minutos_defecto)
+
+    @staticmethod
+    def claves_items(item_ids):
+        """Retorna {item_ruta_id: (proceso_id, familia_id)}"""
+        datos = list(ItemRuta.objects.filter(id__in=item_ids).values_list(
+            'id', 'proceso_id', 'ruta__orden_trabajo__codigo_producto_salida'
+        ))
+        codigos = {codigo for _, _, codigo in datos} - {None, ''}
+
+        familias = dict(Producto.objects.filter(
+            codigo_producto__in=codigos, familia_producto__isnull=False
+        ).values_list('codigo_producto', 'familia_producto_id'))
+        for codigo, familia_id in Pieza.objects.filter(
+            codigo_pieza__in=codigos - set(familias), familia_producto__isnull=False
+        ).values_list('codigo_pieza', 'familia_producto_id'):
+            familias[codigo] = familia_id
+
+        # Sin producto ni pieza registrados, la familia sale de los dos primeros dígitos del código (como en Producto.save)
+        prefijos = dict(FamiliaProducto.objects.filter(
+            codigo_familia__in={codigo[:2] for codigo in codigos if codigo not in familias}
+        ).values_list('codigo_familia', 'id'))
+
+        return {
+            item_id: (proceso_id, familias.get(codigo) or prefijos.get((codigo or '')[:2]))
+            for item_id, proceso_id, codigo in datos
+        }
+
+    def clave(self, item_id):
+        return self.claves.get(item_id, (None, None))
+
+    def minutos(self, maquina_id, anterior, siguiente):
+        """Minutos de preparación de la máquina al pasar de la operación anterior a la siguiente (claves)"""
+        if not self.filas or anterior is None:
+            return self.minutos_defecto
+
+        consulta = (maquina_id, anterior, siguiente)
+        if consulta in self._memo:
+            return self._memo[consulta]
+
+        (proceso_anterior, familia_anterior), (proceso_siguiente, familia_siguiente) = anterior, siguiente
+        candidatas = (
+            (maquina,) + procesos + familias
+            for maquina in (maquina_id, None)
+            for procesos in self._pares(proceso_anterior, proceso_siguiente)
+            for familias in self._pares(familia_anterior, familia_siguiente)
+        )
+        minutos = next((self.filas[fila] for fila in candidatas if fila in self.filas), self.minutos_defecto)
+        self._memo[consulta] = minutos
+        return minutos
+
+    @staticmethod
+    def _pares(anterior, siguiente):
+        """Pares a consultar, del más específico al comodín"""
+        return ((anterior, siguiente), (None, siguiente), (anterior, None), (None, None))
+
+    def __getstate__(self):
+        # El memo se rehace en cada proceso
+        return dict(self.__dict__, _memo={})
+
+
+def secuenciar(orden, trabajos, matriz, ventana):
+    """
+    Reordena las OTs para reducir el setup total, agrupando las que encadenan cambios cortos
+    (por ejemplo, de la misma familia de producto) en cada máquina.
+
+    orden: índices de las OTs en orden de prioridad; trabajos[i]: [(maquina_id, clave)] de las
+    operaciones de la OT i, en orden de ruta. En cada paso se elige, entre las 'ventana'
+    primeras OTs pendientes, la que agrega menos minutos de preparación respecto del setup por
+    defecto, dada la última operación de cada máquina; en empate, la de mayor prioridad. La
+    primera OT pendiente no se posterga más de ventana - 1 veces.
+    """
+    if matriz.vacia or ventana <= 1:
+        return list(orden)
+
+    pendientes = list(orden)
+    ultimos = {}
+    resultado = []
+    postergaciones = 0
+    while pendientes:
+        elegido = 0
+        if postergaciones < ventana - 1:
+            mejor = None
+            for posicion, i in enumerate(pendientes[:ventana]):
+                costo = 0
+                vistos = {}
+                for maquina_id, clave in trabajos[i]:
+                    if not maquina_id:
+                        continue
+                    anterior = vistos.get(maquina_id, ultimos.get(maquina_id))
+                    if anterior is not None:
+                        costo += matriz.minutos(maquina_id, anterior, clave) - matriz.minutos_defecto
+                    vistos[maquina_id] = clave
+                if mejor is None or costo < mejor:
+                    mejor, elegido = costo, posicion
+
+        postergaciones = postergaciones + 1 if elegido else 0
+        i = pendientes.pop(elegido)
+        resultado.append(i)
+        for maquina_id, clave in trabajos[i]:
+            if maquina_id:
+                ultimos[maquina_id] = clave
+    return resultado
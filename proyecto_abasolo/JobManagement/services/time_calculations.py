@@ -1,4 +1,59 @@
-from datetime import datetime, time, timedelta
+import math
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from datetime import date as date_cls, datetime, time, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .working_calendar import WorkingCalendar
+
+
+class IntervalCache:
+    """
+    Caché LRU acotada para los resultados de calculate_working_days.
+    Se comparte entre todas las instancias de TimeCalculator del proceso.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                self.hits += 1
+                return self._datos[clave]
+            self.misses += 1
+            return None
+
+    def put(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maxsize:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._datos),
+                'maxsize': self.maxsize,
+            }
+
 
 class TimeCalculator:
     WORKDAY_START = time(7, 45)
@@ -8,19 +63,66 @@ class TimeCalculator:
     BREAK_END = time(14, 0)
     WORK_HOURS = 9  # L-J
     FRIDAY_HOURS = 8  # Viernes
+    HOLIDAYS_COUNTRY = 'CL'  # Feriados nacionales considerados en el calendario
+
+    INTERVAL_CACHE_SIZE = 4096  # Resultados de calculate_working_days memorizados por proceso
+
+    _calendar = None
+    _calendar_lock = threading.Lock()
+    _interval_cache = IntervalCache(INTERVAL_CACHE_SIZE)
+
+    @classmethod
+    def get_calendar(cls):
+        """Obtiene el índice de calendario laboral compartido por el proceso (se construye una vez)"""
+        if cls._calendar is None:
+            with cls._calendar_lock:
+                if cls._calendar is None:
+                    hoy = date_cls.today()
+                    cls._calendar = WorkingCalendar(
+                        date_cls(hoy.year - 3, 1, 1),
+                        date_cls(hoy.year + 5, 12, 31),
+                        cls.WORKDAY_START,
+                        cls.WORKDAY_END,
+                        cls.FRIDAY_END,
+                        cls.BREAK_START,
+                        cls.BREAK_END,
+                        cargar_feriados_pais=cls.HOLIDAYS_COUNTRY
+                    )
+        return cls._calendar
+
+    @classmethod
+    def reset_calendar(cls):
+        """Descarta el índice del calendario para que se reconstruya con las reglas vigentes"""
+        with cls._calendar_lock:
+            cls._calendar = None
+        cls.clear_cache()
+
+    @classmethod
+    def cache_info(cls):
+        """Estadísticas de la caché de intervalos (aciertos, fallos, tamaño)"""
+        return cls._interval_cache.info()
+
+    @classmethod
+    def clear_cache(cls):
+        """Vacía la caché de intervalos (p.ej. al cambiar feriados u horarios)"""
+        cls._interval_cache.clear()
+
+    @staticmethod
+    def a_hora_local(fecha_hora):
+        """Lleva un datetime con zona a la hora local sin zona (como trabaja el calendario)"""
+        if fecha_hora is not None and timezone.is_aware(fecha_hora):
+            return timezone.localtime(fecha_hora).replace(tzinfo=None)
+        return fecha_hora
 
     @staticmethod
     def is_working_day(date):
-        """Determina si una fecha es día laboral (L-V)"""
-        return date.weekday() < 5
+        """Determina si una fecha es día laboral (L-V sin feriados)"""
+        return TimeCalculator.get_calendar().es_dia_laboral(date)
     
     @staticmethod
     def get_next_working_day(date):
         """Obtiene el siguiente día laboral"""
-        next_day = date + timedelta(days=1)
-        while not TimeCalculator.is_working_day(next_day):
-            next_day += timedelta(days=1)
-        return next_day
+        return TimeCalculator.get_calendar().siguiente_dia_laboral(date)
 
     def get_workday_end(self, date):
         """Obtiene la hora de fin según el día de la semana"""
@@ -30,9 +132,169 @@ class TimeCalculator:
         """Obtiene las horas laborables según el día de la semana"""
         return self.FRIDAY_HOURS if date.weekday() == 4 else self.WORK_HOURS
 
-    def calculate_working_days(self, start_date, cantidad, estandar, cantidad_minima_siguiente=None):
+    def calculate_working_days(self, start_date, cantidad, estandar, cantidad_minima_siguiente=None, por_hora=False,
+                               calendario=None):
+        """
+        Calcula los días laborables que ocupa un proceso considerando horario especial de viernes
+        y feriados.
+
+        Por defecto salta directamente al instante de término usando el índice del calendario
+        laboral y retorna un intervalo agregado por día. Con por_hora=True se obtiene el detalle
+        hora a hora.
+
+        Con calendario se usa el calendario propio de una máquina (ver MachineCalendarService) en
+        lugar del general; el modo por_hora siempre usa el horario general.
+
+        Los resultados se memorizan en una caché LRU compartida (ver cache_info / clear_cache).
+        """
+        if not isinstance(start_date, datetime):
+            start_date = datetime.combine(start_date, self.WORKDAY_START)
+
+        clave = (
+            start_date,
+            self._normalizar_numero(cantidad),
+            self._normalizar_numero(estandar),
+            self._normalizar_numero(cantidad_minima_siguiente) if por_hora else None,
+            bool(por_hora),
+            # La versión y no el objeto: no retiene calendarios y calendarios iguales comparten entradas
+            calendario.version if calendario is not None and not por_hora else None
+        )
+        resultado = self._interval_cache.get(clave)
+        if resultado is None:
+            if por_hora:
+                resultado = self._calculate_working_days_por_hora(start_date, cantidad, estandar, cantidad_minima_siguiente)
+            else:
+                resultado = self._calculate_working_days(start_date, cantidad, estandar, calendario)
+            self._interval_cache.put(clave, resultado)
+
+        # Copia para que los llamadores puedan modificar el resultado sin alterar la caché
+        copia = dict(resultado)
+        copia['intervals'] = [dict(intervalo) for intervalo in resultado['intervals']]
+        return copia
+
+    @staticmethod
+    def _normalizar_numero(valor):
+        """Normaliza cantidades y estándares (int, float, Decimal) para usarlos como clave"""
+        if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+            return float(valor)
+        return valor
+
+    def _calculate_working_days(self, start_date, cantidad, estandar, calendario=None):
+        """Cálculo directo sobre el índice del calendario laboral (sin caché)"""
+
+        if not estandar or estandar <= 0:
+            return {
+                'intervals': [],
+                'start_date': start_date.date(),
+                'end_date': start_date.date(),
+                'next_available_time': start_date,
+                'error': 'El estándar debe ser mayor que 0'
+            }
+
+        calendario = calendario or self.get_calendar()
+        cantidad = float(cantidad)
+        estandar_hora = float(estandar)
+        # Duración total en minutos laborables, redondeada al minuto superior
+        duracion = math.ceil(cantidad * 60 / estandar_hora - 1e-9)
+        minuto_inicio = calendario.minuto_laboral(start_date)
+        minuto_fin = minuto_inicio + duracion
+
+        intervals = []
+        remaining_units = cantidad
+        for fecha, desde, hasta in calendario.desglose_diario(minuto_inicio, minuto_fin):
+            minutos_dia = hasta - desde
+            if hasta >= minuto_fin:
+                unidades_dia = remaining_units
+            else:
+                unidades_dia = min(remaining_units, minutos_dia * estandar_hora / 60)
+            remaining_units -= unidades_dia
+            fecha_fin = calendario.instante(hasta)
+            intervals.append({
+                'fecha': fecha,
+                'fecha_inicio': calendario.instante(desde, inicio=True),
+                'fecha_fin': fecha_fin,
+                'minutos': int(round(minutos_dia)),
+                'unidades': unidades_dia,
+                'unidades_restantes': max(remaining_units, 0),
+                'continue_same_day': fecha_fin < datetime.combine(fecha, self.get_workday_end(fecha))
+            })
+
+        inicio_efectivo = calendario.instante(minuto_inicio, inicio=True)
+        return {
+            'intervals': intervals,
+            'start_date': intervals[0]['fecha'] if intervals else inicio_efectivo.date(),
+            'end_date': intervals[-1]['fecha'] if intervals else inicio_efectivo.date(),
+            'next_available_time': intervals[-1]['fecha_fin'] if intervals else inicio_efectivo
+        }
+
+    def calculate_working_days_batch(self, start_dates, cantidades, estandares):
+        """
+        Versión vectorizada de calculate_working_days para muchos procesos a la vez.
+
+        Recibe arreglos (o listas) de instantes de inicio, cantidades y estándares por hora y
+        retorna arreglos NumPy con el inicio efectivo, el término y el reparto de unidades por
+        día laboral, calculados en una sola pasada sobre los minutos del calendario:
+
+            {
+                'inicio': datetime64[s] (n,),
+                'fin': datetime64[s] (n,),
+                'valido': bool (n,)  # False cuando el estándar no es mayor que 0
+                'fechas': datetime64[D] (d,),
+                'minutos_por_dia': float (n, d),
+                'unidades_por_dia': float (n, d),
+                'inicio_por_dia': datetime64[s] (n, d),  # NaT en los días sin trabajo
+                'fin_por_dia': datetime64[s] (n, d),
+            }
+        """
+        calendario = self.get_calendar()
+        inicios = np.array(
+            [s if isinstance(s, datetime) else datetime.combine(s, self.WORKDAY_START) for s in start_dates]
+            if not isinstance(start_dates, np.ndarray) else start_dates,
+            dtype='datetime64[s]'
+        )
+        cantidades = np.asarray(cantidades, dtype=np.float64)
+        estandares = np.asarray(estandares, dtype=np.float64)
+
+        valido = estandares > 0
+        estandar_seguro = np.where(valido, estandares, 1.0)
+        duracion = np.where(valido, np.ceil(cantidades * 60 / estandar_seguro - 1e-9), 0.0)
+
+        minuto_inicio = calendario.minutos_laborales(inicios)
+        minuto_fin = minuto_inicio + duracion
+        fechas, desde, hasta = calendario.tramos_por_dia(minuto_inicio, minuto_fin)
+        minutos_por_dia = hasta - desde
+        trabaja = minutos_por_dia > 0
+
+        # Mismo reparto que la versión escalar: días completos al estándar y el resto el último día
+        acumulado = np.minimum(
+            np.cumsum(minutos_por_dia * (estandar_seguro / 60)[:, None], axis=1),
+            cantidades[:, None]
+        )
+        unidades_por_dia = np.diff(acumulado, axis=1, prepend=0.0)
+        unidades_por_dia[~valido] = 0.0
+
+        return {
+            'inicio': np.where(valido, calendario.instantes(minuto_inicio, inicio=True), inicios),
+            'fin': np.where(valido, calendario.instantes(minuto_fin), inicios),
+            'valido': valido,
+            'fechas': fechas,
+            'minutos_por_dia': minutos_por_dia,
+            'unidades_por_dia': unidades_por_dia,
+            'inicio_por_dia': np.where(trabaja, calendario.instantes(desde, inicio=True), np.datetime64('NaT')),
+            'fin_por_dia': np.where(trabaja, calendario.instantes(hasta), np.datetime64('NaT')),
+        }
+
+    def ajustar_a_horario_laboral(self, fecha_hora, calendario=None):
+        """Obtiene el primer instante laborable igual o posterior a la fecha dada"""
+        return (calendario or self.get_calendar()).ajustar_inicio(fecha_hora)
+
+    def add_working_minutes(self, fecha_hora, minutos):
+        """Suma minutos laborables a un instante"""
+        return self.get_calendar().sumar_minutos(fecha_hora, minutos)
+
+    def _calculate_working_days_por_hora(self, start_date, cantidad, estandar, cantidad_minima_siguiente=None):
         """
-        Implementación del cálculo de días laborables considerando horario especial de viernes
+        Cálculo hora a hora (modo detallado), considerando horario especial de viernes
         """
         if not isinstance(start_date, datetime):
             start_date = datetime.combine(start_date, self.WORKDAY_START)
@@ -0,0 +1,55 @@
+from django.db import transaction
+
+
+class _Pendiente:
+    """Valores acumulados en una transacción; es el callback que se registra con on_commit"""
+
+    def __init__(self, lote, conexion):
+        self.lote = lote
+        self.conexion = conexion
+        self.valores = set()
+        self.ejecutado = False
+
+    def __call__(self):
+        self.ejecutado = True
+        if getattr(self.conexion, self.lote.atributo, None) is self:
+            delattr(self.conexion, self.lote.atributo)
+        if self.valores:
+            self.lote.aplicar(self.valores)
+
+
+class LoteTransaccion:
+    """
+    Acumula valores durante la transacción actual y los procesa juntos una sola vez, cuando
+    se confirma.
+
+    El conjunto pendiente pertenece a la transacción y no al hilo: se registra un único
+    callback con on_commit por transacción y, si la transacción (o el savepoint en que se
+    registró) se revierte, Django descarta el callback y el siguiente cambio abre un conjunto
+    nuevo, sin arrastrar valores de la transacción revertida. Fuera de una transacción se
+    procesa de inmediato, como on_commit.
+    """
+
+    def __init__(self, nombre, aplicar):
+        self.atributo = f'_lote_transaccion_{nombre}'
+        self.aplicar = aplicar
+
+    def agregar(self, valores, using=None):
+        valores = {valor for valor in valores if valor is not None}
+        if not valores:
+            return
+        conexion = transaction.get_connection(using)
+        pendiente = getattr(conexion, self.atributo, None)
+        if pendiente is not None and not pendiente.ejecutado and self._registrado(conexion, pendiente):
+            pendiente.valores.update(valores)
+            return
+
+        pendiente = _Pendiente(self, conexion)
+        pendiente.valores.update(valores)
+        setattr(conexion, self.atributo, pendiente)
+        transaction.on_commit(pendiente, using=using)
+
+    @staticmethod
+    def _registrado(conexion, pendiente):
+        """El callback sigue agendado (no se descartó por un rollback)"""
+        return any(entrada[1] is pendiente for entrada in conexion.run_on_commit)
@@ -0,0 +1,262 @@
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+
+import django
+
+from JobManagement.models import Maquina, ProgramaOrdenTrabajo
+from .machine_calendars import MachineCalendarService
+from .production_scheduler import ProductionScheduler
+from .setup_times import MatrizPreparacion
+from .time_calculations import TimeCalculator
+
+logger = logging.getLogger(__name__)
+
+# Pool de procesos compartido por las solicitudes: Django se inicializa una sola vez por proceso
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool():
+    """
+    Pool persistente del módulo. Usa 'spawn' para que los procesos no hereden las conexiones
+    a la base de datos de la solicitud (no la usan: todo viene en el escenario). El
+    inicializador es django.setup y no una función de este módulo, que importa modelos.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        return _pool
+
+
+def _descartar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def evaluar_candidato(escenario, candidato):
+    """
+    Programa en memoria el escenario con el orden de OTs y los cambios de máquina del candidato
+    y retorna sus indicadores. No usa la base de datos: los calendarios vienen en el escenario.
+    """
+    ordenes = {ot['orden_trabajo']: ot for ot in escenario['ordenes_trabajo']}
+    cambios = candidato['cambios_maquina']
+    ordenes_trabajo = [
+        dict(ordenes[ot_id], procesos=[
+            dict(proceso, maquina_id=cambios.get(proceso['id'], proceso['maquina_id']))
+            for proceso in ordenes[ot_id]['procesos']
+        ])
+        for ot_id in candidato['orden']
+    ]
+
+    scheduler = ProductionScheduler(None)
+    _, cadenas = scheduler._construir_cadenas(ordenes_trabajo)
+    fecha_inicio = escenario['fecha_inicio']
+    lote = escenario.get('lote_transferencia')
+    paralelas = escenario.get('maquinas_paralelas') or 1
+    scheduler._programar_operaciones(
+        cadenas,
+        fecha_inicio,
+        calendarios=escenario['calendarios'],
+        lotes=[lote] * len(cadenas) if lote else None,
+        maquinas_paralelas=[paralelas] * len(cadenas) if paralelas > 1 else None,
+        alternativas=escenario.get('alternativas') or {},
+        preparaciones=escenario.get('preparaciones'),
+        agrupar_preparaciones=escenario.get('agrupar_preparaciones', False)
+    )
+
+    fin = fecha_inicio
+    atrasadas = []
+    atraso_total = 0.0
+    for ot_data, cadena in zip(ordenes_trabajo, cadenas):
+        if not cadena:
+            continue
+        fin_ot = cadena[-1].fecha_fin
+        fin = max(fin, fin_ot)
+        termino = escenario['fechas_termino'].get(ot_data['orden_trabajo'])
+        if termino:
+            atraso = (fin_ot - datetime.combine(termino, TimeCalculator.WORKDAY_END)).total_seconds() / 3600
+            if atraso > 0:
+                atraso_total += atraso
+                atrasadas.append({
+                    'orden_trabajo': ot_data['orden_trabajo'],
+                    'codigo_ot': ot_data['orden_trabajo_codigo_ot'],
+                    'fecha_fin': fin_ot.strftime('%Y-%m-%d %H:%M'),
+                    'fecha_termino': termino.isoformat(),
+                    'atraso_horas': round(atraso, 2)
+                })
+
+    return {
+        'nombre': candidato['nombre'],
+        'fecha_fin': fin.strftime('%Y-%m-%d %H:%M'),
+        'makespan_horas': round((fin - fecha_inicio).total_seconds() / 3600, 2),
+        'atraso_total_horas': round(atraso_total, 2),
+        'ots_atrasadas': len(atrasadas),
+        'atrasadas': atrasadas
+    }
+
+
+class WhatIfService:
+    """
+    Evalúa órdenes de prioridad y cambios de máquina alternativos para un programa sin
+    escribir en la base de datos. El escenario se carga una vez (OTs, fechas de término y
+    calendarios de máquina) y cada candidato se programa en memoria en un pool de procesos.
+    """
+
+    MAX_CANDIDATOS = 16
+    # Bajo este total de operaciones (candidatos x operaciones del programa) se evalúa en serie:
+    # enviar el escenario a otros procesos cuesta más que programarlo
+    MIN_OPERACIONES_POOL = 2000
+
+    def cargar_escenario(self, programa, maquina_ids_extra=()):
+        """Datos del programa necesarios para programarlo en memoria (serializables, sin consultas posteriores)"""
+        ordenes_trabajo = []
+        fechas_termino = {}
+        ots_multa = set()
+        ots_vip = set()
+        maquina_ids = set(maquina_ids_extra)
+        for prog_ot in ProgramaOrdenTrabajo.objects.filter(
+            programa=programa
+        ).select_related(
+            'orden_trabajo__ruta_ot',
+            'orden_trabajo__cliente'
+        ).prefetch_related(
+            'orden_trabajo__ruta_ot__items__proceso'
+        ).order_by('prioridad'):
+            ot = prog_ot.orden_trabajo
+            ruta = getattr(ot, 'ruta_ot', None)
+            procesos = []
+            for item in sorted(ruta.items.all(), key=lambda i: i.item) if ruta else []:
+                procesos.append({
+                    'id': item.id,
+                    'item': item.item,
+                    'descripcion': item.proceso.descripcion if item.proceso else None,
+                    'maquina_id': item.maquina_id,
+                    'cantidad': float(item.cantidad_pedido),
+                    'estandar': float(item.estandar)
+                })
+                maquina_ids.add(item.maquina_id)
+            ordenes_trabajo.append({
+                'orden_trabajo': ot.id,
+                'orden_trabajo_codigo_ot': ot.codigo_ot,
+                'orden_trabajo_descripcion_producto_ot': ot.descripcion_producto_ot,
+                'procesos': procesos
+            })
+            if ot.fecha_termino:
+                fechas_termino[ot.id] = ot.fecha_termino
+            if ot.multa:
+                ots_multa.add(ot.id)
+            if ot.cliente and ot.cliente.vip:
+                ots_vip.add(ot.id)
+
+        # Máquinas compatibles para dividir procesos (solo si el programa lo permite)
+        item_ids = {proceso['id'] for ot in ordenes_trabajo for proceso in ot['procesos']}
+        alternativas = {}
+        if programa.maquinas_paralelas > 1:
+            alternativas = ProductionScheduler.maquinas_alternativas(item_ids)
+            maquina_ids.update(maquina_id for candidatas in alternativas.values() for maquina_id, _ in candidatas)
+
+        fecha_inicio = datetime.combine(programa.fecha_inicio, TimeCalculator.WORKDAY_START)
+        return {
+            'fecha_inicio': fecha_inicio,
+            'ordenes_trabajo': ordenes_trabajo,
+            'fechas_termino': fechas_termino,
+            'ots_multa': ots_multa,
+            'ots_vip': ots_vip,
+            'lote_transferencia': programa.lote_transferencia,
+            'maquinas_paralelas': programa.maquinas_paralelas,
+            'alternativas': alternativas,
+            'agrupar_preparaciones': programa.agrupar_preparaciones,
+            'calendarios': MachineCalendarService().calendarios(maquina_ids, fecha_inicio),
+            # Los cambios de máquina de los candidatos pueden usar cualquiera de las máquinas cargadas
+            'preparaciones': MatrizPreparacion.cargar(item_ids, maquina_ids)
+        }
+
+    def normalizar_candidatos(self, programa, candidatos):
+        """
+        Valida los candidatos ({'nombre', 'orden': [ot_id...], 'cambios_maquina': {item_ruta_id: maquina_id}})
+        y los completa: las OTs no mencionadas en 'orden' conservan su orden actual al final.
+        Retorna (candidatos, maquina_ids nuevas). Lanza ValueError si un candidato no es válido.
+        """
+        if not isinstance(candidatos, list) or not candidatos:
+            raise ValueError('Se requiere una lista de candidatos')
+        if len(candidatos) > self.MAX_CANDIDATOS:
+            raise ValueError(f'Se permiten como máximo {self.MAX_CANDIDATOS} candidatos')
+
+        ots_actuales = list(ProgramaOrdenTrabajo.objects.filter(
+            programa=programa
+        ).order_by('prioridad').values_list('orden_trabajo_id', flat=True))
+        items_programa = set(ProgramaOrdenTrabajo.objects.filter(
+            programa=programa
+        ).values_list('orden_trabajo__ruta_ot__items__id', flat=True))
+
+        normalizados = []
+        maquinas_nuevas = set()
+        for numero, candidato in enumerate(candidatos, start=1):
+            nombre = candidato.get('nombre') or f'Candidato {numero}'
+            orden = [int(ot_id) for ot_id in candidato.get('orden') or []]
+            desconocidas = set(orden) - set(ots_actuales)
+            if desconocidas or len(set(orden)) != len(orden):
+                raise ValueError(f'{nombre}: el orden contiene OTs repetidas o que no pertenecen al programa')
+            orden += [ot_id for ot_id in ots_actuales if ot_id not in orden]
+
+            cambios = {
+                int(item_ruta_id): int(maquina_id)
+                for item_ruta_id, maquina_id in (candidato.get('cambios_maquina') or {}).items()
+            }
+            if set(cambios) - items_programa:
+                raise ValueError(f'{nombre}: hay cambios de máquina para procesos que no pertenecen al programa')
+            maquinas_nuevas.update(cambios.values())
+            normalizados.append({'nombre': nombre, 'orden': orden, 'cambios_maquina': cambios})
+
+        existentes = set(Maquina.objects.filter(id__in=maquinas_nuevas).values_list('id', flat=True))
+        if maquinas_nuevas - existentes:
+            raise ValueError(f'Máquinas no encontradas: {sorted(maquinas_nuevas - existentes)}')
+        return normalizados, maquinas_nuevas
+
+    def evaluar(self, programa, candidatos):
+        """
+        Evalúa el orden actual y los candidatos, en serie o en el pool de procesos si son muchas
+        operaciones. Retorna {'actual': indicadores, 'candidatos': [indicadores, ...]}.
+        """
+        candidatos, maquinas_nuevas = self.normalizar_candidatos(programa, candidatos)
+        escenario = self.cargar_escenario(programa, maquinas_nuevas)
+        actual = {
+            'nombre': 'Actual',
+            'orden': [ot['orden_trabajo'] for ot in escenario['ordenes_trabajo']],
+            'cambios_maquina': {}
+        }
+        todos = [actual] + candidatos
+
+        operaciones = sum(len(ot['procesos']) for ot in escenario['ordenes_trabajo']) * len(todos)
+        procesos = min(len(todos), os.cpu_count() or 1)
+        resultados = None
+        if procesos > 1 and operaciones >= self.MIN_OPERACIONES_POOL:
+            try:
+                # Un bloque de candidatos por proceso: el escenario se envía una vez por bloque
+                resultados = list(_obtener_pool().map(
+                    partial(evaluar_candidato, escenario),
+                    todos,
+                    chunksize=math.ceil(len(todos) / procesos)
+                ))
+            except BrokenProcessPool:
+                logger.warning("Pool de procesos caído, se evalúa en serie")
+                _descartar_pool()
+        if resultados is None:
+            resultados = [evaluar_candidato(escenario, candidato) for candidato in todos]
+
+        return {'actual': resultados[0], 'candidatos': resultados[1:]}
@@ -1,3 +1,1717 @@
-from django.test import TestCase
+import gc
+import math
+import random
+import threading
+import weakref
+from collections import defaultdict
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from itertools import count
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Machine.models import (
+    BloqueoMaquina, DisponibilidadMaquina, EstadoMaquina, EstadoOperatividad, MantenimientoMaquina, TipoMaquina
+)
+from Operator.models import AsignacionOperador, Operador, OperadorMaquina
+from Product.models import FamiliaProducto, Producto
+
+from .models import (
+    EmpresaOT, IntervaloMaquina, IntervaloOperador, ItemRuta, Maquina, OcupacionMaquinaDia, OrdenTrabajo, Proceso,
+    ProgramaOrdenTrabajo, ProgramaProduccion, ReporteDiarioPrograma, RutaOT, SituacionOT,
+    SnapshotProgramacion, TareaFragmentada, TiempoPreparacion, TipoOT
+)
+from .services.interval_index import MachineIntervalIndex
+from .services.lot_streaming import desfases_transferencia
+from .services.machine_availability import MachineAvailabilityService
+from .services.machine_calendars import MachineCalendarService
+from .services.machine_compatibility import MatrizCompatibilidad
+from .services.machine_load import MAPA_CALOR_CACHE, MachineLoadService
+from .services.machine_occupancy import MachineOccupancyService, _pendientes as pendientes_ocupacion
+from .services.machine_rebalance import MachineRebalanceService
+from .services.operator_availability import OperatorAvailability
+from .services.priority_optimizer import PriorityOptimizer, ProgramacionRapida
+from .services.production_scheduler import ProductionScheduler
+from .services.setup_times import MatrizPreparacion, secuenciar
+from .services.time_calculations import IntervalCache, TimeCalculator
+from .services.what_if import WhatIfService
+from .services.working_calendar import MachineCalendar, WorkingCalendar, cargar_feriados
+from .views_files.program_views import ProgramDetailView
+
+LUNES = datetime(2025, 3, 3, 7, 45)  # Inicio de jornada de un lunes sin feriados cerca
+
+
+class CalculoDiasLaborablesTests(SimpleTestCase):
+    """Cálculo directo de calculate_working_days (salto al término sin recorrer hora a hora)"""
+
+    def setUp(self):
+        self.calculadora = TimeCalculator()
+
+    def test_termino_en_el_mismo_dia_descuenta_colacion(self):
+        # Dos horas desde las 12:00: una antes y otra después de la colación
+        calculo = self.calculadora.calculate_working_days(LUNES.replace(hour=12, minute=0), 120, 60)
+        self.assertEqual(calculo['next_available_time'], LUNES.replace(hour=15, minute=0))
+        self.assertEqual(len(calculo['intervals']), 1)
+        self.assertEqual(calculo['intervals'][0]['minutos'], 120)
+        self.assertTrue(calculo['intervals'][0]['continue_same_day'])
+
+    def test_viernes_corto_y_salto_de_fin_de_semana(self):
+        # 10 horas desde el viernes: 8 ese día (termina 16:45) y 2 el lunes siguiente
+        viernes = LUNES + timedelta(days=4)
+        calculo = self.calculadora.calculate_working_days(viernes, 600, 60)
+        self.assertEqual(
+            [(i['fecha'], i['minutos'], i['unidades']) for i in calculo['intervals']],
+            [(viernes.date(), 480, 480), ((viernes + timedelta(days=3)).date(), 120, 120)]
+        )
+        self.assertEqual(calculo['intervals'][0]['fecha_fin'], viernes.replace(hour=16, minute=45))
+        self.assertEqual(calculo['next_available_time'], viernes.replace(day=10, hour=9, minute=45))
+
+    def test_inicio_fuera_de_horario_se_mueve_al_siguiente_instante_laboral(self):
+        sabado = LUNES + timedelta(days=5)
+        calculo = self.calculadora.calculate_working_days(sabado.replace(hour=10), 60, 60)
+        self.assertEqual(calculo['intervals'][0]['fecha_inicio'], LUNES + timedelta(days=7))
+        calculo = self.calculadora.calculate_working_days(LUNES.replace(hour=13, minute=20), 30, 60)
+        self.assertEqual(calculo['intervals'][0]['fecha_inicio'], LUNES.replace(hour=14, minute=0))
+
+    def test_estandar_invalido(self):
+        calculo = self.calculadora.calculate_working_days(LUNES, 100, 0)
+        self.assertIn('error', calculo)
+        self.assertEqual(calculo['intervals'], [])
+
+    def test_igual_al_calculo_por_hora(self):
+        # Inicios cada 35 minutos durante dos semanas (solo dentro de la jornada, el dominio del
+        # cálculo hora a hora)
+        for paso in range(0, 14 * 24 * 60, 35):
+            inicio = LUNES - timedelta(minutes=45) + timedelta(minutes=paso)
+            if inicio.time() > self.calculadora.get_workday_end(inicio.date()):
+                continue
+            cantidad, estandar = (1, 5, 37, 450, 2500)[paso % 5], (12, 30, 60, 250)[paso % 4]
+            directo = self.calculadora.calculate_working_days(inicio, cantidad, estandar)
+            por_hora = self.calculadora.calculate_working_days(inicio, cantidad, estandar, por_hora=True)
+
+            self.assertEqual(directo['start_date'], por_hora['start_date'])
+            self.assertEqual(directo['end_date'], por_hora['end_date'])
+            self.assertEqual(directo['intervals'][0]['fecha_inicio'], por_hora['intervals'][0]['fecha_inicio'])
+            # El cálculo hora a hora termina en el cambio de hora siguiente al término exacto
+            self.assertLessEqual(directo['next_available_time'], por_hora['next_available_time'])
+            self.assertGreater(directo['next_available_time'], por_hora['next_available_time'] - timedelta(hours=1))
+
+            unidades_por_hora = defaultdict(float)
+            for intervalo in por_hora['intervals']:
+                unidades_por_hora[intervalo['fecha']] += intervalo['unidades']
+            unidades_directo = {i['fecha']: i['unidades'] for i in directo['intervals']}
+            self.assertEqual(set(unidades_directo), set(unidades_por_hora))
+            for fecha, unidades in unidades_por_hora.items():
+                # Solo difiere el redondeo al minuto del último día
+                self.assertAlmostEqual(unidades_directo[fecha], unidades, delta=estandar / 60 + 1e-6)
+
+
+class CalendarioLaboralTests(SimpleTestCase):
+    """Índice precomputado del calendario laboral (feriados y búsquedas binarias)"""
+
+    def setUp(self):
+        self.calendario = TimeCalculator.get_calendar()
+
+    def test_feriados_chilenos(self):
+        # 1 de mayo (jueves) y Viernes Santo 2025 no son laborables
+        self.assertFalse(TimeCalculator.is_working_day(date(2025, 5, 1)))
+        self.assertEqual(TimeCalculator.get_next_working_day(date(2025, 4, 30)), date(2025, 5, 2))
+        self.assertEqual(TimeCalculator.get_next_working_day(date(2025, 4, 17)), date(2025, 4, 21))
+        self.assertEqual(self.calendario.minutos_laborables_dia(date(2025, 5, 1)), 0)
+
+    def test_minutos_por_dia(self):
+        self.assertEqual(self.calendario.minutos_laborables_dia(date(2025, 3, 3)), 540)
+        self.assertEqual(self.calendario.minutos_laborables_dia(date(2025, 3, 7)), 480)
+        self.assertEqual(self.calendario.minutos_laborables_dia(date(2025, 3, 8)), 0)
+
+    def test_siguiente_dia_laboral_igual_a_recorrer_dia_a_dia(self):
+        feriados = cargar_feriados(2024, 2026)
+        dia = date(2024, 1, 1)
+        while dia < date(2026, 12, 1):
+            esperado = dia + timedelta(days=1)
+            while esperado.weekday() >= 5 or esperado in feriados:
+                esperado += timedelta(days=1)
+            self.assertEqual(self.calendario.siguiente_dia_laboral(dia), esperado, dia)
+            dia += timedelta(days=1)
+
+    def test_sumar_minutos_cruza_colacion_fin_de_semana_y_feriado(self):
+        # Miércoles 30/04 a las 17:15 + 60 minutos: 30 ese día, el 1/5 es feriado, 30 el viernes
+        self.assertEqual(
+            self.calendario.sumar_minutos(datetime(2025, 4, 30, 17, 15), 60),
+            datetime(2025, 5, 2, 8, 15)
+        )
+        self.assertEqual(
+            self.calendario.sumar_minutos(datetime(2025, 3, 3, 12, 30), 60),
+            datetime(2025, 3, 3, 14, 30)
+        )
+        self.assertEqual(
+            self.calendario.minutos_entre(datetime(2025, 3, 7, 16, 0), datetime(2025, 3, 10, 8, 45)),
+            105
+        )
+
+    def test_ajustar_inicio(self):
+        self.assertEqual(self.calendario.ajustar_inicio(datetime(2025, 3, 3, 18, 0)), datetime(2025, 3, 4, 7, 45))
+        self.assertEqual(self.calendario.ajustar_inicio(datetime(2025, 3, 3, 13, 15)), datetime(2025, 3, 3, 14, 0))
+        self.assertEqual(self.calendario.ajustar_inicio(datetime(2025, 3, 3, 9, 10)), datetime(2025, 3, 3, 9, 10))
+
+    def test_horizonte_se_extiende_bajo_demanda(self):
+        calendario = WorkingCalendar(
+            date(2025, 1, 1), date(2025, 12, 31),
+            TimeCalculator.WORKDAY_START, TimeCalculator.WORKDAY_END, TimeCalculator.FRIDAY_END,
+            TimeCalculator.BREAK_START, TimeCalculator.BREAK_END,
+            feriados={date(2031, 6, 2)}
+        )
+        # Lunes 2/6/2031 queda fuera del horizonte inicial y es feriado fijo
+        self.assertEqual(calendario.siguiente_dia_laboral(date(2031, 5, 30)), date(2031, 6, 3))
+        self.assertEqual(
+            calendario.sumar_minutos(datetime(2031, 5, 30, 16, 0), 90),
+            datetime(2031, 6, 3, 8, 30)
+        )
+        self.assertGreaterEqual(calendario.fecha_fin, date(2031, 6, 3))
+
+
+    def _calendario_corto(self):
+        return WorkingCalendar(
+            date(2025, 3, 1), date(2025, 4, 30),
+            TimeCalculator.WORKDAY_START, TimeCalculator.WORKDAY_END, TimeCalculator.FRIDAY_END,
+            TimeCalculator.BREAK_START, TimeCalculator.BREAK_END, cargar_feriados_pais='CL'
+        )
+
+    def test_extender_hacia_adelante_conserva_los_minutos(self):
+        calendario = self._calendario_corto()
+        minuto = calendario.minuto_laboral(datetime(2025, 3, 10, 9, 0))
+        calendario.sumar_minutos(datetime(2025, 3, 10, 9, 0), 540 * 400)
+        self.assertEqual(calendario.origen, date(2025, 3, 1))
+        self.assertEqual(calendario.minuto_laboral(datetime(2025, 3, 10, 9, 0)), minuto)
+        self.assertEqual(calendario.instante(minuto, inicio=True), datetime(2025, 3, 10, 9, 0))
+
+    def test_consultas_concurrentes_mientras_se_extiende(self):
+        calendario = self._calendario_corto()
+        rnd = random.Random(3)
+        consultas = [
+            (datetime(2025, 3, 3, 7, 45) + timedelta(days=rnd.randrange(0, 40), minutes=rnd.randrange(0, 600)),
+             rnd.randrange(0, 540 * 800))
+            for _ in range(400)
+        ]
+        esperado = [self.calendario.sumar_minutos(inicio, minutos) for inicio, minutos in consultas]
+        resultados = [None] * len(consultas)
+
+        def consultar(desde):
+            for i in range(desde, len(consultas), 8):
+                resultados[i] = calendario.sumar_minutos(*consultas[i])
+
+        hilos = [threading.Thread(target=consultar, args=(k,)) for k in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(resultados, esperado)
+
+class CalculoEnLoteTests(SimpleTestCase):
+    """calculate_working_days_batch entrega lo mismo que el cálculo individual, en arreglos"""
+
+    def setUp(self):
+        self.calculadora = TimeCalculator()
+
+    def test_igual_al_calculo_individual(self):
+        casos = [
+            (LUNES + timedelta(minutes=paso), (3, 80, 640, 5000)[paso % 4], (7, 45, 120)[paso % 3])
+            for paso in range(0, 10 * 24 * 60, 97)
+        ]
+        lote = self.calculadora.calculate_working_days_batch(*zip(*casos))
+        fechas = lote['fechas'].astype(object)
+        for k, (inicio, cantidad, estandar) in enumerate(casos):
+            directo = self.calculadora.calculate_working_days(inicio, cantidad, estandar)
+            self.assertEqual(lote['inicio'][k].astype(datetime), directo['intervals'][0]['fecha_inicio'])
+            self.assertEqual(lote['fin'][k].astype(datetime), directo['next_available_time'])
+            por_dia = {
+                fechas[d]: (lote['minutos_por_dia'][k, d], lote['unidades_por_dia'][k, d])
+                for d in range(len(fechas)) if lote['minutos_por_dia'][k, d] > 0
+            }
+            self.assertEqual(set(por_dia), {i['fecha'] for i in directo['intervals']})
+            for intervalo in directo['intervals']:
+                minutos, unidades = por_dia[intervalo['fecha']]
+                self.assertEqual(minutos, intervalo['minutos'])
+                self.assertAlmostEqual(unidades, intervalo['unidades'], places=6)
+
+    def test_estandar_invalido_no_ocupa_tiempo(self):
+        lote = self.calculadora.calculate_working_days_batch([LUNES, LUNES], [100, 100], [0, 50])
+        self.assertEqual(lote['valido'].tolist(), [False, True])
+        self.assertEqual(lote['fin'][0].astype(datetime), LUNES)
+        self.assertEqual(lote['unidades_por_dia'][0].sum(), 0)
+        self.assertEqual(lote['fin'][1].astype(datetime), LUNES.replace(hour=9, minute=45))
+
+
+class CacheIntervalosTests(SimpleTestCase):
+    """Memoización de calculate_working_days en la caché LRU compartida"""
+
+    def setUp(self):
+        TimeCalculator.clear_cache()
+
+    def test_misma_consulta_normalizada_es_un_acierto(self):
+        primera = TimeCalculator().calculate_working_days(LUNES, 100, 50)
+        # Otra instancia, con Decimal y float en lugar de int
+        segunda = TimeCalculator().calculate_working_days(LUNES, Decimal('100.00'), 50.0)
+        self.assertEqual(primera, segunda)
+        info = TimeCalculator.cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 1, 1))
+
+        TimeCalculator().calculate_working_days(LUNES, 100, 50, por_hora=True)
+        self.assertEqual(TimeCalculator.cache_info()['misses'], 2)
+
+    def test_el_resultado_es_una_copia(self):
+        calculo = TimeCalculator().calculate_working_days(LUNES, 100, 50)
+        calculo['intervals'][0]['unidades'] = -1
+        calculo['intervals'].append({})
+        otra = TimeCalculator().calculate_working_days(LUNES, 100, 50)
+        self.assertEqual(len(otra['intervals']), 1)
+        self.assertEqual(otra['intervals'][0]['unidades'], 100)
+
+    def test_lru_acotada(self):
+        cache = IntervalCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.info()['size'], 2)
+
+    def test_clave_por_version_del_calendario(self):
+        def calendario(bloqueos=()):
+            return MachineCalendar(
+                date(2025, 3, 1), date(2025, 4, 30), TimeCalculator.WORKDAY_START, TimeCalculator.WORKDAY_END,
+                TimeCalculator.FRIDAY_END, TimeCalculator.BREAK_START, TimeCalculator.BREAK_END,
+                bloqueos=list(bloqueos)
+            )
+
+        primero = calendario([(datetime(2025, 3, 3, 9, 0), datetime(2025, 3, 3, 10, 0))])
+        calculo = TimeCalculator().calculate_working_days(LUNES, 100, 50, calendario=primero)
+        referencia = weakref.ref(primero)
+        del primero
+        gc.collect()
+        # La caché no retiene el calendario
+        self.assertIsNone(referencia())
+
+        # Un calendario igual construido aparte usa las mismas entradas; uno distinto no
+        igual = calendario([(datetime(2025, 3, 3, 9, 0), datetime(2025, 3, 3, 10, 0))])
+        self.assertEqual(TimeCalculator().calculate_working_days(LUNES, 100, 50, calendario=igual), calculo)
+        self.assertEqual(TimeCalculator.cache_info()['hits'], 1)
+        distinto = calendario()
+        self.assertNotEqual(distinto.version, igual.version)
+        self.assertNotEqual(TimeCalculator().calculate_working_days(LUNES, 100, 50, calendario=distinto), calculo)
+        self.assertEqual(TimeCalculator.cache_info()['misses'], 2)
+
+    def test_reiniciar_calendario_vacia_la_cache(self):
+        TimeCalculator().calculate_working_days(LUNES, 100, 50)
+        TimeCalculator.reset_calendar()
+        self.assertEqual(TimeCalculator.cache_info()['size'], 0)
+
+
+def _orden_trabajo(ot_id, prioridad, procesos):
+    """Datos de una OT como los entrega _get_program_orders: procesos = [(maquina_id, cantidad, estandar)]"""
+    return {
+        'orden_trabajo': ot_id,
+        'orden_trabajo_codigo_ot': f'OT{ot_id}',
+        'orden_trabajo_descripcion_producto_ot': f'Producto {ot_id}',
+        'procesos': [
+            {
+                'id': ot_id * 100 + k, 'descripcion': f'P{k}', 'item': k + 1,
+                'cantidad': cantidad, 'estandar': estandar, 'prioridad': prioridad,
+                'maquina_id': maquina, 'maquina_descripcion': f'M{maquina}',
+            }
+            for k, (maquina, cantidad, estandar) in enumerate(procesos)
+        ]
+    }
+
+
+class ProgramacionEnUnaPasadaTests(TestCase):
+    """_generate_base_timeline ubica cada operación una vez, sin traslapes por máquina"""
+
+    SETUP = timedelta(minutes=30)
+
+    def setUp(self):
+        self.scheduler = ProductionScheduler(TimeCalculator())
+        self.programa = SimpleNamespace(id=1, fecha_inicio=LUNES.date())
+
+    def _tramos(self, timeline):
+        """(inicio, fin) de cada proceso a partir de sus intervalos"""
+        tramos = {}
+        for item in timeline['items']:
+            inicio = datetime.strptime(item['start_time'], '%Y-%m-%d %H:%M:%S')
+            fin = datetime.strptime(item['end_time'], '%Y-%m-%d %H:%M:%S')
+            actual = tramos.get(item['proceso_id'])
+            tramos[item['proceso_id']] = (
+                (min(actual[0], inicio), max(actual[1], fin)) if actual else (inicio, fin)
+            )
+        return tramos
+
+    def test_ids_de_items_por_proceso_y_dia(self):
+        ordenes = [_orden_trabajo(1, 1, [(1, 1200, 60)]), _orden_trabajo(2, 2, [(1, 60, 60)])]
+        items = self.scheduler._generate_base_timeline(self.programa, ordenes)['items']
+        self.assertEqual(
+            [item['id'] for item in items],
+            ['item_100_20250303', 'item_100_20250304', 'item_100_20250305', 'item_200_20250305']
+        )
+
+    def test_escenarios_aleatorios_sin_traslapes_y_con_precedencia(self):
+        rnd = random.Random(5)
+        for _ in range(25):
+            ordenes = [
+                _orden_trabajo(ot_id, rnd.randrange(1, 4), [
+                    (rnd.randrange(1, 4), rnd.choice((20, 150, 900)), rnd.choice((30, 60, 200)))
+                    for _ in range(rnd.randrange(1, 4))
+                ])
+                for ot_id in range(1, rnd.randrange(2, 6))
+            ]
+            tramos = self._tramos(self.scheduler._generate_base_timeline(self.programa, ordenes))
+
+            por_maquina = defaultdict(list)
+            for orden in ordenes:
+                anterior = None
+                for proceso in orden['procesos']:
+                    inicio, fin = tramos[f"proc_{proceso['id']}"]
+                    self.assertGreaterEqual(inicio, LUNES)
+                    if anterior:
+                        self.assertGreaterEqual(inicio, anterior + self.SETUP)
+                    anterior = fin
+                    por_maquina[proceso['maquina_id']].append((inicio, fin))
+
+            for ocupaciones in por_maquina.values():
+                ocupaciones.sort()
+                for (_, fin), (inicio, _) in zip(ocupaciones, ocupaciones[1:]):
+                    self.assertGreaterEqual(inicio, fin + self.SETUP)
+
+    def test_la_mejor_prioridad_toma_la_maquina_primero(self):
+        ordenes = [
+            _orden_trabajo(1, 3, [(1, 120, 60)]),
+            _orden_trabajo(2, 1, [(1, 120, 60)]),
+        ]
+        tramos = self._tramos(self.scheduler._generate_base_timeline(self.programa, ordenes))
+        self.assertEqual(tramos['proc_200'], (LUNES, LUNES + timedelta(hours=2)))
+        self.assertEqual(tramos['proc_100'][0], LUNES + timedelta(hours=2, minutes=30))
+
+
+class ReprogramacionIncrementalTests(TestCase):
+    """Una segunda corrida reutiliza las OTs no afectadas y entrega el mismo timeline"""
+
+    def setUp(self):
+        ProductionScheduler.descartar_estado()
+        self.addCleanup(ProductionScheduler.descartar_estado)
+        self.programa = SimpleNamespace(id=7, fecha_inicio=LUNES.date())
+
+    def _ordenes(self, extra=None):
+        """Doce OTs con prioridad igual a su número; extra suma unidades al primer proceso de una OT"""
+        rnd = random.Random(9)
+        ordenes = []
+        for ot_id in range(1, 13):
+            procesos = [
+                (rnd.randrange(1, 6), rnd.randrange(50, 800, 10), rnd.choice((20, 40, 60, 90)))
+                for _ in range(rnd.randrange(1, 4))
+            ]
+            if extra and ot_id in extra:
+                maquina_id, cantidad, estandar = procesos[0]
+                procesos[0] = (maquina_id, cantidad + extra[ot_id], estandar)
+            ordenes.append(_orden_trabajo(ot_id, ot_id, procesos))
+        return ordenes
+
+    def _desde_cero(self, ordenes):
+        return ProductionScheduler(TimeCalculator())._generate_base_timeline(
+            SimpleNamespace(id=None, fecha_inicio=LUNES.date()), ordenes
+        )
+
+    def test_sin_cambios_reutiliza_todo(self):
+        scheduler = ProductionScheduler(TimeCalculator())
+        primera = scheduler._generate_base_timeline(self.programa, self._ordenes())
+        self.assertEqual(scheduler.ultimo_delta['ots_recalculadas'], 12)
+
+        segunda = scheduler._generate_base_timeline(self.programa, self._ordenes())
+        self.assertEqual(segunda, primera)
+        self.assertEqual(scheduler.ultimo_delta['ots_reutilizadas'], 12)
+        self.assertEqual(scheduler.ultimo_delta['movidos'], [])
+
+    def test_cambio_recalcula_desde_la_ot_editada(self):
+        scheduler = ProductionScheduler(TimeCalculator())
+        antes = scheduler._generate_base_timeline(self.programa, self._ordenes())
+        despues = scheduler._generate_base_timeline(self.programa, self._ordenes({8: 400}))
+        self.assertEqual(despues, self._desde_cero(self._ordenes({8: 400})))
+
+        # Las OTs de mejor prioridad no ven el cambio
+        delta = scheduler.ultimo_delta
+        self.assertEqual(delta['ots_reutilizadas'] + delta['ots_recalculadas'], 12)
+        self.assertGreaterEqual(delta['ots_reutilizadas'], 7)
+        self.assertEqual((delta['agregados'], delta['eliminados']), ([], []))
+
+        # El delta informa exactamente los procesos cuyas fechas cambiaron
+        def fechas(timeline):
+            por_proceso = defaultdict(list)
+            for item in timeline['items']:
+                por_proceso[item['proceso_id']].append((item['start_time'], item['end_time']))
+            return {p: (t[0][0], t[-1][1]) for p, t in por_proceso.items()}
+
+        anteriores, actuales = fechas(antes), fechas(despues)
+        self.assertEqual(
+            sorted(m['proceso_id'] for m in delta['movidos']),
+            sorted(p for p in actuales if actuales[p] != anteriores[p])
+        )
+        self.assertIn('proc_800', [m['proceso_id'] for m in delta['movidos']])
+
+    def test_ot_quitada_y_cambio_de_fecha_de_inicio(self):
+        scheduler = ProductionScheduler(TimeCalculator())
+        ordenes = self._ordenes()
+        scheduler._generate_base_timeline(self.programa, ordenes)
+        quitada = ordenes.pop()
+        scheduler._generate_base_timeline(self.programa, ordenes)
+        self.assertEqual(
+            scheduler.ultimo_delta['eliminados'],
+            [f"proc_{p['id']}" for p in quitada['procesos']]
+        )
+
+        # Otra fecha de inicio invalida el estado: todo se recalcula
+        self.programa.fecha_inicio = LUNES.date() + timedelta(days=1)
+        scheduler._generate_base_timeline(self.programa, ordenes)
+        self.assertEqual(scheduler.ultimo_delta['ots_reutilizadas'], 0)
+
+
+def _crear_programa(rutas, fecha_inicio=None, maquinas=None):
+    """
+    Programa con una OT por ruta; rutas = [[(codigo_maquina, cantidad, estandar), ...], ...].
+    Retorna el programa, las máquinas por código y los ItemRuta de cada OT.
+    """
+    if not hasattr(_crear_programa, 'secuencia'):
+        _crear_programa.secuencia = count(1)
+    n = next(_crear_programa.secuencia)
+    empresa = EmpresaOT.objects.create(nombre=f'Empresa {n}', apodo=f'E{n}', codigo_empresa=f'E{n}')
+    tipo, _ = TipoOT.objects.get_or_create(codigo_tipo_ot='VE')
+    situacion, _ = SituacionOT.objects.get_or_create(codigo_situacion_ot='P')
+    proceso = Proceso.objects.create(codigo_proceso='PR', descripcion='Proceso', empresa=empresa)
+    maquinas = dict(maquinas or {})
+    programa = ProgramaProduccion.objects.create(
+        nombre=f'Programa {n}', fecha_inicio=fecha_inicio or LUNES.date(), fecha_fin=LUNES.date()
+    )
+
+    items = []
+    for prioridad, ruta in enumerate(rutas, start=1):
+        ot = OrdenTrabajo.objects.create(
+            codigo_ot=n * 1000 + prioridad, tipo_ot=tipo, situacion_ot=situacion,
+            item_nota_venta=1, descripcion_producto_ot=f'Producto {prioridad}', empresa=empresa
+        )
+        ruta_ot = RutaOT.objects.create(orden_trabajo=ot)
+        items_ot = []
+        for item, (codigo, cantidad, estandar) in enumerate(ruta, start=1):
+            if codigo not in maquinas:
+                maquinas[codigo] = Maquina.objects.create(
+                    codigo_maquina=codigo, descripcion=f'Máquina {codigo}', empresa=empresa
+                )
+            items_ot.append(ItemRuta.objects.create(
+                ruta=ruta_ot, item=item, maquina=maquinas[codigo], proceso=proceso,
+                cantidad_pedido=cantidad, estandar=estandar
+            ))
+        ProgramaOrdenTrabajo.objects.create(programa=programa, orden_trabajo=ot, prioridad=prioridad)
+        items.append(items_ot)
+    return SimpleNamespace(programa=programa, maquinas=maquinas, items=items)
+
+
+class SnapshotProgramacionTests(TestCase):
+    """ProgramDetailView.get sirve la versión guardada hasta que un cambio la invalida"""
+
+    def setUp(self):
+        ProductionScheduler.descartar_estado()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(get_user_model().objects.create(username='jefe', rut='11.111.111-1'))
+        self.escenario = _crear_programa([[('M1', 600, 60), ('M2', 300, 60)], [('M1', 120, 60)]])
+        self.url = reverse('get-program', args=[self.escenario.programa.id])
+
+    def _leer(self):
+        respuesta = self.cliente.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def test_segunda_lectura_usa_la_version_guardada(self):
+        primera = self._leer()
+        self.assertTrue(primera['routes_data']['items'])
+        snapshot = SnapshotProgramacion.obtener_vigente(self.escenario.programa)
+        self.assertEqual(snapshot.version, 1)
+
+        with patch.object(ProductionScheduler, 'generate_timeline_data') as generar:
+            segunda = self._leer()
+        generar.assert_not_called()
+        self.assertEqual(segunda['routes_data'], primera['routes_data'])
+        self.assertEqual(segunda['ordenes_trabajo'], primera['ordenes_trabajo'])
+
+    def test_cambios_invalidan_y_se_regenera(self):
+        self._leer()
+        item = self.escenario.items[1][0]
+        item.cantidad_pedido = 240
+        item.save()
+        self.assertIsNone(SnapshotProgramacion.obtener_vigente(self.escenario.programa))
+
+        datos = self._leer()
+        self.assertEqual(SnapshotProgramacion.obtener_vigente(self.escenario.programa).version, 2)
+        cantidades = {
+            i['cantidad_total'] for i in datos['routes_data']['items']
+            if i['ot_id'] == f'ot_{item.ruta.orden_trabajo_id}'
+        }
+        self.assertEqual(cantidades, {240.0})
+
+        pot = ProgramaOrdenTrabajo.objects.get(orden_trabajo=item.ruta.orden_trabajo)
+        pot.prioridad = 5
+        pot.save()
+        self.assertIsNone(SnapshotProgramacion.obtener_vigente(self.escenario.programa))
+
+    def test_quitar_asignacion_invalida(self):
+        self._leer()
+        item = self.escenario.items[0][0]
+        operador = Operador.objects.create(nombre='Ana', rut='1-9', empresa=item.maquina.empresa)
+        OperadorMaquina.objects.create(operador=operador, maquina=item.maquina)
+        inicio = timezone.make_aware(LUNES)
+        # bulk_create no emite señales: la invalidación viene del borrado
+        asignacion, = AsignacionOperador.objects.bulk_create([AsignacionOperador(
+            operador=operador, item_ruta=item, programa=self.escenario.programa,
+            fecha_inicio=inicio, fecha_fin=inicio + timedelta(hours=2)
+        )])
+        self.assertIsNotNone(SnapshotProgramacion.obtener_vigente(self.escenario.programa))
+        AsignacionOperador.objects.get(pk=asignacion.pk).delete()
+        self.assertIsNone(SnapshotProgramacion.obtener_vigente(self.escenario.programa))
+
+    def test_guardar_solo_fecha_fin_no_invalida(self):
+        self._leer()
+        programa = ProgramaProduccion.objects.get(pk=self.escenario.programa.pk)
+        programa.fecha_fin = programa.fecha_fin + timedelta(days=1)
+        programa.save(update_fields=['fecha_fin'])
+        self.assertIsNotNone(SnapshotProgramacion.obtener_vigente(programa))
+        programa.save()
+        self.assertIsNone(SnapshotProgramacion.obtener_vigente(programa))
+
+    def test_invalidacion_durante_el_calculo_descarta_el_resultado(self):
+        programa = self.escenario.programa
+        reserva = SnapshotProgramacion.reservar_version(programa)
+        SnapshotProgramacion.invalidar([programa.id])
+        self.assertFalse(reserva.completar({'ordenes_trabajo': [], 'routes_data': {}}, programa.fecha_fin))
+        self.assertFalse(SnapshotProgramacion.objects.filter(programa=programa).exists())
+
+    def test_reserva_simultanea_reintenta_con_otra_version(self):
+        programa = self.escenario.programa
+        SnapshotProgramacion.reservar_version(programa)
+        agregar = QuerySet.aggregate
+        lecturas = []
+
+        def maximo_desactualizado(qs, *args, **kwargs):
+            # La primera lectura no ve la versión 1, como si otra petición la hubiera creado en paralelo
+            lecturas.append(1)
+            return {'version__max': None} if len(lecturas) == 1 else agregar(qs, *args, **kwargs)
+
+        with patch.object(QuerySet, 'aggregate', maximo_desactualizado):
+            reserva = SnapshotProgramacion.reservar_version(programa)
+        self.assertEqual(reserva.version, 2)
+        self.assertEqual(len(lecturas), 2)
+
+    def test_una_sola_programacion_por_calculo(self):
+        programa = self.escenario.programa
+        with patch.object(ProductionScheduler, '_generate_base_timeline',
+                          autospec=True, side_effect=ProductionScheduler._generate_base_timeline) as programar:
+            datos = self._leer()
+        self.assertEqual(programar.call_count, 1)
+        programa.refresh_from_db()
+        fin = max(item['end_time'] for item in datos['routes_data']['items'])
+        self.assertEqual(programa.fecha_fin.isoformat(), fin[:10])
+
+    def test_conserva_las_ultimas_versiones(self):
+        programa = self.escenario.programa
+        for _ in range(SnapshotProgramacion.MAX_VERSIONES + 3):
+            SnapshotProgramacion.reservar_version(programa).completar({'ordenes_trabajo': []}, programa.fecha_fin)
+        versiones = list(SnapshotProgramacion.objects.filter(programa=programa).values_list('version', flat=True))
+        self.assertEqual(versiones, list(range(8, 3, -1)))
+
+
+class TareasFragmentadasEnBloqueTests(TestCase):
+    """create_fragmented_tasks guarda las tareas del timeline en bloque y es idempotente"""
+
+    def setUp(self):
+        ProductionScheduler.descartar_estado()
+        self.scheduler = ProductionScheduler(TimeCalculator())
+
+    def _generar(self, escenario):
+        ordenes = ProgramDetailView().get_ordenes_trabajo(escenario.programa)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertTrue(self.scheduler.create_fragmented_tasks(escenario.programa, ordenes))
+        return len(consultas)
+
+    def test_una_tarea_por_dia_y_proceso(self):
+        escenario = _crear_programa([[('M1', 1200, 60), ('M2', 100, 50)], [('M1', 300, 100)]])
+        self._generar(escenario)
+
+        tareas = TareaFragmentada.objects.filter(programa=escenario.programa)
+        claves = list(tareas.values_list('tarea_original_id', 'fecha'))
+        self.assertEqual(len(claves), len(set(claves)))
+        # 1200 unidades a 60/h son 20 horas: tres días laborales desde el lunes
+        self.assertEqual(
+            sorted(f for i, f in claves if i == escenario.items[0][0].id),
+            [date(2025, 3, 3), date(2025, 3, 4), date(2025, 3, 5)]
+        )
+        self.assertEqual({i for i, _ in claves}, {item.id for ot in escenario.items for item in ot})
+        self.assertTrue(all(timezone.localtime(t.fecha_planificada_inicio).date() == t.fecha for t in tareas))
+
+        dias_laborales = [
+            d for d in (escenario.programa.fecha_inicio + timedelta(days=k)
+                        for k in range((escenario.programa.fecha_fin - escenario.programa.fecha_inicio).days + 1))
+            if TimeCalculator.is_working_day(d)
+        ]
+        self.assertEqual(
+            sorted(ReporteDiarioPrograma.objects.filter(programa=escenario.programa).values_list('fecha', flat=True)),
+            dias_laborales
+        )
+
+    def test_segunda_corrida_actualiza_sin_duplicar(self):
+        escenario = _crear_programa([[('M1', 1200, 60)], [('M2', 500, 40)]])
+        self._generar(escenario)
+        antes = dict(TareaFragmentada.objects.filter(programa=escenario.programa).values_list('id', 'cantidad_asignada'))
+        TareaFragmentada.objects.filter(programa=escenario.programa).update(cantidad_asignada=0, estado='COMPLETADO')
+
+        self._generar(escenario)
+        despues = TareaFragmentada.objects.filter(programa=escenario.programa)
+        self.assertEqual(dict(despues.values_list('id', 'cantidad_asignada')), antes)
+        self.assertEqual(set(despues.values_list('estado', flat=True)), {'PENDIENTE'})
+
+    def test_consultas_no_crecen_con_las_ots(self):
+        pequeno = _crear_programa([[('M1', 600, 60)]] * 2)
+        grande = _crear_programa([[('M1', 600, 60), ('M2', 300, 60)]] * 8)
+        self.assertEqual(self._generar(pequeno), self._generar(grande))
+        # Una segunda corrida (todo actualización) tampoco depende del tamaño
+        self.assertEqual(self._generar(pequeno), self._generar(grande))
+
+
+class MachineIntervalIndexTests(SimpleTestCase):
+    """Consultas del índice contra una grilla de ocupación en pasos de 5 minutos"""
+
+    PASO = timedelta(minutes=5)
+    HORIZONTE = 1200  # pasos
+
+    def _escenario(self, rnd):
+        """Intervalos aleatorios (con traslapes y repetición de inicios) y su grilla de ocupación"""
+        intervalos, ocupado = [], [False] * (self.HORIZONTE + 200)
+        for k in range(rnd.randrange(0, 20)):
+            desde = rnd.randrange(0, 1000)
+            largo = rnd.randrange(1, 60)
+            intervalos.append({
+                'inicio': LUNES + desde * self.PASO, 'fin': LUNES + (desde + largo) * self.PASO,
+                'prioridad': rnd.randrange(3), 'id': k,
+            })
+            for paso in range(desde, desde + largo):
+                ocupado[paso] = True
+        return intervalos, ocupado
+
+    def test_siguiente_hueco_y_siguiente_libre(self):
+        rnd = random.Random(11)
+        for _ in range(150):
+            intervalos, ocupado = self._escenario(rnd)
+            indice = MachineIntervalIndex(intervalos)
+            for _ in range(15):
+                desde, pasos = rnd.randrange(0, 1100), rnd.randrange(1, 80)
+                hueco = next(t for t in range(desde, self.HORIZONTE) if not any(ocupado[t:t + pasos]))
+                libre = next(t for t in range(desde, self.HORIZONTE) if not ocupado[t])
+                self.assertEqual(indice.siguiente_hueco(LUNES + desde * self.PASO, pasos * self.PASO), LUNES + hueco * self.PASO)
+                self.assertEqual(indice.siguiente_libre(LUNES + desde * self.PASO), LUNES + libre * self.PASO)
+
+    def test_primer_conflicto_respeta_el_orden_del_indice(self):
+        rnd = random.Random(7)
+        clave = lambda i: (i['inicio'], i['prioridad'], i['id'])
+        for _ in range(150):
+            intervalos, ocupado = self._escenario(rnd)
+            indice = MachineIntervalIndex(intervalos, clave_orden=clave)
+            for _ in range(15):
+                desde, pasos = rnd.randrange(0, 1100), rnd.randrange(1, 80)
+                inicio, fin = LUNES + desde * self.PASO, LUNES + (desde + pasos) * self.PASO
+                traslapados = sorted((i for i in intervalos if i['inicio'] < fin and i['fin'] > inicio), key=clave)
+                conflicto = indice.primer_conflicto(inicio, fin)
+                self.assertIs(conflicto, traslapados[0] if traslapados else None)
+                self.assertEqual(indice.tiene_conflicto(inicio, fin), any(ocupado[desde:desde + pasos]))
+
+    def test_intervalos_vacios_se_ignoran(self):
+        indice = MachineIntervalIndex([{'inicio': LUNES, 'fin': LUNES}])
+        self.assertEqual(len(indice), 0)
+        self.assertEqual(indice.siguiente_hueco(LUNES, timedelta(hours=1)), LUNES)
+
+
+class OcupacionMaquinaDiaTests(TestCase):
+    """La ocupación guardada sigue a los cambios por señales y coincide con un recálculo completo"""
+
+    def _crear(self, rutas):
+        with self.captureOnCommitCallbacks(execute=True):
+            return _crear_programa(rutas)
+
+    def _reservados(self, maquina):
+        return dict(OcupacionMaquinaDia.objects.filter(maquina=maquina).values_list('fecha', 'minutos_reservados'))
+
+    def test_senales_mantienen_la_ocupacion(self):
+        escenario = self._crear([[('M1', 600, 60)], [('M2', 120, 60)]])
+        m1, m2 = escenario.maquinas['M1'], escenario.maquinas['M2']
+        # 600 minutos desde el lunes: 540 ese día y 60 el martes
+        self.assertEqual(self._reservados(m1), {date(2025, 3, 3): 540, date(2025, 3, 4): 60})
+        self.assertEqual(m2.calcular_carga_fecha(date(2025, 3, 3)), 2)
+
+        # Cambiar de máquina recalcula la de origen y la de destino
+        item = escenario.items[0][0]
+        with self.captureOnCommitCallbacks(execute=True):
+            item.maquina = m2
+            item.save()
+        self.assertEqual(self._reservados(m1), {})
+        self.assertEqual(self._reservados(m2), {date(2025, 3, 3): 540 + 120, date(2025, 3, 4): 60})
+        self.assertEqual(MachineOccupancyService().verificar_consistencia(), [])
+
+    def test_bloqueos_de_maquina(self):
+        escenario = self._crear([[('M1', 60, 60)]])
+        maquina = escenario.maquinas['M1']
+        inicio = timezone.make_aware(datetime(2025, 3, 4, 12, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            IntervaloMaquina.objects.create(
+                maquina=maquina, tipo='MAQUINA', fecha_inicio=inicio, fecha_fin=inicio + timedelta(hours=3)
+            )
+        ocupacion = OcupacionMaquinaDia.objects.get(maquina=maquina, fecha=date(2025, 3, 4))
+        # 12:00 a 15:00 menos la colación
+        self.assertEqual(ocupacion.minutos_bloqueados, 120)
+
+    def test_cambios_de_una_transaccion_se_recalculan_juntos(self):
+        escenario = self._crear([[('M1', 600, 60), ('M2', 120, 60)]])
+        with patch.object(MachineOccupancyService, 'actualizar') as actualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                for item in escenario.items[0]:
+                    item.estandar = 30
+                    item.save()
+        actualizar.assert_called_once()
+        self.assertEqual(set(actualizar.call_args.args[0]), {m.id for m in escenario.maquinas.values()})
+
+    def test_un_callback_por_transaccion_y_sin_arrastre_tras_rollback(self):
+        escenario = self._crear([[('M1', 600, 60)], [('M2', 120, 60)]])
+        primero, segundo = escenario.items[0][0], escenario.items[1][0]
+        with patch.object(MachineOccupancyService, 'actualizar') as actualizar:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                # Un cambio revertido no deja su máquina pendiente
+                with self.assertRaises(ValueError), transaction.atomic():
+                    primero.estandar = 30
+                    primero.save()
+                    raise ValueError
+                for estandar in (30, 40):
+                    segundo.estandar = estandar
+                    segundo.save()
+        self.assertEqual(len([c for c in callbacks if getattr(c, 'lote', None) is pendientes_ocupacion]), 1)
+        actualizar.assert_called_once_with({escenario.maquinas['M2'].id})
+
+        # La transacción siguiente vuelve a agendar su propio recálculo
+        with patch.object(MachineOccupancyService, 'actualizar') as actualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                primero.save()
+        actualizar.assert_called_once_with({escenario.maquinas['M1'].id})
+
+    def test_verificar_y_reconstruir(self):
+        escenario = self._crear([[('M1', 600, 60)]])
+        # update() no emite señales: la caché queda desfasada
+        ItemRuta.objects.filter(pk=escenario.items[0][0].pk).update(cantidad_pedido=300)
+
+        salida = StringIO()
+        call_command('reconstruir_ocupacion_maquinas', '--verificar', stdout=salida)
+        self.assertIn('2 diferencias', salida.getvalue())
+        self.assertEqual(OcupacionMaquinaDia.objects.get(fecha=date(2025, 3, 3)).minutos_reservados, 540)
+
+        call_command('reconstruir_ocupacion_maquinas', stdout=StringIO())
+        self.assertEqual(MachineOccupancyService().verificar_consistencia(), [])
+        self.assertEqual(self._reservados(escenario.maquinas['M1']), {date(2025, 3, 3): 300})
+
+
+class AjustesNecesariosTests(TestCase):
+    """obtener_ajustes_necesarios propone mover lo que choca con reservas ajenas o propias"""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            # Otro programa ocupa M1 desde el lunes 7:45 hasta el martes 8:45
+            self.ajeno = _crear_programa([[('M1', 600, 60)]])
+            self.programa = _crear_programa(
+                [[('M1', 120, 60), ('M2', 60, 60)], [('M3', 240, 60)], [('M3', 60, 60)]],
+                maquinas=self.ajeno.maquinas
+            )
+
+    def test_ajustes_por_reservas_ajenas_y_propias(self):
+        ajustes = MachineAvailabilityService().obtener_ajustes_necesarios(self.programa.programa)
+        por_item = {a['item_ruta'].id: a for a in ajustes}
+        codigo_ot = lambda escenario, k: escenario.items[k][0].ruta.orden_trabajo.codigo_ot
+
+        # M1 queda libre el martes a las 8:45; más el setup
+        m1 = por_item.pop(self.programa.items[0][0].id)
+        self.assertEqual((m1['fecha_original'], m1['fecha_ajustada']), (LUNES, datetime(2025, 3, 4, 9, 15)))
+        self.assertEqual(m1['conflicto_con'], codigo_ot(self.ajeno, 0))
+
+        # La segunda OT en M3 espera a la primera del mismo programa
+        m3 = por_item.pop(self.programa.items[2][0].id)
+        self.assertEqual(m3['fecha_ajustada'], LUNES + timedelta(hours=4, minutes=30))
+        self.assertEqual(m3['conflicto_con'], codigo_ot(self.programa, 1))
+
+        # El sucesor en M2 queda listo tras su predecesor y no choca con nada
+        self.assertEqual(por_item, {})
+
+    def test_el_otro_programa_ve_la_reserva_inversa(self):
+        ajuste, = MachineAvailabilityService().obtener_ajustes_necesarios(self.ajeno.programa)
+        self.assertEqual(ajuste['item_ruta'], self.ajeno.items[0][0])
+        self.assertEqual(ajuste['fecha_ajustada'], LUNES + timedelta(hours=2, minutes=30))
+        self.assertEqual(ajuste['conflicto_con'], self.programa.items[0][0].ruta.orden_trabajo.codigo_ot)
+
+    def test_inicio_ajustado_cae_en_horario_laboral(self):
+        # 5 horas desde las 7:45 terminan a las 12:45; más el setup caería en la colación
+        escenario = _crear_programa([[('M1', 300, 60)], [('M1', 60, 60)]])
+        ajuste, = MachineAvailabilityService().obtener_ajustes_necesarios(escenario.programa)
+        self.assertEqual(ajuste['item_ruta'], escenario.items[1][0])
+        self.assertEqual(ajuste['fecha_ajustada'], datetime(2025, 3, 3, 14, 0))
+
+    def test_setup_segun_la_secuencia_de_la_maquina(self):
+        escenario = _crear_programa([[('M1', 300, 60)], [('M1', 60, 60)]])
+        TiempoPreparacion.objects.create(maquina=escenario.maquinas['M1'], minutos=120)
+        ajuste, = MachineAvailabilityService().obtener_ajustes_necesarios(escenario.programa)
+        # 12:45 más dos horas de preparación en vez de los 30 minutos por defecto
+        self.assertEqual(ajuste['fecha_ajustada'], datetime(2025, 3, 3, 14, 45))
+
+    def test_respeta_el_calendario_de_la_maquina(self):
+        escenario = _crear_programa([[('M1', 300, 60)], [('M1', 60, 60)]])
+        lunes = DisponibilidadMaquina.objects.create(maquina=escenario.maquinas['M1'], fecha=LUNES.date())
+        BloqueoMaquina.objects.create(disponibilidad=lunes, hora_inicio=time(14, 0), hora_fin=time(16, 0), motivo='Ajuste')
+        ajuste, = MachineAvailabilityService().obtener_ajustes_necesarios(escenario.programa)
+        self.assertEqual(ajuste['fecha_ajustada'], datetime(2025, 3, 3, 16, 0))
+
+
+class CargaRangoTests(TestCase):
+    """carga_rango agrega las TareaFragmentada en una consulta y llena la matriz densa"""
+
+    def setUp(self):
+        rnd = random.Random(12)
+        self.escenario = _crear_programa([
+            [(rnd.choice('ABC'), 100, rnd.choice((20, 50, 80))) for _ in range(3)] for _ in range(4)
+        ])
+        self.otro = _crear_programa([[('A', 100, 40)]], maquinas=self.escenario.maquinas)
+        self.tareas = []
+        for escenario in (self.escenario, self.otro):
+            for item in (i for ot in escenario.items for i in ot):
+                for dia in rnd.sample(range(12), 4):
+                    self.tareas.append(TareaFragmentada(
+                        tarea_original=item, programa=escenario.programa, fecha=LUNES.date() + timedelta(days=dia),
+                        cantidad_asignada=rnd.randrange(1, 90), cantidad_pendiente_anterior=rnd.randrange(0, 20)
+                    ))
+        TareaFragmentada.objects.bulk_create(self.tareas)
+        self.ids = [m.id for m in self.escenario.maquinas.values()]
+
+    def _esperado(self, desde, hasta, programas=None):
+        horas = defaultdict(float)
+        for tarea in self.tareas:
+            if desde <= tarea.fecha <= hasta and (programas is None or tarea.programa_id in programas):
+                cantidad = float(tarea.cantidad_asignada + tarea.cantidad_pendiente_anterior)
+                horas[(tarea.tarea_original.maquina_id, tarea.fecha)] += cantidad / tarea.tarea_original.estandar
+        return horas
+
+    def test_igual_a_sumar_tarea_por_tarea(self):
+        desde, hasta = LUNES.date() + timedelta(days=2), LUNES.date() + timedelta(days=9)
+        with self.assertNumQueries(1):
+            carga = MachineLoadService().carga_rango(desde, hasta, self.ids)
+        self.assertEqual(carga.horas.shape, (3, 8))
+
+        esperado = self._esperado(desde, hasta)
+        for maquina_id in self.ids:
+            for k in range(8):
+                fecha = desde + timedelta(days=k)
+                self.assertAlmostEqual(carga.horas_dia(maquina_id, fecha), esperado.get((maquina_id, fecha), 0))
+        self.assertAlmostEqual(sum(carga.total_por_maquina().values()), sum(esperado.values()))
+        with self.assertRaises(KeyError):
+            carga.horas_dia(self.ids[0], hasta + timedelta(days=1))
+
+    def test_filtro_por_programa_y_semana(self):
+        programa = self.otro.programa
+        carga = MachineLoadService().carga_semana(LUNES.date() + timedelta(days=3), programa_ids=[programa.id])
+        self.assertEqual(carga.fechas[0].astype(date), LUNES.date())
+        self.assertEqual(len(carga.fechas), 7)
+
+        esperado = self._esperado(LUNES.date(), LUNES.date() + timedelta(days=6), {programa.id})
+        dias = carga.to_dict()[self.escenario.maquinas['A'].id]
+        self.assertEqual(set(dias), {fecha.isoformat() for _, fecha in esperado})
+        for (_, fecha), horas in esperado.items():
+            self.assertAlmostEqual(dias[fecha.isoformat()], horas)
+
+
+class MapaCalorTests(TestCase):
+    """Horas reservadas vs. disponibles por máquina, su agregación semanal y su caché"""
+
+    def setUp(self):
+        self.cache = caches[MAPA_CALOR_CACHE]
+        self.cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.escenario = _crear_programa([[('M1', 100, 10)], [('M2', 100, 50)]])
+            self.m1, self.m2 = self.escenario.maquinas['M1'], self.escenario.maquinas['M2']
+            self._tarea(self.escenario.items[0][0], LUNES.date(), 120)  # 12 horas: sobrecarga
+            self._tarea(self.escenario.items[1][0], LUNES.date() + timedelta(days=4), 200)  # 4 horas el viernes
+
+    def _tarea(self, item, fecha, cantidad):
+        return TareaFragmentada.objects.create(
+            tarea_original=item, programa=self.escenario.programa, fecha=fecha, cantidad_asignada=cantidad
+        )
+
+    def _mapa(self, granularidad='dia', hasta=6):
+        return MachineLoadService().mapa_calor(
+            LUNES.date(), LUNES.date() + timedelta(days=hasta), granularidad, [self.m1.id, self.m2.id]
+        )
+
+    def test_reservado_y_disponible_por_dia(self):
+        # M2 no está disponible el martes y tiene un bloqueo de 13:00 a 15:00 el miércoles
+        DisponibilidadMaquina.objects.create(maquina=self.m2, fecha=date(2025, 3, 4), disponible=False)
+        miercoles = DisponibilidadMaquina.objects.create(maquina=self.m2, fecha=date(2025, 3, 5))
+        BloqueoMaquina.objects.create(disponibilidad=miercoles, hora_inicio=time(13, 0), hora_fin=time(15, 0), motivo='x')
+
+        mapa = self._mapa()
+        m1, m2 = sorted(mapa['maquinas'], key=lambda m: m['codigo'])
+        self.assertEqual(m1['horas_reservadas'], [12, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(m1['horas_disponibles'], [9, 9, 9, 9, 8, 0, 0])
+        self.assertEqual(m2['horas_reservadas'], [0, 0, 0, 0, 4, 0, 0])
+        self.assertEqual(m2['horas_disponibles'], [9, 0, 8, 9, 8, 0, 0])
+        self.assertEqual(m2['utilizacion'][4], 0.5)
+        self.assertIsNone(m2['utilizacion'][5])
+        self.assertEqual(
+            [(s['codigo'], s['periodo'], s['exceso']) for s in mapa['sobrecargas']],
+            [('M1', '2025-03-03', 3)]
+        )
+
+    def test_semanas(self):
+        self._tarea(self.escenario.items[0][0], LUNES.date() + timedelta(days=8), 50)
+        mapa = self._mapa('semana', hasta=9)
+        self.assertEqual(
+            mapa['periodos'],
+            [{'inicio': '2025-03-03', 'fin': '2025-03-09'}, {'inicio': '2025-03-10', 'fin': '2025-03-12'}]
+        )
+        m1 = next(m for m in mapa['maquinas'] if m['codigo'] == 'M1')
+        self.assertEqual(m1['horas_reservadas'], [12, 5])
+        self.assertEqual(m1['horas_disponibles'], [44, 27])
+        self.assertEqual(mapa['sobrecargas'], [])
+
+    def test_cache_se_invalida_con_los_cambios(self):
+        primero = self._mapa()
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self._mapa(), primero)
+        # Solo se lee la caché compartida: nada se recalcula desde las tareas
+        self.assertTrue(all(self.cache._table in q['sql'] for q in consultas.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._tarea(self.escenario.items[1][0], LUNES.date() + timedelta(days=1), 100)
+        m2 = next(m for m in self._mapa()['maquinas'] if m['codigo'] == 'M2')
+        self.assertEqual(m2['horas_reservadas'][1], 2)
+
+    def test_version_cambia_una_vez_por_transaccion(self):
+        self._mapa()
+        version = self.cache.get('mapa_calor:version', 0)
+        with patch.object(type(self.cache), 'incr', autospec=True, side_effect=type(self.cache).incr) as incr:
+            with self.captureOnCommitCallbacks(execute=True):
+                for dia in range(3):
+                    self._tarea(self.escenario.items[0][0], LUNES.date() + timedelta(days=dia + 1), 10)
+                # Hasta confirmar se sigue sirviendo el mapa anterior
+                self.assertEqual(self.cache.get('mapa_calor:version', 0), version)
+        self.assertEqual(incr.call_count, 1)
+        self.assertEqual(self.cache.get('mapa_calor:version'), version + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self._tarea(self.escenario.items[0][0], LUNES.date() + timedelta(days=5), 10)
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(self.cache.get('mapa_calor:version'), version + 1)
+
+    def test_endpoint(self):
+        cliente = APIClient()
+        cliente.force_authenticate(get_user_model().objects.create(username='jefe', rut='11.111.111-1'))
+        url = reverse('maquinas-carga')
+        respuesta = cliente.get(url, {'fecha_inicio': '2025-03-03', 'fecha_fin': '2025-03-09', 'maquinas': f'{self.m1.id}'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([m['codigo'] for m in respuesta.json()['maquinas']], ['M1'])
+        self.assertEqual(cliente.get(url, {'fecha_inicio': '03-03-2025'}).status_code, 400)
+        self.assertEqual(cliente.get(url, {'fecha_inicio': '2025-03-03', 'granularidad': 'mes'}).status_code, 400)
+
+
+class CalendarioMaquinaTests(SimpleTestCase):
+    """MachineCalendar descuenta excepciones y bloqueos del tiempo trabajable"""
+
+    def _calendario(self, dias=None, bloqueos=None, inicio=time(7, 45), fin=time(17, 45)):
+        return MachineCalendar(
+            date(2025, 3, 1), date(2025, 4, 30), inicio, fin, min(fin, TimeCalculator.FRIDAY_END),
+            TimeCalculator.BREAK_START, TimeCalculator.BREAK_END, feriados=set(), dias=dias, bloqueos=bloqueos
+        )
+
+    def test_excepciones_y_bloqueos(self):
+        calendario = self._calendario(
+            dias={date(2025, 3, 4): None, date(2025, 3, 5): (time(10, 0), time(12, 0))},
+            bloqueos=[(datetime(2025, 3, 3, 9, 0), datetime(2025, 3, 3, 11, 0))]
+        )
+        self.assertEqual(
+            [calendario.minutos_laborables_dia(date(2025, 3, d)) for d in (3, 4, 5, 6)],
+            [540 - 120, 0, 120, 540]
+        )
+        self.assertEqual(calendario.sumar_minutos(LUNES, 180), datetime(2025, 3, 3, 12, 45))
+        self.assertEqual(calendario.sumar_minutos(datetime(2025, 3, 3, 17, 0), 60), datetime(2025, 3, 5, 10, 15))
+        self.assertEqual(calendario.ajustar_inicio(datetime(2025, 3, 3, 9, 30)), datetime(2025, 3, 3, 11, 0))
+
+    def test_sumar_minutos_igual_a_contar_minuto_a_minuto(self):
+        rnd = random.Random(14)
+        for _ in range(30):
+            bloqueos = []
+            for _ in range(rnd.randrange(0, 6)):
+                inicio = LUNES + timedelta(minutes=rnd.randrange(0, 9 * 24 * 60, 15))
+                bloqueos.append((inicio, inicio + timedelta(minutes=rnd.randrange(15, 600, 15))))
+            inicio_turno = rnd.choice((time(7, 45), time(8, 30)))
+            fin_turno = rnd.choice((time(17, 45), time(16, 0)))
+            calendario = self._calendario(bloqueos=bloqueos, inicio=inicio_turno, fin=fin_turno)
+
+            def trabajable(instante):
+                hora = instante.time()
+                fin = min(fin_turno, TimeCalculator.FRIDAY_END) if instante.weekday() == 4 else fin_turno
+                return (
+                    instante.weekday() < 5 and inicio_turno <= hora < fin
+                    and not TimeCalculator.BREAK_START <= hora < TimeCalculator.BREAK_END
+                    and not any(a <= instante < b for a, b in bloqueos)
+                )
+
+            desde = LUNES + timedelta(minutes=rnd.randrange(0, 3 * 24 * 60, 5))
+            minutos = rnd.randrange(1, 1500)
+            instante, contados = desde, 0
+            while True:
+                if trabajable(instante):
+                    contados += 1
+                    if contados == minutos:
+                        break
+                instante += timedelta(minutes=1)
+            self.assertEqual(calendario.sumar_minutos(desde, minutos), instante + timedelta(minutes=1))
+
+
+class CalendariosPorMaquinaTests(TestCase):
+    """El programador solo ubica trabajo en el tiempo libre del calendario de cada máquina"""
+
+    def setUp(self):
+        self.escenario = _crear_programa([[('M1', 120, 60)], [('M2', 120, 60)]])
+        self.m1, self.m2 = self.escenario.maquinas['M1'], self.escenario.maquinas['M2']
+
+    def test_maquina_sin_particularidades_usa_el_calendario_general(self):
+        calendarios = MachineCalendarService().calendarios([self.m1.id], LUNES)
+        self.assertIs(calendarios[self.m1.id], TimeCalculator.get_calendar())
+
+    def test_programa_alrededor_de_bloqueos_y_mantenciones(self):
+        lunes = DisponibilidadMaquina.objects.create(maquina=self.m1, fecha=LUNES.date())
+        BloqueoMaquina.objects.create(disponibilidad=lunes, hora_inicio=time(8, 0), hora_fin=time(10, 0), motivo='Ajuste')
+        MantenimientoMaquina.objects.create(
+            maquina=self.m2, tipo_mantenimiento='PR', descripcion='Cambio de matriz',
+            fecha_programada=timezone.make_aware(LUNES), duracion_estimada=timedelta(hours=3)
+        )
+
+        ordenes = [
+            _orden_trabajo(ot, ot, [(item.maquina_id, 120, 60)])
+            for ot, item in ((1, self.escenario.items[0][0]), (2, self.escenario.items[1][0]))
+        ]
+        timeline = ProductionScheduler(TimeCalculator())._generate_base_timeline(
+            SimpleNamespace(id=None, fecha_inicio=LUNES.date()), ordenes
+        )
+        tramos = defaultdict(list)
+        for item in timeline['items']:
+            tramos[item['ot_id']].append((item['start_time'][11:16], item['end_time'][11:16]))
+
+        # M1: 15 minutos antes del bloqueo y el resto desde las 10:00
+        self.assertEqual(tramos['ot_1'][0][0], '07:45')
+        self.assertEqual(tramos['ot_1'][-1][1], '11:45')
+        # M2: después de la mantención de 7:45 a 10:45
+        self.assertEqual(tramos['ot_2'], [('10:45', '12:45')])
+
+
+class OperatorAvailabilityTests(SimpleTestCase):
+
+    def test_elige_al_menos_cargado_o_informa_la_liberacion(self):
+        disponibilidad = OperatorAvailability({1: [10, 20]}, {20: [(LUNES, LUNES + timedelta(hours=1))]})
+        self.assertEqual(disponibilidad.elegir(1, LUNES, LUNES + timedelta(minutes=30)), (10, None))
+
+        disponibilidad.reservar(10, LUNES, LUNES + timedelta(hours=2))
+        self.assertEqual(disponibilidad.elegir(1, LUNES, LUNES + timedelta(minutes=30)), (None, LUNES + timedelta(hours=1)))
+        self.assertEqual(disponibilidad.elegir(1, LUNES + timedelta(hours=1), LUNES + timedelta(hours=3)), (20, None))
+        self.assertEqual(disponibilidad.elegir(2, LUNES, LUNES + timedelta(hours=1)), (None, None))
+
+    def test_tramos_contiguos_se_fusionan(self):
+        disponibilidad = OperatorAvailability({}, {7: [
+            (LUNES + timedelta(hours=1), LUNES + timedelta(hours=2)),
+            (LUNES, LUNES + timedelta(hours=1)),
+            (LUNES + timedelta(hours=4), LUNES + timedelta(hours=5)),
+        ]})
+        disponibilidad.reservar(7, LUNES + timedelta(hours=2), LUNES + timedelta(hours=4))
+        self.assertEqual(disponibilidad.bloques_inicio[7], [LUNES])
+        self.assertEqual(disponibilidad.bloques_fin[7], [LUNES + timedelta(hours=5)])
+
+
+class ProgramacionConOperadoresTests(TestCase):
+    """Con considerar_operadores una operación espera a que un operador habilitado quede libre"""
+
+    def setUp(self):
+        self.escenario = _crear_programa([[('M1', 120, 60)], [('M2', 120, 60)], [('M3', 120, 60)]])
+        empresa = self.escenario.programa.programaordentrabajo_set.first().orden_trabajo.empresa
+        self.operador = Operador.objects.create(nombre='Ana', rut='11.111.111-1', empresa=empresa)
+        for codigo in ('M1', 'M2'):
+            OperadorMaquina.objects.create(operador=self.operador, maquina=self.escenario.maquinas[codigo])
+
+    def _programar(self):
+        ordenes = [
+            _orden_trabajo(ot, ot, [(items[0].maquina_id, 120, 60)])
+            for ot, items in enumerate(self.escenario.items, start=1)
+        ]
+        scheduler = ProductionScheduler(TimeCalculator(), considerar_operadores=True)
+        timeline = scheduler._generate_base_timeline(self.escenario.programa, ordenes)
+        tramos = {
+            item['ot_id']: (item['start_time'][11:16], item['end_time'][11:16], item['asignado'])
+            for item in timeline['items']
+        }
+        return scheduler, tramos
+
+    def test_un_operador_no_atiende_dos_maquinas_a_la_vez(self):
+        scheduler, tramos = self._programar()
+        self.assertEqual(tramos['ot_1'], ('07:45', '09:45', True))
+        self.assertEqual(tramos['ot_2'], ('09:45', '11:45', True))
+        # M3 no tiene operadores habilitados: se programa igual y queda informada
+        self.assertEqual(tramos['ot_3'], ('07:45', '09:45', False))
+        self.assertEqual(scheduler.resumen_operadores['asignados'], 2)
+        self.assertEqual(scheduler.resumen_operadores['sin_operador'], ['proc_300'])
+
+    def test_segundo_operador_permite_trabajar_en_paralelo(self):
+        otro = Operador.objects.create(nombre='Luis', rut='22.222.222-2', empresa=self.operador.empresa)
+        OperadorMaquina.objects.create(operador=otro, maquina=self.escenario.maquinas['M2'])
+        scheduler, tramos = self._programar()
+        self.assertEqual(tramos['ot_2'], ('07:45', '09:45', True))
+        self.assertEqual(scheduler.resumen_operadores['esperas'], 0)
+
+    def test_respeta_las_ausencias(self):
+        IntervaloOperador.objects.create(
+            operador=self.operador, tipo='OPERADOR', motivo='Licencia',
+            fecha_inicio=timezone.make_aware(LUNES), fecha_fin=timezone.make_aware(LUNES + timedelta(hours=1))
+        )
+        _, tramos = self._programar()
+        self.assertEqual(tramos['ot_1'], ('08:45', '10:45', True))
+        self.assertEqual(tramos['ot_2'], ('10:45', '12:45', True))
+
+
+class ProgramacionGlobalTests(TestCase):
+    """Varios programas se programan juntos sin compartir una máquina al mismo tiempo"""
+
+    def setUp(self):
+        self.primero = _crear_programa([[('M1', 120, 60), ('M2', 60, 60)], [('M1', 60, 60)]])
+        self.segundo = _crear_programa([[('M1', 180, 60)]], maquinas=self.primero.maquinas)
+
+    @staticmethod
+    def _tramos(routes_data):
+        return sorted(
+            (item['start_time'], item['end_time'])
+            for item in routes_data['items']
+            if item['maquina'] == 'Máquina M1'
+        )
+
+    def test_sin_traslapes_entre_programas(self):
+        programas = [self.segundo.programa, self.primero.programa]
+        resultado = ProgramDetailView().generar_programacion_global(programas)
+
+        tramos = sorted(
+            self._tramos(resultado[self.primero.programa.id][1]) + self._tramos(resultado[self.segundo.programa.id][1])
+        )
+        self.assertEqual(len(tramos), 3)
+        for (_, fin), (inicio, _) in zip(tramos, tramos[1:]):
+            self.assertLessEqual(fin, inicio)
+        # Con el mismo inicio, el programa más antiguo toma la máquina primero
+        self.assertLess(
+            self._tramos(resultado[self.primero.programa.id][1])[0],
+            self._tramos(resultado[self.segundo.programa.id][1])[0]
+        )
+
+        for escenario in (self.primero, self.segundo):
+            snapshot = SnapshotProgramacion.obtener_vigente(escenario.programa)
+            self.assertTrue(snapshot.datos['programacion_global'])
+
+    def test_lectura_no_recalcula_la_programacion_global(self):
+        cliente = APIClient()
+        cliente.force_authenticate(get_user_model().objects.create(username='jefe', rut='11.111.111-1'))
+        url = reverse('get-program', args=[self.segundo.programa.id])
+        ProgramDetailView().generar_programacion_global([self.primero.programa, self.segundo.programa])
+        guardada = SnapshotProgramacion.obtener_vigente(self.segundo.programa)
+
+        item = self.segundo.items[0][0]
+        item.cantidad_pedido = 240
+        item.save()
+        with patch.object(ProductionScheduler, 'generate_global_timelines') as global_, \
+                patch.object(ProductionScheduler, '_generate_base_timeline') as individual:
+            respuesta = cliente.get(url)
+        global_.assert_not_called()
+        individual.assert_not_called()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.json()['programacion_desactualizada'])
+        self.assertEqual(respuesta.json()['routes_data'], guardada.datos['routes_data'])
+
+        # Al volver a ejecutar la programación global la lectura queda al día
+        ProgramDetailView().generar_programacion_global([self.primero.programa, self.segundo.programa])
+        self.assertNotIn('programacion_desactualizada', cliente.get(url).json())
+
+    def test_cada_ot_comienza_desde_el_inicio_de_su_programa(self):
+        self.segundo.programa.fecha_inicio = LUNES.date() + timedelta(days=1)
+        self.segundo.programa.save()
+        resultado = ProgramDetailView().generar_programacion_global(
+            [self.primero.programa, self.segundo.programa]
+        )
+        inicio, _ = self._tramos(resultado[self.segundo.programa.id][1])[0]
+        self.assertEqual(inicio, '2025-03-04 07:45:00')
+
+    def test_comando(self):
+        salida = StringIO()
+        call_command('programar_global', programa_id=[self.primero.programa.id], stdout=salida)
+        self.assertIn('Programación global guardada para 1 programas', salida.getvalue())
+        self.assertIsNone(SnapshotProgramacion.obtener_vigente(self.segundo.programa))
+
+
+@patch('JobManagement.services.what_if.os.cpu_count', return_value=1)
+class WhatIfTests(TestCase):
+    """Alternativas de prioridad evaluadas en memoria, sin escribir en la base de datos"""
+
+    def setUp(self):
+        # OT 1 ocupa M1 más de un día; OT 2 es corta y vence el mismo lunes
+        self.escenario = _crear_programa([[('M1', 600, 60)], [('M1', 60, 60)]])
+        self.ots = [items[0].ruta.orden_trabajo for items in self.escenario.items]
+        OrdenTrabajo.objects.filter(id=self.ots[1].id).update(fecha_termino=LUNES.date())
+
+    def test_invertir_prioridades_elimina_el_atraso(self, _):
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = WhatIfService().evaluar(self.escenario.programa, [
+                {'nombre': 'Urgente primero', 'orden': [self.ots[1].id]}
+            ])
+        self.assertTrue(all(q['sql'].lstrip().upper().startswith('SELECT') for q in consultas.captured_queries))
+
+        actual, (candidato,) = resultado['actual'], resultado['candidatos']
+        self.assertEqual(actual['ots_atrasadas'], 1)
+        self.assertEqual(actual['atrasadas'][0]['codigo_ot'], self.ots[1].codigo_ot)
+        self.assertGreater(actual['atraso_total_horas'], 0)
+        self.assertEqual((candidato['nombre'], candidato['ots_atrasadas'], candidato['atraso_total_horas']),
+                         ('Urgente primero', 0, 0))
+
+    def test_actual_coincide_con_el_programador(self, _):
+        resultado = WhatIfService().evaluar(self.escenario.programa, [{'orden': []}])
+        ordenes = [
+            _orden_trabajo(ot.id, k, [(self.escenario.maquinas['M1'].id, items[0].cantidad_pedido, items[0].estandar)])
+            for k, (ot, items) in enumerate(zip(self.ots, self.escenario.items), start=1)
+        ]
+        timeline = ProductionScheduler(TimeCalculator())._generate_base_timeline(
+            SimpleNamespace(id=None, fecha_inicio=LUNES.date()), ordenes
+        )
+        self.assertEqual(resultado['actual']['fecha_fin'], max(i['end_time'] for i in timeline['items'])[:16])
+        self.assertEqual(resultado['candidatos'][0]['nombre'], 'Candidato 1')
+
+    def test_pocas_operaciones_no_usan_el_pool(self, cpu_count):
+        cpu_count.return_value = 4
+        candidatos = [{'orden': [self.ots[1].id]}, {'orden': []}]
+        with patch('JobManagement.services.what_if._obtener_pool') as pool:
+            resultado = WhatIfService().evaluar(self.escenario.programa, candidatos)
+        pool.assert_not_called()
+        self.assertEqual(len(resultado['candidatos']), 2)
+
+        # Sobre el umbral se usa el pool; si está caído se evalúa en serie con el mismo resultado
+        pool.return_value.map.side_effect = BrokenProcessPool
+        with patch.object(WhatIfService, 'MIN_OPERACIONES_POOL', 1), \
+                patch('JobManagement.services.what_if._obtener_pool', pool), \
+                patch('JobManagement.services.what_if._descartar_pool') as descartar:
+            self.assertEqual(WhatIfService().evaluar(self.escenario.programa, candidatos), resultado)
+        pool.return_value.map.assert_called_once()
+        descartar.assert_called_once()
+
+    def test_candidatos_invalidos(self, _):
+        servicio = WhatIfService()
+        with self.assertRaises(ValueError):
+            servicio.evaluar(self.escenario.programa, [])
+        with self.assertRaises(ValueError):
+            servicio.evaluar(self.escenario.programa, [{'orden': [self.ots[0].id, self.ots[0].id]}])
+        with self.assertRaises(ValueError):
+            servicio.evaluar(self.escenario.programa, [{'cambios_maquina': {self.escenario.items[0][0].id: 0}}])
+
+
+class ProgramacionRapidaTests(SimpleTestCase):
+    """El núcleo del optimizador termina cada OT en el mismo instante que el programador completo"""
+
+    def _escenario(self, rnd, calendarios):
+        ordenes_trabajo = []
+        for ot_id in range(1, rnd.randint(2, 7)):
+            ordenes_trabajo.append({
+                'orden_trabajo': ot_id,
+                'orden_trabajo_codigo_ot': ot_id,
+                'orden_trabajo_descripcion_producto_ot': f'Producto {ot_id}',
+                'procesos': [
+                    {
+                        'id': ot_id * 100 + k, 'item': k, 'descripcion': 'Proceso',
+                        'maquina_id': rnd.choice(list(calendarios)),
+                        'cantidad': float(rnd.randint(1, 900)), 'estandar': float(rnd.choice([7, 35, 60, 130]))
+                    }
+                    for k in range(1, rnd.randint(1, 4) + 1)
+                ]
+            })
+        # Setups por secuencia entre dos procesos y dos familias, con comodines
+        filas = {
+            (rnd.choice([None, 1, 2, 3]), rnd.choice([None, 1, 2]), rnd.choice([None, 1, 2]),
+             rnd.choice([None, 10, 20]), rnd.choice([None, 10, 20])): rnd.randrange(0, 95, 5)
+            for _ in range(rnd.choice([0, 4, 12]))
+        }
+        claves = {
+            proceso['id']: (rnd.choice([1, 2]), rnd.choice([10, 20]))
+            for ot in ordenes_trabajo for proceso in ot['procesos']
+        }
+        return {
+            'fecha_inicio': LUNES + timedelta(minutes=rnd.randrange(0, 3 * 24 * 60, 15)),
+            'ordenes_trabajo': ordenes_trabajo,
+            'fechas_termino': {},
+            'calendarios': calendarios,
+            'lote_transferencia': rnd.choice([None, 5, 40]),
+            'preparaciones': MatrizPreparacion(filas, claves),
+            'agrupar_preparaciones': rnd.random() < 0.5
+        }
+
+    def test_igual_al_programador_en_escenarios_aleatorios(self):
+        rnd = random.Random(21)
+        general = TimeCalculator.get_calendar()
+        parcial = MachineCalendar(
+            date(2025, 3, 1), date(2025, 4, 30), time(7, 45), time(17, 45), TimeCalculator.FRIDAY_END,
+            TimeCalculator.BREAK_START, TimeCalculator.BREAK_END, feriados=set(),
+            dias={date(2025, 3, 4): None, date(2025, 3, 6): (time(10, 0), time(15, 0))},
+            bloqueos=[(LUNES + timedelta(hours=3), LUNES + timedelta(hours=5))]
+        )
+        calendarios = {1: general, 2: general, 3: parcial}
+
+        for _ in range(40):
+            escenario = self._escenario(rnd, calendarios)
+            nucleo = ProgramacionRapida(escenario)
+            orden = list(range(len(nucleo.ots)))
+            rnd.shuffle(orden)
+            fines = nucleo.programar(orden)
+
+            scheduler = ProductionScheduler(None)
+            _, cadenas = scheduler._construir_cadenas([escenario['ordenes_trabajo'][i] for i in orden])
+            scheduler._programar_operaciones(
+                cadenas, escenario['fecha_inicio'], calendarios=calendarios,
+                lotes=[escenario['lote_transferencia']] * len(cadenas),
+                preparaciones=escenario['preparaciones'],
+                agrupar_preparaciones=escenario['agrupar_preparaciones']
+            )
+            for i, cadena in zip(orden, cadenas):
+                self.assertEqual(escenario['fecha_inicio'] + timedelta(minutes=fines[i]), cadena[-1].fecha_fin)
+
+
+@patch('JobManagement.services.what_if.os.cpu_count', return_value=1)
+class PriorityOptimizerTests(TestCase):
+
+    def test_adelanta_la_ot_que_vence_y_no_empeora(self, _):
+        escenario = _crear_programa([[('M1', 600, 60)], [('M1', 300, 60)], [('M1', 60, 60)]])
+        urgente = escenario.items[2][0].ruta.orden_trabajo
+        OrdenTrabajo.objects.filter(id=urgente.id).update(fecha_termino=LUNES.date())
+
+        resultado = PriorityOptimizer().optimizar(escenario.programa, segundos=0.2, semilla=1)
+        self.assertGreater(resultado['actual']['ots_atrasadas'], 0)
+        self.assertEqual(resultado['propuesta']['ots_atrasadas'], 0)
+        self.assertLessEqual(resultado['propuesta']['costo'], resultado['actual']['costo'])
+        # La OT larga ya no va antes que la urgente
+        posiciones = {o['orden_trabajo']: o['prioridad'] for o in resultado['ordenes']}
+        self.assertLess(posiciones[urgente.id], posiciones[escenario.items[0][0].ruta.orden_trabajo_id])
+        self.assertEqual([o['prioridad'] for o in resultado['ordenes']], [1, 2, 3])
+
+
+class LoteTransferenciaTests(TestCase):
+    """Con lote de transferencia un proceso parte cuando el anterior entregó su primer lote"""
+
+    def test_desfases(self):
+        # 100 u a 60 u/h, luego 100 u a 30 u/h, lotes de 40 u: el primer lote sale a los 40 min
+        # y el último (20 u) se procesa en 40 min después del término del anterior
+        adelanto, cola = desfases_transferencia([100, 100], [60, 30], [True, False], [40, 40])
+        self.assertTrue(math.isnan(adelanto[0]) and math.isnan(cola[0]))
+        self.assertEqual((adelanto[1], cola[1]), (40, 40))
+        # Sin lote no hay traslape
+        adelanto, _ = desfases_transferencia([100, 100], [60, 30], [True, False], [0, 0])
+        self.assertTrue(math.isnan(adelanto[1]))
+
+    def _tramos(self, lote, estandar_siguiente):
+        ordenes = [_orden_trabajo(1, 1, [(1, 120, 60), (2, 120, estandar_siguiente)])]
+        timeline = ProductionScheduler(TimeCalculator())._generate_base_timeline(
+            SimpleNamespace(id=None, fecha_inicio=LUNES.date(), lote_transferencia=lote), ordenes
+        )
+        tramos = defaultdict(list)
+        for item in timeline['items']:
+            tramos[item['proceso_id']].append((item['start_time'][11:16], item['end_time'][11:16]))
+        return [(t[0][0], t[-1][1]) for _, t in sorted(tramos.items())]
+
+    def test_traslape_entre_procesos_consecutivos(self):
+        # Sin lote: término-inicio más setup
+        self.assertEqual(self._tramos(None, 60), [('07:45', '09:45'), ('10:15', '12:15')])
+        # Primer lote de 10 u a los 10 minutos, más setup
+        self.assertEqual(self._tramos(10, 60), [('07:45', '09:45'), ('08:25', '10:25')])
+        # Un proceso más rápido se posterga: termina 5 min (su último lote) después del anterior
+        self.assertEqual(self._tramos(10, 120), [('07:45', '09:45'), ('08:50', '09:50')])
+
+
+    def test_configuracion_invalida_no_guarda_nada(self):
+        cliente = APIClient()
+        cliente.force_authenticate(get_user_model().objects.create(username='jefe', rut='11.111.111-1'))
+        programa = _crear_programa([[('M1', 120, 60)]]).programa
+        url = reverse('program-detail', args=[programa.id])
+
+        for datos in ({'lote_transferencia': 10, 'maquinas_paralelas': -1},
+                      {'lote_transferencia': 10, 'maquinas_paralelas': 'dos'},
+                      {'lote_transferencia': 'diez'}):
+            respuesta = cliente.put(url, datos, format='json')
+            self.assertEqual(respuesta.status_code, 400)
+            programa.refresh_from_db()
+            self.assertIsNone(programa.lote_transferencia)
+
+        self.assertEqual(cliente.put(url, {'lote_transferencia': 10}, format='json').status_code, 200)
+        programa.refresh_from_db()
+        self.assertEqual(programa.lote_transferencia, 10)
+
+class DivisionEntreMaquinasTests(SimpleTestCase):
+    """Un proceso largo se reparte entre máquinas compatibles ociosas y sus piezas terminan juntas"""
+
+    def _programar(self, ordenes, alternativas, paralelas):
+        scheduler = ProductionScheduler(TimeCalculator())
+        _, cadenas = scheduler._construir_cadenas(ordenes)
+        scheduler._programar_operaciones(
+            cadenas, LUNES, calendarios={}, preparaciones=MatrizPreparacion({}),
+            maquinas_paralelas=[paralelas] * len(cadenas), alternativas=alternativas
+        )
+        return cadenas
+
+    def _termino(self, listo, cantidad, estandar):
+        if not cantidad:
+            return listo
+        return TimeCalculator().calculate_working_days(listo, cantidad, estandar)['next_available_time']
+
+    def test_piezas_terminan_juntas_y_ningun_traspaso_mejora(self):
+        rnd = random.Random(23)
+        for _ in range(8):
+            estandar = rnd.choice([40, 60, 90])
+            cantidad = estandar * rnd.randint(9, 20)
+            # M1 y M2 quedan ocupadas por otras OTs durante tiempos distintos; M3 está ociosa
+            ordenes = [
+                _orden_trabajo(1, 1, [(1, rnd.randrange(60, 300, 10), 60)]),
+                _orden_trabajo(2, 2, [(2, rnd.randrange(60, 300, 10), 60)]),
+                _orden_trabajo(3, 3, [(1, cantidad, estandar)]),
+            ]
+            nodo = self._programar(ordenes, {300: [(1, 'M1'), (2, 'M2'), (3, 'M3')]}, 3)[2][0]
+
+            self.assertGreater(len(nodo.piezas), 1)
+            cantidades = [p.proceso_data['cantidad'] for p in nodo.piezas]
+            self.assertEqual(sum(cantidades), cantidad)
+            self.assertEqual(nodo.fecha_fin, max(p.fecha_fin for p in nodo.piezas))
+            self.assertLess(nodo.fecha_fin, self._termino(nodo.piezas[0].fecha_inicio, cantidad, estandar))
+
+            # Pasar una unidad de la pieza que termina última a cualquier otra no adelanta el término
+            ultima = max(range(len(nodo.piezas)), key=lambda k: nodo.piezas[k].fecha_fin)
+            for otra in range(len(nodo.piezas)):
+                if otra == ultima:
+                    continue
+                traspaso = list(cantidades)
+                traspaso[ultima] -= 1
+                traspaso[otra] += 1
+                fin = max(
+                    self._termino(pieza.fecha_inicio, q, estandar) for pieza, q in zip(nodo.piezas, traspaso)
+                )
+                self.assertGreaterEqual(fin + timedelta(minutes=2), nodo.fecha_fin)
+
+    def test_no_divide_procesos_cortos_ni_sin_paralelas(self):
+        alternativas = {100: [(1, 'M1'), (2, 'M2')]}
+        corto = self._programar([_orden_trabajo(1, 1, [(1, 420, 60)])], alternativas, 2)[0][0]
+        self.assertEqual(corto.piezas, [])
+        largo = self._programar([_orden_trabajo(1, 1, [(1, 1200, 60)])], alternativas, 1)[0][0]
+        self.assertEqual(largo.piezas, [])
+        self.assertEqual(len(self._programar([_orden_trabajo(1, 1, [(1, 1200, 60)])], alternativas, 2)[0][0].piezas), 2)
+
+
+class MaquinasAlternativasTests(TestCase):
+
+    def test_solo_maquinas_operativas_de_tipos_compatibles(self):
+        escenario = _crear_programa([[('M1', 1200, 60)]])
+        m1 = escenario.maquinas['M1']
+        item = escenario.items[0][0]
+        corte = TipoMaquina.objects.create(codigo='COR', descripcion='Corte')
+        prensa = TipoMaquina.objects.create(codigo='PRE', descripcion='Prensa')
+        item.proceso.tipos_maquina_compatibles.add(corte)
+        operativa = EstadoOperatividad.objects.create(estado='OP', descripcion='Operativa')
+        en_mantencion = EstadoOperatividad.objects.create(estado='MN', descripcion='En mantención')
+
+        maquinas = {}
+        for codigo, tipo, estado in (
+            ('M1', corte, operativa), ('M2', corte, operativa), ('M3', corte, en_mantencion), ('M4', prensa, operativa)
+        ):
+            maquinas[codigo] = m1 if codigo == 'M1' else Maquina.objects.create(
+                codigo_maquina=codigo, descripcion=f'Máquina {codigo}', empresa=m1.empresa
+            )
+            EstadoMaquina.objects.create(maquina=maquinas[codigo], estado_operatividad=estado).tipos_maquina.add(tipo)
+
+        with self.assertNumQueries(3):
+            alternativas = ProductionScheduler.maquinas_alternativas([item.id])
+        self.assertEqual(alternativas, {item.id: [(m1.id, 'Máquina M1'), (maquinas['M2'].id, 'Máquina M2')]})
+
+
+class MatrizCompatibilidadTests(TestCase):
+
+    def test_igual_a_consultar_proceso_por_proceso(self):
+        rnd = random.Random(24)
+        escenario = _crear_programa([[(f'M{k}', 10, 10) for k in range(1, 7)]])
+        empresa = escenario.programa.programaordentrabajo_set.get().orden_trabajo.empresa
+        tipos = [TipoMaquina.objects.create(codigo=f'T{k}', descripcion=f'Tipo {k}') for k in range(4)]
+        estados = [EstadoOperatividad.objects.create(estado=e, descripcion=e) for e in ('OP', 'MN', 'IN')]
+        for maquina in escenario.maquinas.values():
+            estado = EstadoMaquina.objects.create(
+                maquina=maquina, estado_operatividad=rnd.choice(estados[:1] * 3 + estados[1:])
+            )
+            estado.tipos_maquina.add(*rnd.sample(tipos, rnd.randint(0, 2)))
+        procesos = [
+            Proceso.objects.create(codigo_proceso=f'X{k}', descripcion=f'Proceso {k}', empresa=empresa)
+            for k in range(5)
+        ]
+        for proceso in procesos:
+            proceso.tipos_maquina_compatibles.add(*rnd.sample(tipos, rnd.randint(0, 3)))
+
+        with self.assertNumQueries(2):
+            matriz = MatrizCompatibilidad.cargar([p.id for p in procesos])
+        for proceso in procesos:
+            esperadas = sorted(proceso.get_maquinas_compatibles().values_list('id', flat=True))
+            self.assertEqual(matriz.maquinas(proceso.id), esperadas)
+            for maquina in escenario.maquinas.values():
+                self.assertEqual(matriz.es_compatible(proceso.id, maquina.id), maquina.id in esperadas)
+        self.assertEqual(matriz.maquinas(-1), [])
+
+
+class RebalanceoMaquinasTests(TestCase):
+    """El rebalanceo propone mover operaciones de la máquina sobrecargada a una compatible"""
+
+    def setUp(self):
+        self.escenario = _crear_programa([[('M1', 1800, 60)], [('M1', 1800, 60)], [('M3', 90, 10)]])
+        m1 = self.escenario.maquinas['M1']
+        self.m2 = Maquina.objects.create(codigo_maquina='M2', descripcion='Máquina M2', empresa=m1.empresa)
+        tipo = TipoMaquina.objects.create(codigo='COR', descripcion='Corte')
+        operativa = EstadoOperatividad.objects.create(estado='OP', descripcion='Operativa')
+        for maquina in (m1, self.m2):
+            EstadoMaquina.objects.create(maquina=maquina, estado_operatividad=operativa).tipos_maquina.add(tipo)
+        self.escenario.items[0][0].proceso.tipos_maquina_compatibles.add(tipo)
+
+    def test_propone_el_movimiento_con_su_ganancia(self):
+        resultado = MachineRebalanceService().proponer(self.escenario.programa)
+
+        (movimiento,) = resultado['movimientos']
+        self.assertEqual(movimiento['maquina_destino']['id'], self.m2.id)
+        self.assertIn(movimiento['item_ruta'], {self.escenario.items[0][0].id, self.escenario.items[1][0].id})
+        self.assertEqual((movimiento['horas_origen'], movimiento['horas_destino']), (30, 30))
+        self.assertGreater(movimiento['ganancia_dias'], 0)
+        self.assertAlmostEqual(
+            movimiento['makespan_dias'], resultado['makespan_inicial_dias'] - movimiento['ganancia_dias'], places=1
+        )
+        self.assertEqual(resultado['makespan_final_dias'], movimiento['makespan_dias'])
+        self.assertEqual(
+            movimiento['cambio'], {'id': movimiento['item_ruta'], 'maquina_id': self.m2.id, 'estandar': 60}
+        )
+        # Sin nada que ganar no se propone más
+        self.assertEqual(len(MachineRebalanceService().proponer(self.escenario.programa, 5)['movimientos']), 1)
+
+    def test_endpoint(self):
+        cliente = APIClient()
+        cliente.force_authenticate(get_user_model().objects.create_user(
+            username='planificador', password='x', rut='11.111.111-1'
+        ))
+        url = reverse('rebalanceo-maquinas', args=[self.escenario.programa.id])
+        self.assertEqual(cliente.get(url).status_code, 200)
+        self.assertEqual(cliente.get(url, {'max_movimientos': '0'}).status_code, 400)
+        self.assertEqual(cliente.get(reverse('rebalanceo-maquinas', args=[0])).status_code, 404)
+
+
+class MatrizPreparacionTests(SimpleTestCase):
+    """La fila más específica decide el setup; secuenciar agrupa los cambios cortos"""
+
+    def test_fila_mas_especifica(self):
+        # Claves (proceso, familia)
+        matriz = MatrizPreparacion({
+            (None, None, None, None, None): 20,        # general
+            (1, None, None, None, None): 40,           # defecto de la máquina 1
+            (1, None, None, 'A', 'A'): 5,              # misma familia en la máquina 1
+            (None, 'P', 'Q', None, None): 60,          # de P a Q en cualquier máquina
+            (1, None, 'Q', None, None): 50,            # hacia Q en la máquina 1
+        }, minutos_defecto=30)
+
+        self.assertEqual(matriz.minutos(1, None, ('P', 'A')), 30)
+        self.assertEqual(matriz.minutos(1, ('P', 'A'), ('P', 'A')), 5)
+        self.assertEqual(matriz.minutos(1, ('P', 'A'), ('Q', 'B')), 50)
+        self.assertEqual(matriz.minutos(1, ('R', 'A'), ('P', 'B')), 40)
+        self.assertEqual(matriz.minutos(2, ('P', 'A'), ('Q', 'B')), 60)
+        self.assertEqual(matriz.minutos(2, ('P', 'A'), ('P', 'A')), 20)
+        self.assertEqual(MatrizPreparacion({}, minutos_defecto=30).minutos(1, ('P', 'A'), ('Q', 'B')), 30)
+
+    def test_secuenciar_agrupa_familias_dentro_de_la_ventana(self):
+        matriz = MatrizPreparacion({(None, None, None, 'A', 'A'): 0, (None, None, None, 'B', 'B'): 0})
+        familias = ['A', 'B', 'A', 'B', 'A', 'B']
+        trabajos = [[(1, ('P', familia))] for familia in familias]
+
+        self.assertEqual(secuenciar(range(6), trabajos, matriz, 4), [0, 2, 4, 1, 3, 5])
+        # La primera pendiente no se posterga más de ventana - 1 veces
+        self.assertEqual(secuenciar(range(6), trabajos, matriz, 2), [0, 2, 1, 3, 5, 4])
+        self.assertEqual(secuenciar(range(6), trabajos, MatrizPreparacion({}), 4), list(range(6)))
+
+
+class TiemposPreparacionTests(TestCase):
+    """El programador usa el setup según la operación anterior en cada máquina"""
+
+    def setUp(self):
+        self.escenario = _crear_programa([[('M1', 120, 60)], [('M1', 120, 60)]])
+        self.familias = {
+            codigo: FamiliaProducto.objects.create(codigo_familia=codigo, descripcion=f'Familia {codigo}')
+            for codigo in ('10', '20')
+        }
+        Producto.objects.bulk_create([Producto(
+            codigo_producto='10AB', descripcion='Producto', peso_unitario=1, familia_producto=self.familias['10']
+        )])
+        # La primera OT es de un producto registrado; la segunda toma la familia del prefijo del código
+        for items, codigo in zip(self.escenario.items, ('10AB', '20ZZ')):
+            OrdenTrabajo.objects.filter(id=items[0].ruta.orden_trabajo_id).update(codigo_producto_salida=codigo)
+
+    def _inicios(self):
+        timeline = ProductionScheduler(TimeCalculator())._generate_base_timeline(
+            SimpleNamespace(id=None, fecha_inicio=LUNES.date()),
+            ProgramDetailView().get_ordenes_trabajo(self.escenario.programa)
+        )
+        return sorted({item['start_time'][11:16] for item in timeline['items']})
+
+    def test_claves_por_proceso_y_familia(self):
+        items = [items[0] for items in self.escenario.items]
+        self.assertEqual(
+            MatrizPreparacion.claves_items([item.id for item in items]),
+            {
+                items[0].id: (items[0].proceso_id, self.familias['10'].id),
+                items[1].id: (items[1].proceso_id, self.familias['20'].id)
+            }
+        )
+
+    def test_setup_por_cambio_de_familia(self):
+        self.assertEqual(self._inicios(), ['07:45', '10:15'])
+
+        TiempoPreparacion.objects.create(
+            maquina=self.escenario.maquinas['M1'],
+            familia_anterior=self.familias['10'], familia_siguiente=self.familias['20'], minutos=90
+        )
+        self.assertEqual(self._inicios(), ['07:45', '11:15'])
+
+    def test_comodines_repetidos_se_rechazan(self):
+        datos = {'familia_anterior': self.familias['10'], 'familia_siguiente': self.familias['20'], 'minutos': 90}
+        TiempoPreparacion.objects.create(**datos)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TiempoPreparacion.objects.create(**datos)
+        # La misma regla para una máquina concreta no es un duplicado
+        TiempoPreparacion.objects.create(maquina=self.escenario.maquinas['M1'], **datos)
@@ -21,6 +21,7 @@ urlpatterns = [
     #Programa
     path('api/v1/programas/crear_programa/', program_views.ProgramCreateView.as_view(), name='crear_programa'),
     path('api/v1/programas/', program_views.ProgramListView.as_view(), name='programas-list'),
+    path('api/v1/programas/programacion-global/', program_views.ProgramacionGlobalView.as_view(), name='programacion-global'),
     path('api/v1/programas/<int:pk>/', program_views.ProgramDetailView.as_view(), name='get-program'),
     path('api/v1/programas/<int:pk>/update-prio/', program_views.ProgramDetailView.as_view(), name='program-detail'),
     #path('api/v1/programas/<int:pk>/delete-orders/', program_views.UpdatePriorityView.as_view(), name='delete_orders'),
@@ -28,11 +29,15 @@ urlpatterns = [
     path('api/v1/programas/<int:pk>/generar_pdf/', program_views.GenerateProgramPDF.as_view(), name='generar_pdf'),
     path('api/v1/programas/<int:pk>/check-status/', program_views.ProgramDetailView.as_view(), name='check_status'),
     path('api/v1/programas/<int:pk>/add-orders/', program_views.AddOrdersToProgram.as_view(), name='add-orders-to-program'),
+    path('api/v1/programas/<int:pk>/what-if/', program_views.WhatIfProgramaView.as_view(), name='what-if-programa'),
+    path('api/v1/programas/<int:pk>/optimizar-prioridades/', program_views.OptimizarPrioridadesView.as_view(), name='optimizar-prioridades'),
     path('api/v1/programas/<int:pk>/reajustar/', program_views.ReajustarProgramaView.as_view(), name='reajustar-programa'),
 
     #Maquinas
     path('api/v1/programas/<int:pk>/maquinas/', machine_views.MaquinasView.as_view(), name='maquinas-list'),
+    path('api/v1/programas/<int:pk>/rebalanceo-maquinas/', machine_views.RebalanceoMaquinasView.as_view(), name='rebalanceo-maquinas'),
     path('api/v1/maquinas/', machine_views.MaquinaListView.as_view(), name='maquinas-get-list'),
+    path('api/v1/maquinas/carga/', machine_views.CargaMaquinasView.as_view(), name='maquinas-carga'),
     path('api/v1/empresas/', program_views.EmpresaListView.as_view(), name='empresas-get-list'),
 
     #Reporte
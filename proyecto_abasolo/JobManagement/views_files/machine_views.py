@@ -1,3 +1,5 @@
+import logging
+from datetime import datetime, timedelta
 from django.db.models import Q
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -6,6 +8,11 @@ from rest_framework.permissions import IsAuthenticated
 
 from ..models import Maquina, Proceso, ProgramaProduccion
 from ..serializers import MaquinaSerializer
+from ..services.machine_load import MachineLoadService
+from ..services.machine_rebalance import MachineRebalanceService
+
+logger = logging.getLogger(__name__)
+
 
 class MaquinasView(APIView):
     def get(self, request, pk=None):
@@ -51,4 +58,84 @@ class MaquinaListView(APIView):
     def get(self, request):
         maquinas = Maquina.objects.all()
         serializer = MaquinaSerializer(maquinas, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class CargaMaquinasView(APIView):
+    """Mapa de calor de horas reservadas vs. disponibles de todas las máquinas en un horizonte"""
+    permission_classes = [IsAuthenticated]
+
+    HORIZONTE_DIAS = 27  # 4 semanas por defecto
+
+    def get(self, request):
+        try:
+            hoy = datetime.now().date()
+            fecha_inicio = request.query_params.get('fecha_inicio')
+            fecha_fin = request.query_params.get('fecha_fin')
+            fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else hoy
+            fecha_fin = (
+                datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin
+                else fecha_inicio + timedelta(days=self.HORIZONTE_DIAS)
+            )
+            granularidad = request.query_params.get('granularidad', 'dia')
+            maquinas = request.query_params.get('maquinas')
+            maquina_ids = [int(m) for m in maquinas.split(',') if m] if maquinas else None
+        except ValueError:
+            return Response(
+                {'error': 'Parámetros inválidos. Use fechas YYYY-MM-DD y maquinas=1,2,3'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if (fecha_fin - fecha_inicio).days > 366:
+            return Response(
+                {'error': 'El horizonte no puede superar un año'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            return Response(
+                MachineLoadService().mapa_calor(fecha_inicio, fecha_fin, granularidad, maquina_ids),
+                status=status.HTTP_200_OK
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("Error en CargaMaquinasView")
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class RebalanceoMaquinasView(APIView):
+    """Movimientos propuestos de operaciones del programa a máquinas compatibles con menos carga"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            programa = ProgramaProduccion.objects.get(pk=pk)
+        except ProgramaProduccion.DoesNotExist:
+            return Response({'error': 'Programa no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            max_movimientos = request.query_params.get('max_movimientos')
+            max_movimientos = int(max_movimientos) if max_movimientos else None
+            if max_movimientos is not None and max_movimientos < 1:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {'error': 'max_movimientos debe ser un entero positivo'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            return Response(
+                MachineRebalanceService().proponer(programa, max_movimientos),
+                status=status.HTTP_200_OK
+            )
+        except Exception as e:
+            logger.exception("Error en RebalanceoMaquinasView")
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
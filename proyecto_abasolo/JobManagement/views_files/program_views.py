@@ -11,6 +11,7 @@ from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status, generics
+from rest_framework.utils.encoders import JSONEncoder
 
 from ..models import (
     ProgramaProduccion, 
@@ -20,13 +21,16 @@ from ..models import (
     ItemRuta,
     TareaFragmentada,
     EmpresaOT,
-    ReporteDiarioPrograma
+    ReporteDiarioPrograma,
+    SnapshotProgramacion
 )
 from Operator.models import AsignacionOperador
 from ..serializers import ProgramaProduccionSerializer, EmpresaOTSerializer
 from ..services.time_calculations import TimeCalculator
 from ..services.production_scheduler import ProductionScheduler
 from ..services.machine_availability import MachineAvailabilityService
+from ..services.what_if import WhatIfService
+from ..services.priority_optimizer import PriorityOptimizer
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, landscape, A3, A2, A1
@@ -34,7 +38,9 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
-import traceback, logging, os
+import traceback, logging, os, json
+
+logger = logging.getLogger(__name__)
 
 
 class ProgramListView(generics.ListAPIView):
@@ -288,49 +294,39 @@ class ProgramDetailView(APIView):
             programa = ProgramaProduccion.objects.get(id=pk)
             print(f"[Backend] Programa encontrado: {programa.nombre}")
 
-            try:
-                #Usar el production_scheduler para calcular la fecha fin
-                print(f"[Backend] Calculando fecha fin para programa {pk}")
-                fecha_fin = self.production_scheduler.calculate_program_end_date(programa)
-                print(f"[Backend] Fecha fin calculada: {fecha_fin}")
-                
-                if fecha_fin != programa.fecha_fin:
-                    programa.fecha_fin = fecha_fin
-                    programa.save(update_fields=['fecha_fin'])
-                    programa.refresh_from_db()
-            except Exception as e:
-                print(f"[Backend] Error calculando fecha fin: {str(e)}")
-                # No dejar que este error detenga toda la vista
-                fecha_fin = programa.fecha_inicio
+            # Modo con operadores: cada proceso espera a un operador habilitado libre (no se guarda)
+            considerar_operadores = request.query_params.get('considerar_operadores', '').lower() in ('1', 'true')
+
+            # Servir la programación guardada; solo se recalcula si fue invalidada
+            snapshot = None if considerar_operadores else SnapshotProgramacion.obtener_ultima(programa)
+            desactualizada = False
+            if snapshot and snapshot.vigente:
+                logger.info("Programa %s: usando programación guardada v%s", pk, snapshot.version)
+                ordenes_trabajo = snapshot.datos['ordenes_trabajo']
+                routes_data = snapshot.datos['routes_data']
+            elif snapshot and snapshot.datos.get('programacion_global'):
+                # Recalcular la programación global toca todos los programas activos: no se hace en
+                # una lectura. Se sirve la última versión marcada como desactualizada hasta que se
+                # vuelva a ejecutar (ProgramacionGlobalView o el comando programar_global)
+                logger.info("Programa %s: programación global v%s desactualizada", pk, snapshot.version)
+                ordenes_trabajo = snapshot.datos['ordenes_trabajo']
+                routes_data = snapshot.datos['routes_data']
+                desactualizada = True
+            else:
+                ordenes_trabajo, routes_data = self.generar_programacion(programa, considerar_operadores)
 
             print(f"[Backend] Serializando programa {pk}")
             serializer = ProgramaProduccionSerializer(programa)
-            
-            print(f"[Backend] Obteniendo asignaciones para programa {pk}")
-            asignaciones_por_item = self.get_procesos_con_asignaciones(pk)
-            
-            print(f"[Backend] Obteniendo órdenes de trabajo para programa {pk}")
-            ordenes_trabajo = self.get_ordenes_trabajo(programa)
-
-            for ot in ordenes_trabajo:
-                for proceso in ot['procesos']:
-                    if proceso['id'] in asignaciones_por_item:
-                        proceso['asignacion'] = asignaciones_por_item[proceso['id']]
-
-            try:
-                print(f"[Backend] Generando timeline para programa {pk}")
-                routes_data = self.production_scheduler.generate_timeline_data(programa, ordenes_trabajo)
-                print(f"[Backend] Timeline generado exitosamente")
-            except Exception as e:
-                print(f"[Backend] Error generando timeline: {str(e)}")
-                # No dejar que este error detenga toda la vista
-                routes_data = {"groups": [], "items": []}
 
             response_data = {
                 "program": serializer.data,
                 "ordenes_trabajo": ordenes_trabajo,
                 "routes_data": routes_data
             }
+            if considerar_operadores:
+                response_data["operadores"] = self.production_scheduler.resumen_operadores
+            if desactualizada:
+                response_data["programacion_desactualizada"] = True
 
             print(f"[Backend] Enviando respuesta para programa {pk}")
             return Response(response_data, status=status.HTTP_200_OK)
@@ -349,6 +345,106 @@ class ProgramDetailView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
+    def generar_programacion(self, programa, considerar_operadores=False):
+        """
+        Calcula fecha fin, OTs y timeline del programa y los guarda como nueva versión.
+        La programación con operadores es una simulación y no se guarda.
+        """
+        pk = programa.id
+        snapshot = None if considerar_operadores else SnapshotProgramacion.reservar_version(programa)
+        self.production_scheduler.considerar_operadores = considerar_operadores
+
+        ordenes_trabajo = self.get_ordenes_con_asignaciones(programa)
+
+        try:
+            # Una sola programación entrega el timeline y la fecha de término
+            logger.info("Generando timeline para programa %s", pk)
+            routes_data, fecha_fin = self.production_scheduler.generate_timeline_with_end_date(
+                programa, ordenes_trabajo
+            )
+            if fecha_fin != programa.fecha_fin:
+                programa.fecha_fin = fecha_fin
+                programa.save(update_fields=['fecha_fin'])
+                programa.refresh_from_db()
+        except Exception:
+            logger.exception("Error generando timeline para programa %s", pk)
+            # No dejar que este error detenga toda la vista
+            routes_data = {"groups": [], "items": []}
+
+        # Guardar en formato JSON tal como se envía en la respuesta
+        datos = json.loads(json.dumps(
+            {'ordenes_trabajo': ordenes_trabajo, 'routes_data': routes_data},
+            cls=JSONEncoder
+        ))
+        if snapshot and snapshot.completar(datos, programa.fecha_fin):
+            logger.info("Programa %s: programación guardada como v%s", pk, snapshot.version)
+
+        return datos['ordenes_trabajo'], datos['routes_data']
+
+    def get_ordenes_con_asignaciones(self, programa):
+        """Órdenes de trabajo del programa con la asignación de operador de cada proceso"""
+        print(f"[Backend] Obteniendo asignaciones para programa {programa.id}")
+        asignaciones_por_item = self.get_procesos_con_asignaciones(programa.id)
+
+        print(f"[Backend] Obteniendo órdenes de trabajo para programa {programa.id}")
+        ordenes_trabajo = self.get_ordenes_trabajo(programa)
+
+        for ot in ordenes_trabajo:
+            for proceso in ot['procesos']:
+                if proceso['id'] in asignaciones_por_item:
+                    proceso['asignacion'] = asignaciones_por_item[proceso['id']]
+        return ordenes_trabajo
+
+    @staticmethod
+    def programas_activos():
+        """Programas que aún no terminan, en orden de precedencia (inicio más temprano primero)"""
+        return list(ProgramaProduccion.objects.filter(
+            fecha_fin__gte=timezone.localdate()
+        ).order_by('fecha_inicio', 'id'))
+
+    def generar_programacion_global(self, programas=None):
+        """
+        Programa juntos los programas indicados (por defecto los activos) sobre una línea de
+        tiempo compartida por máquina, y guarda la parte de cada uno como nueva versión.
+        Retorna {programa_id: (ordenes_trabajo, routes_data)}.
+        """
+        programas = sorted(
+            programas if programas is not None else self.programas_activos(),
+            key=lambda p: (p.fecha_inicio, p.id)
+        )
+        if not programas:
+            return {}
+        logger.info("Programación global de %s programas", len(programas))
+
+        snapshots = {programa.id: SnapshotProgramacion.reservar_version(programa) for programa in programas}
+        ordenes_por_programa = {programa.id: self.get_ordenes_con_asignaciones(programa) for programa in programas}
+        self.production_scheduler.considerar_operadores = False
+        timelines = self.production_scheduler.generate_global_timelines(
+            [(programa, ordenes_por_programa[programa.id]) for programa in programas]
+        )
+
+        resultado = {}
+        for programa in programas:
+            routes_data, fecha_fin = timelines[programa.id]
+            if fecha_fin != programa.fecha_fin:
+                programa.fecha_fin = fecha_fin
+                programa.save(update_fields=['fecha_fin'])
+
+            datos = json.loads(json.dumps(
+                {
+                    'ordenes_trabajo': ordenes_por_programa[programa.id],
+                    'routes_data': routes_data,
+                    'programacion_global': True
+                },
+                cls=JSONEncoder
+            ))
+            snapshot = snapshots[programa.id]
+            if snapshot.completar(datos, programa.fecha_fin):
+                logger.info("Programación global guardada para programa %s como v%s", programa.id, snapshot.version)
+            resultado[programa.id] = (datos['ordenes_trabajo'], datos['routes_data'])
+
+        return resultado
+
     def get_ordenes_trabajo(self, programa):
         """Obtiene las órdenes de trabajo del programa dado."""
         try:
@@ -430,13 +526,62 @@ class ProgramDetailView(APIView):
             print(f"Error formateando orden de trabajo {orden_trabajo.id}: {str(e)}")
             return None
         
+    def _validar_configuracion(self, data):
+        """
+        Valida los campos de configuración de la programación presentes en los datos y retorna
+        {campo: valor}. Lanza ValueError con el mensaje para el usuario si alguno es inválido.
+        """
+        configuracion = {}
+
+        # Lote de transferencia para traslapar procesos consecutivos (vacío o 0 = sin traslape)
+        if 'lote_transferencia' in data:
+            lote = data.get('lote_transferencia')
+            try:
+                lote = int(lote) if lote not in (None, '', 0, '0') else None
+            except (TypeError, ValueError):
+                raise ValueError('lote_transferencia debe ser un entero positivo')
+            if lote is not None and lote < 0:
+                raise ValueError('lote_transferencia debe ser un entero positivo')
+            configuracion['lote_transferencia'] = lote
+
+        # Máximo de máquinas compatibles entre las que se puede dividir un proceso
+        if 'maquinas_paralelas' in data:
+            try:
+                paralelas = int(data.get('maquinas_paralelas') or 1)
+            except (TypeError, ValueError):
+                raise ValueError('maquinas_paralelas debe ser un entero mayor o igual a 1')
+            if paralelas < 1:
+                raise ValueError('maquinas_paralelas debe ser un entero mayor o igual a 1')
+            configuracion['maquinas_paralelas'] = paralelas
+
+        # Reordenar OTs para reducir los tiempos de preparación
+        if 'agrupar_preparaciones' in data:
+            agrupar = data.get('agrupar_preparaciones')
+            if not isinstance(agrupar, bool):
+                raise ValueError('agrupar_preparaciones debe ser true o false')
+            configuracion['agrupar_preparaciones'] = agrupar
+
+        return configuracion
+
     def put(self, request, pk):
         try:
             programa = get_object_or_404(ProgramaProduccion, id=pk)
             print(f"Actualizando programa {pk}")
             print(f"Datos recibidos: {request.data}")
 
+            # Validar la configuración antes de guardar nada: un campo inválido no deja otros a medias
+            try:
+                configuracion = self._validar_configuracion(request.data)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
             with transaction.atomic():
+                if configuracion:
+                    for campo, valor in configuracion.items():
+                        setattr(programa, campo, valor)
+                    programa.save(update_fields=list(configuracion))
+                    logger.info("Programa %s: configuración actualizada %s", pk, configuracion)
+
                 # Manejar tanto el formato 'ordenes' como 'order_ids'
                 ordenes_data = request.data.get('ordenes', request.data.get('order_ids', []))
                 
@@ -501,16 +646,19 @@ class ProgramDetailView(APIView):
                         print(f"Error procesando orden {orden_id}: {str(e)}")
                         raise
 
-                # Recalcular fechas si se solicita
+                # Recalcular fechas si se solicita (solo se reprograman las OTs afectadas por el cambio)
+                cambios = None
                 if request.data.get('recalculate_dates', True):
                     fecha_fin = self.production_scheduler.calculate_program_end_date(programa)
+                    cambios = self.production_scheduler.ultimo_delta
                     programa.fecha_fin = fecha_fin
                     programa.save()
                     print(f"Fecha fin actualizada a: {fecha_fin}")
 
                 return Response({
                     "message": "Programa actualizado correctamente",
-                    "fecha_fin": programa.fecha_fin
+                    "fecha_fin": programa.fecha_fin,
+                    "cambios": cambios
                 }, status=status.HTTP_200_OK)
 
         except Exception as e:
@@ -625,13 +773,110 @@ class ProgramDetailView(APIView):
         return acciones_tomadas
 
 
+class ProgramacionGlobalView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Programa juntos todos los programas activos (o los indicados en "programa_ids") sobre una
+        línea de tiempo compartida por máquina. Cada programa guarda su parte como nueva versión.
+        """
+        try:
+            programa_ids = request.data.get('programa_ids')
+            if programa_ids:
+                programas = list(ProgramaProduccion.objects.filter(id__in=programa_ids))
+                if len(programas) != len(set(programa_ids)):
+                    return Response(
+                        {'error': 'Uno o más programas no existen'},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+            else:
+                programas = None
+
+            detalle = ProgramDetailView()
+            resultado = detalle.generar_programacion_global(programas)
+            programas = ProgramaProduccion.objects.filter(id__in=resultado).order_by('fecha_inicio', 'id')
+            return Response({
+                'programas': [
+                    {
+                        'id': programa.id,
+                        'nombre': programa.nombre,
+                        'fecha_inicio': programa.fecha_inicio,
+                        'fecha_fin': programa.fecha_fin,
+                        'procesos': len({item['proceso_id'] for item in resultado[programa.id][1]['items']})
+                    }
+                    for programa in programas
+                ]
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Error en programación global")
+            return Response(
+                {'error': f'Error interno del servidor: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class WhatIfProgramaView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        """
+        Evalúa sin guardar órdenes de prioridad y cambios de máquina alternativos del programa.
+        Body: {"candidatos": [{"nombre": ..., "orden": [ot_id, ...], "cambios_maquina": {item_ruta_id: maquina_id}}]}
+        """
+        programa = get_object_or_404(ProgramaProduccion, id=pk)
+        try:
+            resultado = WhatIfService().evaluar(programa, request.data.get('candidatos'))
+            return Response(resultado, status=status.HTTP_200_OK)
+
+        except (ValueError, TypeError, AttributeError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("Error evaluando alternativas del programa %s", pk)
+            return Response(
+                {'error': f'Error interno del servidor: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class OptimizarPrioridadesView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        """
+        Busca el orden de OTs que minimiza atrasos (con recargo por multa y cliente VIP) y makespan.
+        Body opcional: {"segundos": 5, "pesos": {"atraso", "multa", "vip", "makespan"}, "semilla": n}.
+        La respuesta trae la propuesta en "ordenes", en el formato de update-prio, sin aplicarla.
+        """
+        programa = get_object_or_404(ProgramaProduccion, id=pk)
+        try:
+            pesos = request.data.get('pesos') or {}
+            if not isinstance(pesos, dict):
+                raise ValueError('pesos debe ser un objeto')
+            resultado = PriorityOptimizer(pesos).optimizar(
+                programa,
+                segundos=request.data.get('segundos'),
+                semilla=request.data.get('semilla')
+            )
+            return Response(resultado, status=status.HTTP_200_OK)
+
+        except (ValueError, TypeError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("Error optimizando prioridades del programa %s", pk)
+            return Response(
+                {'error': f'Error interno del servidor: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class EmpresaListView(APIView):
     def get(self, request):
         empresas = EmpresaOT.objects.all()
         serializer = EmpresaOTSerializer(empresas, many=True)
         return Response(serializer.data)
     
-logger = logging.getLogger(__name__)
 class GenerateProgramPDF(APIView):
     def __init__(self):
         super().__init__()
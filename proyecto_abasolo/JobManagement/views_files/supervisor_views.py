@@ -42,8 +42,8 @@ class SupervisorReportView(APIView):
                     fecha_solicitada = primera_tarea.fecha.strftime('%Y-%m-%d')
                 else:
                     fecha_inicio = programa.fecha_inicio
-                    while fecha_inicio.weekday() >= 5:  # 5=Sábado, 6=Domingo
-                        fecha_inicio += timedelta(days=1)
+                    if not TimeCalculator.is_working_day(fecha_inicio):
+                        fecha_inicio = TimeCalculator.get_next_working_day(fecha_inicio)
                     fecha_solicitada = fecha_inicio.strftime('%Y-%m-%d')
             
             # Convertir a datetime para mantener consistencia
@@ -52,8 +52,8 @@ class SupervisorReportView(APIView):
             print(f"Fecha parseada (objeto): {fecha}")
             print(f"Fecha.date() usada en filtro: {fecha.date()}")
             
-            # Verificar si es día laboral (Lunes-Viernes)
-            es_dia_laboral = fecha.weekday() < 5
+            # Verificar si es día laboral (Lunes-Viernes, sin feriados)
+            es_dia_laboral = TimeCalculator.is_working_day(fecha.date())
             
             # Verificar si hay tareas para esta fecha específica
             count_tareas = TareaFragmentada.objects.filter(
@@ -615,11 +615,8 @@ class FinalizarDiaView(APIView):
             )
 
     def obtener_siguiente_dia_laboral(self, fecha):
-        """Obtiene el siguiente día laboral (excluye fines de semana)"""
-        siguiente_dia = fecha + timedelta(days=1)
-        while siguiente_dia.weekday() >= 5:  # 5 = Sábado, 6 = Domingo
-            siguiente_dia += timedelta(days=1)
-        return siguiente_dia
+        """Obtiene el siguiente día laboral (excluye fines de semana y feriados)"""
+        return TimeCalculator.get_next_working_day(fecha)
 
 
 @api_view(['POST'])
@@ -77,11 +77,11 @@ class DisponibilidadMaquina(models.Model):
     
     def get_horas_efectivas(self):
         """Obtiene las horas efectivas considerando el horario normal o override"""
-        inicio = self.hora_inicio or self.maquina.estado.hora_inicio_normal
-        fin = self.hora_fin or self.maquina.estado.hora_fin_normal
-        
         if not self.disponible:
             return 0
+
+        inicio = self.hora_inicio or self.maquina.estadomaquina.hora_inicio_normal
+        fin = self.hora_fin or self.maquina.estadomaquina.hora_fin_normal
             
         delta = datetime.combine(date.min, fin) - datetime.combine(date.min, inicio)
         return delta.total_seconds() / 3600
@@ -89,154 +89,124 @@ class AsignacionOperador(models.Model):
         except Exception as e:
             raise ValidationError(f'Error de validación: {str(e)}')
 
+    @staticmethod
+    def indice_ocupacion(operador_id, maquina_id, desde, excluir_id=None):
+        """
+        Índice en memoria de las asignaciones del operador y de la máquina que terminan después
+        de 'desde' (una sola consulta). Sirve para buscar huecos sin volver a la base de datos.
+        """
+        from JobManagement.services.interval_index import MachineIntervalIndex
+
+        filtro = Q(operador_id=operador_id)
+        if maquina_id:
+            filtro |= Q(item_ruta__maquina_id=maquina_id)
+        asignaciones = AsignacionOperador.objects.filter(filtro, fecha_fin__gt=desde)
+        if excluir_id is not None:
+            asignaciones = asignaciones.exclude(id=excluir_id)
+        return MachineIntervalIndex([
+            {'inicio': inicio, 'fin': fin}
+            for inicio, fin in asignaciones.values_list('fecha_inicio', 'fecha_fin')
+        ])
+
+    @staticmethod
+    def minutos_laborales(fecha_inicio, fecha_fin):
+        """
+        Duración de una asignación en minutos laborables del calendario de TimeCalculator. Una
+        asignación que cae entera fuera del horario conserva su duración de reloj.
+        """
+        from JobManagement.services.time_calculations import TimeCalculator
+
+        minutos = TimeCalculator.get_calendar().minutos_entre(
+            TimeCalculator.a_hora_local(fecha_inicio), TimeCalculator.a_hora_local(fecha_fin)
+        )
+        return minutos or (fecha_fin - fecha_inicio).total_seconds() / 60
+
+    @staticmethod
+    def siguiente_hueco(indices, desde, minutos):
+        """
+        Primer tramo (inicio, fin) con inicio >= desde que cubre 'minutos' laborables del horario
+        de TimeCalculator (el término se calcula con el calendario, saltando colaciones, noches y
+        feriados) y en el que todos los índices quedan libres de inicio a fin. Cada vuelta salta
+        al menos un bloque ocupado, por lo que el número de vueltas está acotado por el tamaño
+        de los índices.
+        """
+        from JobManagement.services.time_calculations import TimeCalculator
+
+        calendario = TimeCalculator.get_calendar()
+        con_zona = timezone.is_aware(desde)
+
+        def tramo(candidato):
+            inicio = calendario.ajustar_inicio(TimeCalculator.a_hora_local(candidato))
+            fin = calendario.sumar_minutos(inicio, minutos)
+            if con_zona:
+                return timezone.make_aware(inicio), timezone.make_aware(fin)
+            return inicio, fin
+
+        candidato = desde
+        for _ in range(sum(len(indice.bloques_inicio) for indice in indices) + 2):
+            inicio, fin = tramo(candidato)
+            candidato = max(indice.siguiente_hueco(inicio, fin - inicio) for indice in indices)
+            if candidato == inicio:
+                return inicio, fin
+
+        # No debería alcanzarse: después del último bloque siempre hay hueco
+        return tramo(max([candidato] + [indice.bloques_fin[-1] for indice in indices if indice.bloques_fin]))
+
     def ajustar_fechas_por_conflictos(self):
         """Ajusta las fechas de la asignación en caso de conflictos"""
-        duracion = self.fecha_fin - self.fecha_inicio
-        fecha_inicio_propuesta = self.fecha_inicio
-        fecha_fin_propuesta = self.fecha_fin
-        
-        while True:
-            # Verificar superposición con otras asignaciones del operador
-            superposicion_operador = AsignacionOperador.objects.filter(
-                operador=self.operador,
-                fecha_inicio__lt=fecha_fin_propuesta,
-                fecha_fin__gt=fecha_inicio_propuesta
-            ).exclude(id=self.id).order_by('fecha_inicio')
-
-            # Verificar superposición con otras asignaciones de la máquina
-            superposicion_maquina = AsignacionOperador.objects.filter(
-                item_ruta__maquina=self.item_ruta.maquina,
-                fecha_inicio__lt=fecha_fin_propuesta,
-                fecha_fin__gt=fecha_inicio_propuesta
-            ).exclude(id=self.id).order_by('fecha_inicio')
-
-            if not superposicion_operador.exists() and not superposicion_maquina.exists():
-                # No hay conflictos, usar estas fechas
-                self.fecha_inicio = fecha_inicio_propuesta
-                self.fecha_fin = fecha_fin_propuesta
-                break
-
-            # Encontrar la última fecha de fin entre todas las superposiciones
-            ultima_fecha_fin = None
-            if superposicion_operador.exists():
-                ultima_fecha_fin = superposicion_operador.last().fecha_fin
-
-            if superposicion_maquina.exists():
-                fecha_fin_maquina = superposicion_maquina.last().fecha_fin
-                if ultima_fecha_fin is None or fecha_fin_maquina > ultima_fecha_fin:
-                    ultima_fecha_fin = fecha_fin_maquina
-
-            # Ajustar las fechas para el siguiente intervalo disponible
-            fecha_inicio_propuesta = ultima_fecha_fin
-            fecha_fin_propuesta = fecha_inicio_propuesta + duracion
-
-            # Ajustar por horario laboral (8:00 - 18:00)
-            hora_inicio = fecha_inicio_propuesta.hour
-            if hora_inicio < 8:
-                fecha_inicio_propuesta = fecha_inicio_propuesta.replace(hour=8, minute=0)
-                fecha_fin_propuesta = fecha_inicio_propuesta + duracion
-            elif hora_inicio >= 18:
-                # Mover al siguiente día laboral
-                fecha_inicio_propuesta = (fecha_inicio_propuesta + timedelta(days=1)).replace(hour=8, minute=0)
-                fecha_fin_propuesta = fecha_inicio_propuesta + duracion
-
-            # Si la fecha propuesta es después de la hora de almuerzo (13:00-14:00)
-            if 13 <= fecha_inicio_propuesta.hour < 14:
-                fecha_inicio_propuesta = fecha_inicio_propuesta.replace(hour=14, minute=0)
-                fecha_fin_propuesta = fecha_inicio_propuesta + duracion
+        if settings.USE_TZ and timezone.is_naive(self.fecha_inicio):
+            self.fecha_inicio = timezone.make_aware(self.fecha_inicio)
+            self.fecha_fin = timezone.make_aware(self.fecha_fin)
+        indice = self.indice_ocupacion(
+            self.operador_id,
+            self.item_ruta.maquina_id,
+            self.fecha_inicio,
+            excluir_id=self.id
+        )
+        if not indice.tiene_conflicto(self.fecha_inicio, self.fecha_fin):
+            return
 
-    @staticmethod
-    def encontrar_siguiente_horario_disponible(operador, maquina, fecha_inicio, duracion_horas):
-        """Encuentra el siguiente horario disponible para una asignación"""
-        fecha_propuesta = fecha_inicio
-        duracion = timedelta(hours=duracion_horas)
-        
-        while True:
-            fecha_fin_propuesta = fecha_propuesta + duracion
-            
-            # Verificar disponibilidad del operador y la máquina
-            superposicion = AsignacionOperador.objects.filter(
-            Q(operador=operador, fecha_inicio__lt=fecha_fin_propuesta, fecha_fin__gt=fecha_propuesta) |
-            Q(item_ruta__maquina=maquina, fecha_inicio__lt=fecha_fin_propuesta, fecha_fin__gt=fecha_propuesta)
-            ).order_by('fecha_fin')
-
-            if not superposicion.exists():
-                # Ajustar por horario laboral
-                hora = fecha_propuesta.hour
-                if hora < 8:
-                    fecha_propuesta = fecha_propuesta.replace(hour=8, minute=0)
-                elif hora >= 18:
-                    fecha_propuesta = (fecha_propuesta + timedelta(days=1)).replace(hour=8, minute=0)
-                elif 13 <= hora < 14:
-                    fecha_propuesta = fecha_propuesta.replace(hour=14, minute=0)
-                else:
-                    return fecha_propuesta
-            else:
-                fecha_propuesta = superposicion.last().fecha_fin
-
-            # Verificar si la nueva fecha propuesta respeta el horario laboral
-            if fecha_propuesta.hour >= 18:
-                fecha_propuesta = (fecha_propuesta + timedelta(days=1)).replace(hour=8, minute=0)
+        self.fecha_inicio, self.fecha_fin = self.siguiente_hueco(
+            [indice], self.fecha_inicio, self.minutos_laborales(self.fecha_inicio, self.fecha_fin)
+        )
 
-    def recalcular_asignaciones_posteriores(self):
-        """Recalcula las fechas de las asignaciones posteriores cuando se modifica una asignacion"""
-        # Obtener todas las asignaciones posteriores del mismo operador, ordenadas por prioridad de OT
-        asignaciones_posteriores = AsignacionOperador.objects.filter(
-            operador=self.operador,
-            fecha_inicio__gt=self.fecha_inicio
-        ).select_related(
-            'item_ruta__orden_trabajo',
-            'programa'
-        ).order_by(
-            'item_ruta__orden_trabajo__prioridad',
-            'item_ruta__item'
+    @staticmethod
+    def encontrar_siguiente_horario_disponible(operador, maquina, fecha_inicio, duracion_horas, excluir_id=None):
+        """Encuentra el siguiente horario disponible para una asignación de duracion_horas laborables"""
+        if settings.USE_TZ and timezone.is_naive(fecha_inicio):
+            fecha_inicio = timezone.make_aware(fecha_inicio)
+        indice = AsignacionOperador.indice_ocupacion(
+            operador.id,
+            maquina.id if maquina else None,
+            fecha_inicio,
+            excluir_id=excluir_id
         )
+        inicio, _ = AsignacionOperador.siguiente_hueco([indice], fecha_inicio, duracion_horas * 60)
+        return inicio
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._valores_originales = (
+            instancia.__dict__.get('operador_id'),
+            instancia.__dict__.get('fecha_inicio'),
+            instancia.__dict__.get('fecha_fin')
+        )
+        return instancia
 
-        fecha_anterior = self.fecha_fin
-        for asignacion in asignaciones_posteriores:
-            # Calcular la duración original de la asignacion
-            duracion = asignacion.fecha_fin - asignacion.fecha_inicio
-            
-            # Encontrar el siguiente horario disponible
-            nueva_fecha_inicio = self.encontrar_siguiente_horario_disponible(
-                asignacion.operador,
-                asignacion.item_ruta.maquina,
-                fecha_anterior,
-                duracion.total_seconds() / 3600
-            )
+    @property
+    def has_changed(self):
+        """Indica si cambió el operador o las fechas respecto de lo leído de la base de datos"""
+        originales = getattr(self, '_valores_originales', None)
+        return originales is None or originales != (self.operador_id, self.fecha_inicio, self.fecha_fin)
 
-            # Actualizar las fechas
-            asignacion.fecha_inicio = nueva_fecha_inicio
-            asignacion.fecha_fin = nueva_fecha_inicio + duracion
-            asignacion.save()
-
-            # Recalcular los procesos subsiguientes de la misma OT
-            self.recalcular_procesos_subsiguientes(asignacion)
-
-            fecha_anterior = asignacion.fecha_fin
-
-    def recalcular_procesos_subsiguientes(self, asignacion):
-        """Recalcula las fechas de los procesos que siguen después del proceso actual en la misma OT"""
-        procesos_siguientes = ItemRuta.objects.filter(
-            orden_trabajo=asignacion.item_ruta.orden_trabajo,
-            item__gt=asignacion.item_ruta.item
-        ).order_by('item')
-
-        fecha_inicio = asignacion.fecha_fin
-        for proceso in procesos_siguientes:
-            # Buscar si el proceso tiene una asignación
-            try:
-                asig_proceso = AsignacionOperador.objects.get(
-                    item_ruta=proceso,
-                    programa=asignacion.programa
-                )
-                # Actualizar las fechas de la asignación
-                asig_proceso.fecha_inicio = fecha_inicio
-                asig_proceso.fecha_fin = fecha_inicio + (asig_proceso.fecha_fin - asig_proceso.fecha_inicio)
-                asig_proceso.save()
-                fecha_inicio = asig_proceso.fecha_fin
-            except AsignacionOperador.DoesNotExist:
-                continue
+    def recalcular_asignaciones_posteriores(self):
+        """
+        Agenda el recálculo de las asignaciones posteriores del operador. Se ejecuta una sola vez
+        por transacción, al confirmarla, junto con las demás asignaciones modificadas en ella.
+        """
+        from .services import programar_recalculo
+        programar_recalculo([self])
 
     def save(self, *args, **kwargs):
         is_new = self._state.adding
@@ -246,6 +216,7 @@ class AsignacionOperador(models.Model):
         #Solo recalcular si es una nueva asignacion o si las fechas cambiaron
         if is_new or self.has_changed:
             self.recalcular_asignaciones_posteriores()
+        self._valores_originales = (self.operador_id, self.fecha_inicio, self.fecha_fin)
 
     def __str__(self):
         return f"{self.operador.nombre} - {self.item_ruta} ({self.fecha_inicio})"
\ No newline at end of file
@@ -0,0 +1,403 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from JobManagement.models import ItemRuta, ProgramaOrdenTrabajo, SnapshotProgramacion
+from JobManagement.services.interval_index import MachineIntervalIndex
+from JobManagement.services.operator_availability import OperatorAvailability
+from JobManagement.services.transaction_batch import LoteTransaccion
+from .models import AsignacionOperador
+
+logger = logging.getLogger(__name__)
+
+# Costo de un par proceso-operador imposible (no habilitado u ocupado)
+COSTO_IMPOSIBLE = 1e12
+
+# Asignaciones modificadas en la transacción actual cuyas posteriores se deben recalcular
+_recalculos = LoteTransaccion('recalculo_asignaciones', lambda ids: AssignmentCascade().recalcular(ids))
+
+
+def programar_recalculo(asignaciones):
+    """
+    Agenda el recálculo de las asignaciones posteriores para cuando se confirme la transacción.
+    Todas las asignaciones modificadas en la misma transacción se recalculan juntas una sola vez;
+    las de una transacción revertida se descartan con ella.
+    """
+    _recalculos.agregar(asignacion.id for asignacion in asignaciones)
+
+
+def resolver_asignacion(costos):
+    """
+    Asignación de costo mínimo (método húngaro) para una matriz filas x columnas.
+    Cada fila recibe a lo más una columna distinta. Retorna la lista de pares (fila, columna)
+    asignados, omitiendo los que tienen COSTO_IMPOSIBLE.
+    """
+    costos = np.asarray(costos, dtype=np.float64)
+    if not costos.size:
+        return []
+    transpuesta = costos.shape[0] > costos.shape[1]
+    if transpuesta:
+        costos = costos.T
+
+    n, m = costos.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    asignada = np.zeros(m + 1, dtype=np.int64)  # asignada[j] = fila (1..n) de la columna j
+    camino = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        asignada[0] = i
+        j0 = 0
+        minimo = np.full(m + 1, np.inf)
+        usada = np.zeros(m + 1, dtype=bool)
+        while True:
+            usada[j0] = True
+            i0 = asignada[j0]
+            libres = ~usada[1:]
+            reducido = costos[i0 - 1] - u[i0] - v[1:]
+            mejora = libres & (reducido < minimo[1:])
+            minimo[1:][mejora] = reducido[mejora]
+            camino[1:][mejora] = j0
+            candidatos = np.where(libres, minimo[1:], np.inf)
+            j1 = int(np.argmin(candidatos)) + 1
+            delta = candidatos[j1 - 1]
+            u[asignada[usada]] += delta
+            v[usada] -= delta
+            minimo[1:][libres] -= delta
+            j0 = j1
+            if asignada[j0] == 0:
+                break
+        while j0:
+            j1 = camino[j0]
+            asignada[j0] = asignada[j1]
+            j0 = j1
+
+    pares = []
+    for j in range(1, m + 1):
+        if asignada[j]:
+            fila, columna = asignada[j] - 1, j - 1
+            if costos[fila, columna] < COSTO_IMPOSIBLE:
+                pares.append((columna, fila) if transpuesta else (fila, columna))
+    return sorted(pares)
+
+
+class OperatorAssignmentSolver:
+    """
+    Asigna en lote operadores a los procesos sin asignar de un programa.
+
+    Resuelve rondas de asignación de costo mínimo entre los procesos pendientes y los
+    operadores: en cada ronda un operador recibe a lo más un proceso, solo si está habilitado
+    para la máquina y libre durante todo el tramo del proceso, y el costo favorece a los
+    operadores con menos carga (y menos habilitaciones, para dejar libres a los polivalentes).
+    Las asignaciones de una ronda quedan reservadas para las siguientes, hasta que no se
+    pueda asignar nada más.
+    """
+
+    PESO_HABILITACIONES = 1.0  # minutos equivalentes por máquina habilitada
+
+    def tramos_programa(self, routes_data):
+        """{item_ruta_id: (inicio, fin)} a partir de los items del timeline del programa"""
+        tramos = {}
+        for item in routes_data.get('items', []):
+            proceso_id = str(item.get('proceso_id', ''))
+            if not proceso_id.startswith('proc_'):
+                continue
+            item_ruta_id = int(proceso_id[len('proc_'):])
+            inicio = datetime.strptime(item['start_time'], '%Y-%m-%d %H:%M:%S')
+            fin = datetime.strptime(item['end_time'], '%Y-%m-%d %H:%M:%S')
+            if item_ruta_id in tramos:
+                inicio = min(inicio, tramos[item_ruta_id][0])
+                fin = max(fin, tramos[item_ruta_id][1])
+            tramos[item_ruta_id] = (inicio, fin)
+        return tramos
+
+    def resolver(self, programa, tramos, usuario=None, aplicar=True):
+        """
+        Asigna operadores a los procesos del programa que no tienen uno.
+        tramos: {item_ruta_id: (inicio, fin)} en hora local. Con aplicar=False solo propone.
+        """
+        asignados = set(AsignacionOperador.objects.filter(
+            programa=programa
+        ).values_list('item_ruta_id', flat=True))
+        items = {
+            item.id: item
+            for item in ItemRuta.objects.filter(
+                id__in=[item_ruta_id for item_ruta_id in tramos if item_ruta_id not in asignados]
+            ).select_related('maquina', 'proceso', 'ruta__orden_trabajo')
+        }
+
+        pendientes = []
+        sin_asignar = []
+        for item_ruta_id, item in items.items():
+            inicio, fin = tramos[item_ruta_id]
+            if not item.maquina_id or not inicio < fin:
+                sin_asignar.append({'item_ruta_id': item_ruta_id, 'motivo': 'Proceso sin máquina o sin tramo programado'})
+                continue
+            pendientes.append((inicio, fin, item))
+        pendientes.sort(key=lambda p: (p[0], p[2].id))
+
+        if not pendientes:
+            return {'asignaciones': [], 'sin_asignar': sin_asignar}
+
+        disponibilidad = OperatorAvailability.cargar(
+            {item.maquina_id for _, _, item in pendientes},
+            min(inicio for inicio, _, _ in pendientes)
+        )
+        operadores = sorted({
+            operador_id
+            for _, _, item in pendientes
+            for operador_id in disponibilidad.candidatos(item.maquina_id)
+        })
+        habilitaciones = {operador_id: 0 for operador_id in operadores}
+        for candidatos in disponibilidad.habilitados.values():
+            for operador_id in candidatos:
+                if operador_id in habilitaciones:
+                    habilitaciones[operador_id] += 1
+
+        propuestas = []
+        while pendientes and operadores:
+            costos = np.full((len(pendientes), len(operadores)), COSTO_IMPOSIBLE)
+            for fila, (inicio, fin, item) in enumerate(pendientes):
+                for operador_id in disponibilidad.candidatos(item.maquina_id):
+                    if disponibilidad.conflicto(operador_id, inicio, fin) is None:
+                        costos[fila, operadores.index(operador_id)] = (
+                            disponibilidad.minutos_asignados[operador_id]
+                            + self.PESO_HABILITACIONES * habilitaciones[operador_id]
+                        )
+
+            pares = resolver_asignacion(costos)
+            if not pares:
+                break
+            asignadas = set()
+            for fila, columna in pares:
+                inicio, fin, item = pendientes[fila]
+                operador_id = operadores[columna]
+                # Dos procesos de la misma ronda no comparten operador, pero se revalida igual
+                if disponibilidad.conflicto(operador_id, inicio, fin) is not None:
+                    continue
+                disponibilidad.reservar(operador_id, inicio, fin)
+                propuestas.append((item, operador_id, inicio, fin))
+                asignadas.add(fila)
+            if not asignadas:
+                break
+            pendientes = [p for fila, p in enumerate(pendientes) if fila not in asignadas]
+
+        for _, _, item in pendientes:
+            sin_asignar.append({
+                'item_ruta_id': item.id,
+                'motivo': 'Sin operador habilitado y libre en el tramo programado'
+            })
+
+        if aplicar and propuestas:
+            with transaction.atomic():
+                AsignacionOperador.objects.bulk_create([
+                    AsignacionOperador(
+                        operador_id=operador_id,
+                        item_ruta=item,
+                        programa=programa,
+                        fecha_inicio=timezone.make_aware(inicio),
+                        fecha_fin=timezone.make_aware(fin),
+                        asignado_por=usuario
+                    )
+                    for item, operador_id, inicio, fin in propuestas
+                ])
+                # bulk_create no emite señales: invalidar lo que depende de las asignaciones
+                SnapshotProgramacion.invalidar([programa.id])
+                from JobManagement.services.machine_occupancy import programar_actualizacion
+                programar_actualizacion({item.maquina_id for item, _, _, _ in propuestas})
+
+        return {
+            'asignaciones': [
+                {
+                    'item_ruta_id': item.id,
+                    'orden_trabajo': item.ruta.orden_trabajo.codigo_ot,
+                    'proceso': item.proceso.descripcion if item.proceso else None,
+                    'maquina': item.maquina.codigo_maquina,
+                    'operador_id': operador_id,
+                    'operador_nombre': disponibilidad.nombres.get(operador_id),
+                    'fecha_inicio': inicio.strftime('%Y-%m-%d %H:%M'),
+                    'fecha_fin': fin.strftime('%Y-%m-%d %H:%M')
+                }
+                for item, operador_id, inicio, fin in propuestas
+            ],
+            'sin_asignar': sin_asignar
+        }
+
+
+class AssignmentCascade:
+    """
+    Recalcula en un solo lote las asignaciones afectadas por cambios en otras.
+
+    Las asignaciones modificadas quedan fijas. Las posteriores de cada operador se vuelven a
+    encadenar desde la primera modificada, en orden de prioridad de la OT, buscando huecos en
+    el horario laboral que no choquen con otras asignaciones de la máquina ni con las fijas
+    del operador. Después, los procesos siguientes de la misma OT en el programa se desplazan
+    para no comenzar antes de que termine el anterior. Todo se calcula en memoria y se guarda
+    con un único bulk_update (sin volver a disparar la cascada).
+    """
+
+    def recalcular(self, ancla_ids):
+        """Retorna la cantidad de asignaciones cuyas fechas cambiaron"""
+        anclas = list(AsignacionOperador.objects.filter(id__in=ancla_ids).only(
+            'id', 'operador_id', 'fecha_inicio', 'fecha_fin'
+        ))
+        if not anclas:
+            return 0
+        desde = min(ancla.fecha_inicio for ancla in anclas)
+        fijas = {ancla.id for ancla in anclas}
+
+        asignaciones = {
+            asignacion.id: asignacion
+            for asignacion in AsignacionOperador.objects.filter(
+                operador_id__in={ancla.operador_id for ancla in anclas},
+                fecha_fin__gt=desde
+            ).select_related('item_ruta__ruta')
+        }
+        prioridades = {
+            (programa_id, orden_trabajo_id): prioridad
+            for programa_id, orden_trabajo_id, prioridad in ProgramaOrdenTrabajo.objects.filter(
+                programa_id__in={a.programa_id for a in asignaciones.values()}
+            ).values_list('programa_id', 'orden_trabajo_id', 'prioridad')
+        }
+
+        # Asignaciones a mover por operador, a partir de su primera asignación modificada
+        por_operador = {}
+        for operador_id in sorted({ancla.operador_id for ancla in anclas}):
+            propias = [a for a in asignaciones.values() if a.operador_id == operador_id]
+            ancla = min((a for a in propias if a.id in fijas), key=lambda a: (a.fecha_inicio, a.id))
+            mover = [a for a in propias if a.id not in fijas and a.fecha_inicio > ancla.fecha_inicio]
+            mover.sort(key=lambda a: (
+                prioridades.get((a.programa_id, a.item_ruta.ruta.orden_trabajo_id), float('inf')),
+                a.item_ruta.item,
+                a.fecha_inicio
+            ))
+            por_operador[operador_id] = (ancla, [a for a in propias if a.id in fijas], mover)
+
+        movidas = {a.id for _, _, mover in por_operador.values() for a in mover}
+        ocupacion_maquina = defaultdict(list)
+        for maquina_id, inicio, fin in AsignacionOperador.objects.filter(
+            item_ruta__maquina_id__in={a.item_ruta.maquina_id for a in asignaciones.values()},
+            fecha_fin__gt=desde
+        ).exclude(id__in=movidas).values_list('item_ruta__maquina_id', 'fecha_inicio', 'fecha_fin'):
+            ocupacion_maquina[maquina_id].append({'inicio': inicio, 'fin': fin})
+
+        cambiadas = {}
+        for operador_id, (ancla, propias_fijas, mover) in por_operador.items():
+            indice_fijas = MachineIntervalIndex([{'inicio': a.fecha_inicio, 'fin': a.fecha_fin} for a in propias_fijas])
+            indices_maquina = {
+                maquina_id: MachineIntervalIndex(ocupacion_maquina[maquina_id])
+                for maquina_id in {a.item_ruta.maquina_id for a in mover}
+            }
+            anterior = ancla.fecha_fin
+            for asignacion in mover:
+                inicio, fin = AsignacionOperador.siguiente_hueco(
+                    [indices_maquina[asignacion.item_ruta.maquina_id], indice_fijas],
+                    anterior,
+                    AsignacionOperador.minutos_laborales(asignacion.fecha_inicio, asignacion.fecha_fin)
+                )
+                if (inicio, fin) != (asignacion.fecha_inicio, asignacion.fecha_fin):
+                    asignacion.fecha_inicio, asignacion.fecha_fin = inicio, fin
+                    cambiadas[asignacion.id] = asignacion
+                # Las asignaciones de los siguientes operadores del lote deben respetar esta
+                ocupacion_maquina[asignacion.item_ruta.maquina_id].append(
+                    {'inicio': asignacion.fecha_inicio, 'fin': asignacion.fecha_fin}
+                )
+                anterior = asignacion.fecha_fin
+
+        self._desplazar_procesos_siguientes(cambiadas, asignaciones, fijas)
+        if not cambiadas:
+            return 0
+
+        with transaction.atomic():
+            AsignacionOperador.objects.bulk_update(
+                list(cambiadas.values()), ['fecha_inicio', 'fecha_fin'], batch_size=500
+            )
+            # bulk_update no emite señales: invalidar lo que depende de las asignaciones
+            SnapshotProgramacion.invalidar({a.programa_id for a in cambiadas.values()})
+            from JobManagement.services.machine_occupancy import programar_actualizacion
+            programar_actualizacion({a.item_ruta.maquina_id for a in cambiadas.values()})
+        logger.info("%s asignaciones recalculadas", len(cambiadas))
+        return len(cambiadas)
+
+    def _desplazar_procesos_siguientes(self, cambiadas, asignaciones, fijas):
+        """
+        Ningún proceso de la OT comienza antes de que termine el anterior en el mismo programa.
+        Los procesos desplazados buscan un hueco libre para su operador y su máquina.
+        """
+        iniciales = set(cambiadas) | fijas
+        origenes = [asignaciones[i] for i in iniciales if i in asignaciones]
+        if not origenes:
+            return
+        cadenas = defaultdict(list)
+        for asignacion in AsignacionOperador.objects.filter(
+            programa_id__in={a.programa_id for a in origenes},
+            item_ruta__ruta_id__in={a.item_ruta.ruta_id for a in origenes}
+        ).select_related('item_ruta__ruta'):
+            # Usar las instancias ya modificadas en memoria
+            asignacion = cambiadas.get(asignacion.id, asignaciones.get(asignacion.id, asignacion))
+            cadenas[(asignacion.programa_id, asignacion.item_ruta.ruta_id)].append(asignacion)
+
+        # Ocupación de los operadores y máquinas de las cadenas, con las fechas ya recalculadas,
+        # agrupada una sola vez por operador y por máquina
+        en_cadenas = [a for cadena in cadenas.values() for a in cadena]
+        ocupacion = defaultdict(dict)  # ('operador' | 'maquina', id) -> {asignacion_id: (inicio, fin)}
+
+        def ocupar(asignacion_id, operador_id, maquina_id, inicio, fin):
+            ocupacion[('operador', operador_id)][asignacion_id] = (inicio, fin)
+            ocupacion[('maquina', maquina_id)][asignacion_id] = (inicio, fin)
+
+        for fila in AsignacionOperador.objects.filter(
+            Q(operador_id__in={a.operador_id for a in en_cadenas}) |
+            Q(item_ruta__maquina_id__in={a.item_ruta.maquina_id for a in en_cadenas}),
+            fecha_fin__gt=min(a.fecha_inicio for a in origenes)
+        ).exclude(
+            id__in={a.id for a in cambiadas.values()} | {a.id for a in en_cadenas}
+        ).values_list('id', 'operador_id', 'item_ruta__maquina_id', 'fecha_inicio', 'fecha_fin'):
+            ocupar(*fila)
+        for asignacion in {a.id: a for a in list(cambiadas.values()) + en_cadenas}.values():
+            ocupar(asignacion.id, asignacion.operador_id, asignacion.item_ruta.maquina_id,
+                   asignacion.fecha_inicio, asignacion.fecha_fin)
+
+        # Índice por operador y por máquina; al mover una asignación solo se descartan los dos
+        # índices que la contienen, que se reconstruyen cuando se vuelven a consultar
+        indices = {}
+
+        def indice(clave):
+            if clave not in indices:
+                indices[clave] = MachineIntervalIndex([
+                    {'inicio': inicio, 'fin': fin} for inicio, fin in ocupacion[clave].values()
+                ])
+            return indices[clave]
+
+        def claves(asignacion):
+            return ('operador', asignacion.operador_id), ('maquina', asignacion.item_ruta.maquina_id)
+
+        for cadena in cadenas.values():
+            cadena.sort(key=lambda a: a.item_ruta.item)
+            # Los procesos movibles de la cadena no bloquean a los anteriores: se vuelven a ocupar
+            # recién cuando su posición queda decidida
+            for asignacion in cadena:
+                if asignacion.id not in fijas:
+                    for clave in claves(asignacion):
+                        del ocupacion[clave][asignacion.id]
+                        indices.pop(clave, None)
+
+            fin_anterior = None
+            afectada = False
+            for asignacion in cadena:
+                afectada = afectada or asignacion.id in iniciales
+                if afectada and asignacion.id not in fijas and fin_anterior and asignacion.fecha_inicio < fin_anterior:
+                    minutos = AsignacionOperador.minutos_laborales(asignacion.fecha_inicio, asignacion.fecha_fin)
+                    asignacion.fecha_inicio, asignacion.fecha_fin = AsignacionOperador.siguiente_hueco(
+                        [indice(clave) for clave in claves(asignacion)], fin_anterior, minutos
+                    )
+                    cambiadas[asignacion.id] = asignacion
+                if asignacion.id not in fijas:
+                    for clave in claves(asignacion):
+                        ocupacion[clave][asignacion.id] = (asignacion.fecha_inicio, asignacion.fecha_fin)
+                        indices.pop(clave, None)
+                fin_anterior = asignacion.fecha_fin
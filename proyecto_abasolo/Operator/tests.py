@@ -1,3 +1,302 @@
-from django.test import TestCase
+import random
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from unittest.mock import patch
 
-# Create your tests here.
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from JobManagement.models import (
+    EmpresaOT, ItemRuta, Maquina, OrdenTrabajo, Proceso, ProgramaOrdenTrabajo, ProgramaProduccion, RutaOT,
+    SituacionOT, TipoOT
+)
+from .models import AsignacionOperador, Operador, OperadorMaquina
+from .services import AssignmentCascade, COSTO_IMPOSIBLE, OperatorAssignmentSolver, resolver_asignacion
+
+
+def _costo_optimo(costos):
+    """Mínimo de la asignación completa por programación dinámica sobre subconjuntos de columnas"""
+    if len(costos) > len(costos[0]):
+        costos = [list(columna) for columna in zip(*costos)]
+    filas, columnas = len(costos), len(costos[0])
+
+    @lru_cache(maxsize=None)
+    def mejor(fila, usadas):
+        if fila == filas:
+            return 0
+        return min(
+            costos[fila][j] + mejor(fila + 1, usadas | (1 << j))
+            for j in range(columnas) if not usadas & (1 << j)
+        )
+
+    return mejor(0, 0)
+
+
+class ResolverAsignacionTests(SimpleTestCase):
+
+    def test_igual_al_optimo_exhaustivo(self):
+        rnd = random.Random(2)
+        for imposibles in (0.0, 0.4):
+            for _ in range(300):
+                filas, columnas = rnd.randrange(1, 7), rnd.randrange(1, 7)
+                costos = [
+                    [COSTO_IMPOSIBLE if rnd.random() < imposibles else rnd.randrange(50) for _ in range(columnas)]
+                    for _ in range(filas)
+                ]
+                pares = resolver_asignacion(costos)
+
+                self.assertEqual(pares, sorted(pares))
+                self.assertEqual(len({i for i, _ in pares}), len(pares))
+                self.assertEqual(len({j for _, j in pares}), len(pares))
+                self.assertTrue(all(costos[i][j] < COSTO_IMPOSIBLE for i, j in pares))
+                # Los pares omitidos son los imposibles que la asignación completa no pudo evitar
+                omitidos = min(filas, columnas) - len(pares)
+                self.assertEqual(
+                    sum(costos[i][j] for i, j in pares) + omitidos * COSTO_IMPOSIBLE,
+                    _costo_optimo(costos)
+                )
+
+    def test_casos_borde(self):
+        self.assertEqual(resolver_asignacion([]), [])
+        self.assertEqual(resolver_asignacion([[COSTO_IMPOSIBLE]]), [])
+        self.assertEqual(resolver_asignacion([[5, 1, 3]]), [(0, 1)])
+        self.assertEqual(resolver_asignacion([[5], [1], [3]]), [(1, 0)])
+
+
+def _crear_escenario(prueba):
+    """Tres OTs de un proceso en M1, M2 y M3; Ana opera M1 y M2, Luis solo M2 y nadie M3"""
+    empresa = EmpresaOT.objects.create(nombre='Empresa', apodo='E', codigo_empresa='E1')
+    tipo = TipoOT.objects.create(codigo_tipo_ot='VE')
+    situacion = SituacionOT.objects.create(codigo_situacion_ot='P')
+    proceso = Proceso.objects.create(codigo_proceso='PR', descripcion='Proceso', empresa=empresa)
+    prueba.programa = ProgramaProduccion.objects.create(
+        nombre='Programa', fecha_inicio=date(2025, 3, 3), fecha_fin=date(2025, 3, 3)
+    )
+    prueba.maquinas = {
+        codigo: Maquina.objects.create(codigo_maquina=codigo, descripcion=codigo, empresa=empresa)
+        for codigo in ('M1', 'M2', 'M3')
+    }
+    prueba.items = {}
+    for k, codigo in enumerate(('M1', 'M2', 'M3'), start=1):
+        ot = OrdenTrabajo.objects.create(
+            codigo_ot=k, tipo_ot=tipo, situacion_ot=situacion, item_nota_venta=1,
+            descripcion_producto_ot=f'Producto {k}', empresa=empresa
+        )
+        prueba.items[codigo] = ItemRuta.objects.create(
+            ruta=RutaOT.objects.create(orden_trabajo=ot), item=1, maquina=prueba.maquinas[codigo],
+            proceso=proceso, cantidad_pedido=100, estandar=50
+        )
+
+    prueba.ana = Operador.objects.create(nombre='Ana', rut='11.111.111-1', empresa=empresa)
+    prueba.luis = Operador.objects.create(nombre='Luis', rut='22.222.222-2', empresa=empresa)
+    for operador, codigos in ((prueba.ana, ('M1', 'M2')), (prueba.luis, ('M2',))):
+        for codigo in codigos:
+            OperadorMaquina.objects.create(operador=operador, maquina=prueba.maquinas[codigo])
+
+    inicio = datetime(2025, 3, 3, 7, 45)
+    prueba.tramos = {item.id: (inicio, inicio + timedelta(hours=2)) for item in prueba.items.values()}
+
+
+class OperatorAssignmentSolverTests(TestCase):
+    """Asignación en lote de los procesos de un programa"""
+
+    def setUp(self):
+        _crear_escenario(self)
+
+    def test_procesos_simultaneos_reciben_operadores_distintos(self):
+        resultado = OperatorAssignmentSolver().resolver(self.programa, self.tramos, aplicar=False)
+
+        asignados = {a['maquina']: a['operador_nombre'] for a in resultado['asignaciones']}
+        self.assertEqual(asignados, {'M1': 'Ana', 'M2': 'Luis'})
+        self.assertEqual([s['item_ruta_id'] for s in resultado['sin_asignar']], [self.items['M3'].id])
+        self.assertFalse(AsignacionOperador.objects.exists())
+
+    def test_aplicar_guarda_y_no_repite(self):
+        solver = OperatorAssignmentSolver()
+        solver.resolver(self.programa, self.tramos)
+        self.assertEqual(
+            set(AsignacionOperador.objects.values_list('item_ruta__maquina__codigo_maquina', 'operador__nombre')),
+            {('M1', 'Ana'), ('M2', 'Luis')}
+        )
+
+        # Los procesos ya asignados no se vuelven a proponer
+        resultado = solver.resolver(self.programa, self.tramos, aplicar=False)
+        self.assertEqual(resultado['asignaciones'], [])
+
+    def test_operador_ocupado_en_otro_programa(self):
+        otro = ProgramaProduccion.objects.create(
+            nombre='Otro', fecha_inicio=date(2025, 3, 3), fecha_fin=date(2025, 3, 3)
+        )
+        inicio, fin = self.tramos[self.items['M2'].id]
+        AsignacionOperador.objects.bulk_create([AsignacionOperador(
+            operador=self.luis, item_ruta=self.items['M2'], programa=otro,
+            fecha_inicio=timezone.make_aware(inicio), fecha_fin=timezone.make_aware(fin)
+        )])
+
+        resultado = OperatorAssignmentSolver().resolver(self.programa, self.tramos, aplicar=False)
+        # Ana cubre M1 o M2, pero no ambas: una de las dos queda sin operador
+        self.assertEqual(len(resultado['asignaciones']), 1)
+        self.assertEqual(resultado['asignaciones'][0]['operador_nombre'], 'Ana')
+        self.assertEqual(len(resultado['sin_asignar']), 2)
+
+
+class AjusteFechasAsignacionTests(TestCase):
+    """Una asignación que choca con otra se mueve al primer hueco libre en horario laboral"""
+
+    def setUp(self):
+        _crear_escenario(self)
+
+    def _reservar(self, operador, item, desde, horas):
+        inicio = timezone.make_aware(desde)
+        AsignacionOperador.objects.bulk_create([AsignacionOperador(
+            operador=operador, item_ruta=item, programa=self.programa,
+            fecha_inicio=inicio, fecha_fin=inicio + timedelta(hours=horas)
+        )])
+
+    def _ajustar(self, operador, item, desde, horas):
+        inicio = timezone.make_aware(desde)
+        asignacion = AsignacionOperador(
+            operador=operador, item_ruta=item, programa=self.programa,
+            fecha_inicio=inicio, fecha_fin=inicio + timedelta(hours=horas)
+        )
+        asignacion.ajustar_fechas_por_conflictos()
+        return timezone.localtime(asignacion.fecha_inicio), timezone.localtime(asignacion.fecha_fin)
+
+    def test_sin_conflicto_conserva_las_fechas(self):
+        self._reservar(self.ana, self.items['M1'], datetime(2025, 3, 3, 7, 45), 2)
+        inicio, fin = self._ajustar(self.ana, self.items['M2'], datetime(2025, 3, 3, 10, 0), 1)
+        self.assertEqual((inicio.hour, inicio.minute, fin.hour), (10, 0, 11))
+
+    def test_conflicto_del_operador_y_de_la_maquina(self):
+        self._reservar(self.ana, self.items['M1'], datetime(2025, 3, 3, 7, 45), 2)
+        self._reservar(self.luis, self.items['M2'], datetime(2025, 3, 3, 9, 45), 1)
+
+        # Ana está ocupada hasta 9:45 y M2 hasta 10:45
+        inicio, fin = self._ajustar(self.ana, self.items['M2'], datetime(2025, 3, 3, 9, 0), 1)
+        self.assertEqual((inicio.hour, inicio.minute), (10, 45))
+        self.assertEqual(fin - inicio, timedelta(hours=1))
+
+    def test_conflicto_al_final_del_dia_pasa_al_siguiente_dia_laboral(self):
+        # Viernes hasta las 17:45: el siguiente inicio laboral es el lunes a las 7:45
+        self._reservar(self.ana, self.items['M1'], datetime(2025, 3, 7, 15, 45), 2)
+        inicio, _ = self._ajustar(self.ana, self.items['M1'], datetime(2025, 3, 7, 16, 0), 1)
+        self.assertEqual(inicio.date(), date(2025, 3, 10))
+        self.assertEqual((inicio.hour, inicio.minute), (7, 45))
+
+        siguiente = AsignacionOperador.encontrar_siguiente_horario_disponible(
+            self.ana, self.maquinas['M1'], datetime(2025, 3, 7, 16, 0), 1
+        )
+        self.assertEqual(timezone.localtime(siguiente), inicio)
+
+    def test_la_duracion_se_cuenta_en_horario_laboral(self):
+        self._reservar(self.ana, self.items['M1'], datetime(2025, 3, 3, 7, 45), 4.75)
+        # Una hora desde las 12:30 termina a las 14:30 por la colación
+        inicio, fin = self._ajustar(self.ana, self.items['M1'], datetime(2025, 3, 3, 9, 0), 1)
+        self.assertEqual(((inicio.hour, inicio.minute), (fin.hour, fin.minute)), ((12, 30), (14, 30)))
+
+    def test_todo_el_tramo_laboral_debe_estar_libre(self):
+        self._reservar(self.ana, self.items['M1'], datetime(2025, 3, 3, 7, 45), 4.75)
+        self._reservar(self.luis, self.items['M2'], datetime(2025, 3, 3, 14, 0), 1)
+        # De 12:30 a 13:30 hay una hora de reloj libre, pero la hora laboral termina a las 14:30
+        inicio, fin = self._ajustar(self.ana, self.items['M2'], datetime(2025, 3, 3, 9, 0), 1)
+        self.assertEqual(((inicio.hour, inicio.minute), (fin.hour, fin.minute)), ((15, 0), (16, 0)))
+
+
+class CascadaAsignacionesTests(TestCase):
+    """Al guardar una asignación las posteriores se recalculan en lote al confirmar la transacción"""
+
+    def setUp(self):
+        _crear_escenario(self)
+        lunes = datetime(2025, 3, 3)
+        # OT 1: M1 (Ana) y luego M3 (Luis); OT 2: M2 (Ana) en la tarde
+        segundo = ItemRuta.objects.create(
+            ruta=self.items['M1'].ruta, item=2, maquina=self.maquinas['M3'],
+            proceso=self.items['M1'].proceso, cantidad_pedido=100, estandar=50
+        )
+        for operador, item, desde, hasta in (
+            (self.ana, self.items['M1'], time(7, 45), time(9, 45)),
+            (self.ana, self.items['M2'], time(14, 0), time(15, 0)),
+            (self.luis, segundo, time(9, 45), time(10, 45)),
+        ):
+            AsignacionOperador.objects.bulk_create([AsignacionOperador(
+                operador=operador, item_ruta=item, programa=self.programa,
+                fecha_inicio=timezone.make_aware(datetime.combine(lunes, desde)),
+                fecha_fin=timezone.make_aware(datetime.combine(lunes, hasta))
+            )])
+        for k, ot in enumerate(OrdenTrabajo.objects.order_by('codigo_ot')[:2], start=1):
+            ProgramaOrdenTrabajo.objects.create(programa=self.programa, orden_trabajo=ot, prioridad=k)
+        self.primera, self.tarde, self.siguiente = AsignacionOperador.objects.order_by('id')
+
+    def _horas(self, asignacion):
+        asignacion.refresh_from_db()
+        return (
+            timezone.localtime(asignacion.fecha_inicio).strftime('%H:%M'),
+            timezone.localtime(asignacion.fecha_fin).strftime('%H:%M')
+        )
+
+    def test_atrasar_una_asignacion_desplaza_al_operador_y_a_la_ot(self):
+        self.primera.fecha_inicio += timedelta(hours=1)
+        self.primera.fecha_fin += timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.primera.save()
+
+        self.assertEqual(self._horas(self.primera), ('08:45', '10:45'))
+        # La siguiente del operador se encadena a continuación
+        self.assertEqual(self._horas(self.tarde), ('10:45', '11:45'))
+        # El proceso siguiente de la OT no comienza antes de que termine el anterior
+        self.assertEqual(self._horas(self.siguiente), ('10:45', '11:45'))
+
+    def test_un_solo_recalculo_por_transaccion(self):
+        with patch.object(AssignmentCascade, 'recalcular') as recalcular:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for asignacion in (self.primera, self.tarde):
+                        asignacion.fecha_fin -= timedelta(minutes=15)
+                        asignacion.save()
+        recalcular.assert_called_once_with({self.primera.id, self.tarde.id})
+
+    def test_transaccion_revertida_no_deja_recalculos_pendientes(self):
+        with patch.object(AssignmentCascade, 'recalcular') as recalcular:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(ValueError), transaction.atomic():
+                    self.primera.fecha_fin -= timedelta(minutes=15)
+                    self.primera.save()
+                    raise ValueError
+                self.tarde.fecha_fin -= timedelta(minutes=15)
+                self.tarde.save()
+        recalcular.assert_called_once_with({self.tarde.id})
+
+    def test_cadena_larga_se_desplaza_en_orden(self):
+        # Tres procesos más de la OT 1 en M3, de media hora cada uno, a continuación del segundo
+        lunes = datetime(2025, 3, 3)
+        for k, desde in enumerate((time(10, 45), time(11, 15), time(11, 45)), start=3):
+            item = ItemRuta.objects.create(
+                ruta=self.items['M1'].ruta, item=k, maquina=self.maquinas['M3'],
+                proceso=self.items['M1'].proceso, cantidad_pedido=100, estandar=200
+            )
+            inicio = timezone.make_aware(datetime.combine(lunes, desde))
+            AsignacionOperador.objects.bulk_create([AsignacionOperador(
+                operador=self.luis, item_ruta=item, programa=self.programa,
+                fecha_inicio=inicio, fecha_fin=inicio + timedelta(minutes=30)
+            )])
+        cola = list(AsignacionOperador.objects.order_by('id'))[3:]
+
+        self.primera.fecha_inicio += timedelta(hours=1)
+        self.primera.fecha_fin += timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.primera.save()
+
+        self.assertEqual(self._horas(self.siguiente), ('10:45', '11:45'))
+        # El último cruza la colación: media hora laboral termina a las 14:15
+        self.assertEqual(
+            [self._horas(a) for a in cola],
+            [('11:45', '12:15'), ('12:15', '12:45'), ('12:45', '14:15')]
+        )
+
+    def test_guardar_sin_cambios_no_recalcula(self):
+        asignacion = AsignacionOperador.objects.get(id=self.tarde.id)
+        with patch.object(AssignmentCascade, 'recalcular') as recalcular:
+            with self.captureOnCommitCallbacks(execute=True):
+                asignacion.save()
+        recalcular.assert_not_called()
@@ -14,5 +14,6 @@ urlpatterns = [
 
     #Gestión de Asignaciones
     path('api/v1/asignaciones/', views.AsignacionOperadorView.as_view(), name='asignacion-list'),
+    path('api/v1/asignaciones/automatica/<int:programa_id>/', views.AsignacionAutomaticaView.as_view(), name='asignacion-automatica'),
     path('api/v1/asignaciones/<int:pk>/', views.AsignacionOperadorDetailView.as_view(), name='asignacion-detail'),
 ]
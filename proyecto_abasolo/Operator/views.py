@@ -254,6 +254,47 @@ class AsignacionOperadorDetailView(APIView):
         asignacion.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+class AsignacionAutomaticaView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, programa_id):
+        """
+        Asigna operadores a todos los procesos sin asignar del programa en una sola operación.
+        Con {"aplicar": false} solo retorna la propuesta sin guardarla.
+        """
+        from JobManagement.models import SnapshotProgramacion
+        from JobManagement.views_files.program_views import ProgramDetailView
+        from .services import OperatorAssignmentSolver
+
+        programa = get_object_or_404(ProgramaProduccion, pk=programa_id)
+        aplicar = str(request.data.get('aplicar', True)).lower() not in ('0', 'false')
+
+        try:
+            snapshot = SnapshotProgramacion.obtener_vigente(programa)
+            if snapshot:
+                routes_data = snapshot.datos['routes_data']
+            else:
+                _, routes_data = ProgramDetailView().generar_programacion(programa)
+
+            solver = OperatorAssignmentSolver()
+            resultado = solver.resolver(
+                programa,
+                solver.tramos_programa(routes_data),
+                usuario=request.user,
+                aplicar=aplicar
+            )
+            resultado['aplicado'] = aplicar
+            return Response(
+                resultado,
+                status=status.HTTP_201_CREATED if aplicar and resultado['asignaciones'] else status.HTTP_200_OK
+            )
+
+        except Exception as e:
+            return Response(
+                {"error": f"Error al asignar operadores: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 class OperadorTareasView(APIView):
     permission_classes = [IsAuthenticated]
 
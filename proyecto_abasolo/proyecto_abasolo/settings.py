@@ -130,6 +130,21 @@ DATABASES = {
 }
 
 
+# Cache
+# 'default' sigue siendo la caché en memoria de cada proceso. 'mapa_calor' es compartida entre
+# procesos y servidores (mapa de calor de máquinas y su versión); la tabla la crea la migración
+# JobManagement 0009_tabla_cache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'mapa_calor': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cache_compartida',
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 